@@ -0,0 +1,7 @@
+"""Load tests for the checkout hot path.
+
+Run ``python -m benchmarks --help``; results are written as JSON so runs of
+different releases can be compared with ``python -m benchmarks compare``.
+Micro-benchmarks of single functions are pytest-benchmark tests in
+tests/test_benchmarks.py.
+"""
@@ -0,0 +1,109 @@
+"""Command line entry point: ``python -m benchmarks {run,seed,compare}``."""
+import argparse
+import json
+import platform
+import sqlite3
+import sys
+import time
+from . import load
+from .seed import make_app, seed
+
+
+def _run(args):
+    app = make_app(args.database)
+    database = app.config['DATABASE']
+    report = {
+        'meta': {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'database': database,
+            'url': args.url,
+        },
+    }
+    if not args.url:
+        report['fleet'] = seed(app, vehicles=args.vehicles, gas_cards=args.vehicles,
+                               users=max(args.users, args.processes), history=args.history)
+    scenarios = args.scenario or list(load.SCENARIOS)
+    report['load'] = {}
+    for scenario in scenarios:
+        report['load'][scenario] = load.run(
+            scenario, processes=args.processes, requests=args.requests,
+            fleet=args.vehicles, database=database, url=args.url,
+        )
+        print(f"{scenario:>20}: {report['load'][scenario]['throughput']:.1f} req/s, "
+              f"p50 {report['load'][scenario]['p50_ms']:.2f} ms, "
+              f"p99 {report['load'][scenario]['p99_ms']:.2f} ms", file=sys.stderr)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def _seed(args):
+    app = make_app(args.database)
+    counts = seed(app, vehicles=args.vehicles, gas_cards=args.vehicles,
+                  users=args.users, history=args.history)
+    print(json.dumps(counts))
+
+
+def _compare(args):
+    """Exit non-zero if any p99 or throughput regressed beyond the threshold."""
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = []
+    for name, old in base.get('load', {}).items():
+        cur = new.get('load', {}).get(name)
+        if not cur:
+            continue
+        if old.get('p99_ms') and cur.get('p99_ms') and cur['p99_ms'] > old['p99_ms'] * (1 + args.threshold):
+            regressions.append(f"load.{name} p99 {old['p99_ms']:.2f} -> {cur['p99_ms']:.2f} ms")
+        if old.get('throughput') and cur.get('throughput') \
+                and cur['throughput'] < old['throughput'] * (1 - args.threshold):
+            regressions.append(f"load.{name} throughput {old['throughput']:.1f} -> {cur['throughput']:.1f} req/s")
+    for line in regressions:
+        print('REGRESSION', line)
+    if not regressions:
+        print('no regressions')
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='seed a fleet and run the load scenarios')
+    run.add_argument('--database', help='SQLite file to use (default: a fresh temp file)')
+    run.add_argument('--url', help='benchmark a running server instead of the test client')
+    run.add_argument('--vehicles', type=int, default=2000)
+    run.add_argument('--users', type=int, default=500)
+    run.add_argument('--history', type=int, default=20000)
+    run.add_argument('--processes', type=int, default=4)
+    run.add_argument('--requests', type=int, default=200, help='requests per process')
+    run.add_argument('--scenario', action='append', choices=list(load.SCENARIOS))
+    run.add_argument('--out', help='write the JSON report here instead of stdout')
+    run.set_defaults(func=_run)
+
+    seed_cmd = sub.add_parser('seed', help='seed a database for benchmarking a live server')
+    seed_cmd.add_argument('--database', required=True)
+    seed_cmd.add_argument('--vehicles', type=int, default=2000)
+    seed_cmd.add_argument('--users', type=int, default=500)
+    seed_cmd.add_argument('--history', type=int, default=20000)
+    seed_cmd.set_defaults(func=_seed)
+
+    compare = sub.add_parser('compare', help='compare two JSON reports')
+    compare.add_argument('base')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown')
+    compare.set_defaults(func=_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
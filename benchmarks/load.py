@@ -0,0 +1,108 @@
+"""Multi-process load driver.
+
+Every process logs in as its own user and fires ``requests`` requests of one
+scenario, either through the Flask test client against a shared on-disk
+database or over HTTP against a running server (e.g. local gunicorn).
+Latencies are measured client-side; throughput is requests per second of
+wall time across all processes.
+"""
+import http.cookiejar
+import multiprocessing
+import random
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from .seed import USER_PASSWORD, make_app
+from .stats import summarize
+
+
+# Number of vehicles/gas cards the contention scenario fights over
+HOT_SET = 5
+
+
+def _checkout_form(rng, fleet):
+    i = rng.randrange(fleet)
+    return {'vehicle': f'B{i:05d}', 'gasCard': f'9{i:07d}', 'balance': '100'}
+
+
+SCENARIOS = {
+    'home': lambda rng, fleet: ('GET', '/', None),
+    'record_vehicle': lambda rng, fleet: ('GET', '/record/vehicle', None),
+    'record_gas': lambda rng, fleet: ('GET', '/record/gas', None),
+    'login': None,  # handled specially: needs the worker's credentials
+    'checkout': lambda rng, fleet: ('POST', '/lock/submit', _checkout_form(rng, fleet)),
+    'checkout_contention': lambda rng, fleet: ('POST', '/lock/submit', _checkout_form(rng, HOT_SET)),
+}
+
+
+class TestClient:
+    def __init__(self, database):
+        # pool workers are daemonic and cannot start the hashing pool
+        self.client = make_app(database, PASSWORD_HASH_WORKERS=0).test_client()
+
+    def request(self, method, path, data=None):
+        if method == 'GET':
+            return self.client.get(path).status_code
+        return self.client.post(path, data=data).status_code
+
+
+class HttpClient:
+    """Minimal cookie-keeping HTTP client that does not follow redirects."""
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self._NoRedirect
+        )
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def _worker(args):
+    scenario, index, requests, fleet, database, url = args
+    client = HttpClient(url) if url else TestClient(database)
+    username = f'user{index:05d}'
+    credentials = {'username': username, 'password': USER_PASSWORD}
+    client.request('POST', '/auth/login', credentials)
+    rng = random.Random(index)
+    latencies, errors = [], 0
+    started = time.time()
+    for _ in range(requests):
+        if scenario == 'login':
+            method, path, data = 'POST', '/auth/login', credentials
+        else:
+            method, path, data = SCENARIOS[scenario](rng, fleet)
+        start = time.perf_counter()
+        status = client.request(method, path, data)
+        latencies.append(time.perf_counter() - start)
+        if status >= 400:
+            errors += 1
+    return started, time.time(), latencies, errors
+
+
+def run(scenario, processes=4, requests=200, fleet=2000, database=None, url=None):
+    """Run one scenario; returns its latency/throughput summary."""
+    ctx = multiprocessing.get_context('spawn')
+    jobs = [(scenario, i, requests, fleet, database, url) for i in range(processes)]
+    with ctx.Pool(processes) as pool:
+        results = pool.map(_worker, jobs)
+    started = min(r[0] for r in results)
+    finished = max(r[1] for r in results)
+    latencies = [value for r in results for value in r[2]]
+    summary = summarize(latencies, finished - started)
+    summary['errors'] = sum(r[3] for r in results)
+    summary['processes'] = processes
+    return summary
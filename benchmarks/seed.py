@@ -0,0 +1,57 @@
+"""Synthetic fleet for benchmarks: vehicles, gas cards, users and history."""
+import os
+import random
+import tempfile
+from werkzeug.security import generate_password_hash
+from vehicles import create_app
+from vehicles.db import get_db, init_database
+
+
+USER_PASSWORD = 'bench-password'
+
+
+def make_app(path=None, **config):
+    """Create an app on a fresh on-disk database (a temp file by default)."""
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='vehicles-bench-'), 'bench.sqlite')
+    settings = {'DATABASE': path, 'SECRET_KEY': 'bench', 'SLOW_QUERY_MS': None}
+    settings.update(config)
+    return create_app(settings)
+
+
+def seed(app, vehicles=2000, gas_cards=2000, users=500, history=20000, passwords=5000, rng=None):
+    """Fill the app database with a synthetic fleet. Returns the counts."""
+    rng = rng or random.Random(42)
+    # Hash once: per-user hashing would dominate seeding time. Use the app's
+    # policy so logins measure verification, not a one-off rehash.
+    hashed = generate_password_hash(USER_PASSWORD, app.config['PASSWORD_HASH_METHOD'])
+    with app.app_context():
+        init_database()
+        db = get_db()
+        db.execute('INSERT INTO users (username, password, is_identified) VALUES (?, ?, 1)', ('admin', hashed))
+        db.executemany(
+            'INSERT INTO users (username, password, is_identified) VALUES (?, ?, 1)',
+            ((f'user{i:05d}', hashed) for i in range(users))
+        )
+        db.executemany('INSERT INTO vehicles (plate) VALUES (?)', ((f'B{i:05d}',) for i in range(vehicles)))
+        db.executemany(
+            'INSERT INTO gas_cards (card_number, balance) VALUES (?, ?)',
+            ((f'9{i:07d}', round(rng.uniform(0, 2000), 2)) for i in range(gas_cards))
+        )
+        db.executemany(
+            'INSERT INTO passwords (password) VALUES (?)',
+            ((f'{i:08d}',) for i in range(passwords))
+        )
+        db.executemany(
+            'INSERT INTO record_vehicles (vehicle_id, user_id, action) VALUES (?, ?, ?)',
+            ((rng.randint(1, vehicles), rng.randint(2, users + 1), rng.choice(('taken', 'returned')))
+             for _ in range(history))
+        )
+        db.executemany(
+            'INSERT INTO record_gas_cards (gas_card_id, user_id, action, balance) VALUES (?, ?, ?, ?)',
+            ((rng.randint(1, gas_cards), rng.randint(2, users + 1), rng.choice(('taken', 'returned')),
+              round(rng.uniform(0, 2000), 2)) for _ in range(history))
+        )
+        db.commit()
+    return {'vehicles': vehicles, 'gas_cards': gas_cards, 'users': users,
+            'history': history, 'passwords': passwords}
@@ -0,0 +1,25 @@
+"""Summary statistics for the load driver."""
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize(samples, wall_seconds=None):
+    """Latency summary in milliseconds; ``throughput`` is per second of wall time."""
+    values = sorted(samples)
+    n = len(values)
+    result = {
+        'count': n,
+        'min_ms': values[0] * 1000 if n else None,
+        'mean_ms': sum(values) / n * 1000 if n else None,
+        'p50_ms': percentile(values, 0.50) * 1000 if n else None,
+        'p99_ms': percentile(values, 0.99) * 1000 if n else None,
+        'max_ms': values[-1] * 1000 if n else None,
+    }
+    total = wall_seconds if wall_seconds is not None else sum(values)
+    result['throughput'] = n / total if total else None
+    return result
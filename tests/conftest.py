@@ -0,0 +1,69 @@
+"""Shared fixtures: an app on a fresh on-disk database with a small fleet.
+
+Users (password ``PASSWORD``): ``admin`` (id 1), ``alice`` (2) and ``bob``
+(3), all identified. Vehicles ``B00001``-``B00005`` and gas cards
+``90000001``-``90000005`` (balance 100) are returned; the pool holds ten
+temporary passwords.
+"""
+import pytest
+from werkzeug.security import generate_password_hash
+from vehicles import create_app
+from vehicles.db import get_db, init_database
+
+
+PASSWORD = 'test-password'
+USERS = ('admin', 'alice', 'bob')
+PLATES = tuple(f'B{i:05d}' for i in range(1, 6))
+CARDS = tuple(f'9{i:07d}' for i in range(1, 6))
+
+
+@pytest.fixture
+def config():
+    """Extra settings for :func:`app`; override with ``parametrize``."""
+    return {}
+
+
+@pytest.fixture
+def app(tmp_path, config):
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': str(tmp_path / 'vehicles.sqlite'),
+        'SECRET_KEY': 'test',
+        # cheap hashes, computed inline
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'PASSWORD_HASH_WORKERS': 0,
+        'TEMPLATE_BYTECODE_CACHE': False,
+        'SLOW_QUERY_MS': None,
+        **config,
+    })
+    with app.app_context():
+        init_database()
+        db = get_db()
+        hashed = generate_password_hash(PASSWORD, app.config['PASSWORD_HASH_METHOD'])
+        db.executemany('INSERT INTO users (username, password, is_identified) VALUES (?, ?, 1)',
+                       [(name, hashed) for name in USERS])
+        db.executemany('INSERT INTO vehicles (plate) VALUES (?)', [(p,) for p in PLATES])
+        db.executemany('INSERT INTO gas_cards (card_number, balance) VALUES (?, 100)', [(c,) for c in CARDS])
+        db.executemany('INSERT INTO passwords (password) VALUES (?)', [(f'{i:08d}',) for i in range(10)])
+        db.commit()
+    yield app
+    app.extensions['db_pool'].close()
+
+
+@pytest.fixture
+def db(app):
+    with app.app_context():
+        yield get_db()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    """Log ``client`` in as one of :data:`USERS`; returns the response."""
+    def login(username='alice', password=PASSWORD):
+        return client.post('/auth/login', data={'username': username, 'password': password})
+    return login
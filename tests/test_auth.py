@@ -0,0 +1,76 @@
+import pytest
+from werkzeug.middleware.proxy_fix import ProxyFix
+from vehicles import create_app, hashing
+from .conftest import PASSWORD
+
+
+def _login(client, username, password, address):
+    return client.post('/auth/login', data={'username': username, 'password': password},
+                       environ_base={'REMOTE_ADDR': address})
+
+
+def test_failures_lock_out_the_sending_address(app, client):
+    for _ in range(app.config['LOGIN_MAX_FAILURES']):
+        assert _login(client, 'alice', 'wrong', '10.0.0.1').status_code == 200
+    assert _login(client, 'alice', PASSWORD, '10.0.0.1').status_code == 429
+
+
+def test_failures_elsewhere_do_not_lock_out_the_user(app, client):
+    for _ in range(app.config['LOGIN_MAX_FAILURES'] + 1):
+        _login(client, 'admin', 'wrong', '10.0.0.1')
+    response = _login(client, 'admin', PASSWORD, '10.0.0.2')
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert session['role'] == 'admin'
+
+
+def test_per_address_limit_covers_all_usernames(app, client):
+    app.config['LOGIN_MAX_FAILURES_PER_IP'] = 3
+    for name in ('alice', 'bob', 'carol'):
+        _login(client, name, 'wrong', '10.0.0.1')
+    assert _login(client, 'admin', PASSWORD, '10.0.0.1').status_code == 429
+
+
+def _stored(db, username):
+    return db.execute('SELECT password FROM users WHERE username = ?', (username,)).fetchone()[0]
+
+
+def test_method_without_parameters_is_not_rehashed_every_login(app, db, login):
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+    assert login('alice').status_code == 302
+    upgraded = _stored(db, 'alice')
+    assert upgraded != _stored(db, 'bob')
+    with app.test_request_context():
+        assert not hashing.needs_rehash(upgraded)
+    login('alice')
+    assert _stored(db, 'alice') == upgraded
+
+
+def test_changed_method_is_rehashed_at_login(app, db, login):
+    old = _stored(db, 'alice')
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+    login('alice')
+    assert _stored(db, 'alice').startswith('pbkdf2:sha256:2000$')
+    assert _stored(db, 'alice') != old
+
+
+@pytest.mark.parametrize('config', [{'PROXY_FIX_X_FOR': 1}])
+def test_forwarded_clients_are_limited_separately(app, client):
+    def login(password, forwarded_for):
+        return client.post('/auth/login', data={'username': 'admin', 'password': password},
+                           environ_base={'REMOTE_ADDR': '172.18.0.5'},
+                           headers={'X-Forwarded-For': forwarded_for})
+    for _ in range(app.config['LOGIN_MAX_FAILURES'] + 1):
+        login('wrong', '203.0.113.7')
+    assert login(PASSWORD, '203.0.113.7').status_code == 429
+    # the same nginx address, another client behind it
+    assert login(PASSWORD, '198.51.100.2').status_code == 302
+
+
+def test_proxy_fix_from_the_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv('PROXY_FIX_X_FOR', '1')
+    app = create_app({'DATABASE': str(tmp_path / 'v.sqlite'), 'SECRET_KEY': 'test',
+                      'TEMPLATE_BYTECODE_CACHE': False})
+    assert app.config['PROXY_FIX_X_FOR'] == 1
+    assert isinstance(app.wsgi_app, ProxyFix)
+    app.extensions['db_pool'].close()
@@ -0,0 +1,85 @@
+"""Micro-benchmarks of the functions on the request hot path.
+
+They run with the rest of the suite; skip them with ``--benchmark-skip``, or
+compare against a saved run::
+
+    pytest tests/test_benchmarks.py --benchmark-autosave
+    pytest tests/test_benchmarks.py --benchmark-compare --benchmark-compare-fail=mean:20%
+"""
+import itertools
+import pytest
+from vehicles import checkout, hashing, history, inventory, user_cache
+from vehicles.db import get_db
+from benchmarks.seed import USER_PASSWORD, make_app, seed
+
+pytest.importorskip('pytest_benchmark')
+
+
+@pytest.fixture(scope='module')
+def fleet(tmp_path_factory):
+    app = make_app(str(tmp_path_factory.mktemp('bench') / 'bench.sqlite'),
+                   PASSWORD_HASH_WORKERS=0, TEMPLATE_BYTECODE_CACHE=False)
+    seed(app, vehicles=2000, gas_cards=2000, users=50, history=20000, passwords=100)
+    yield app
+    app.extensions['db_pool'].close()
+
+
+@pytest.fixture
+def ctx(fleet):
+    with fleet.test_request_context('/'):
+        yield fleet, get_db()
+        get_db().commit()
+
+
+def test_inventory_cached(benchmark, ctx):
+    app, db = ctx
+    inventory.get_inventory(db)
+    benchmark(inventory.get_inventory, db)
+
+
+def test_inventory_uncached(benchmark, ctx):
+    app, db = ctx
+    cache = app.extensions['inventory_cache']
+
+    def run():
+        cache.clear()
+        inventory.get_inventory(db)
+    benchmark(run)
+
+
+def test_history_first_page(benchmark, ctx):
+    app, db = ctx
+    assert len(benchmark(history.page, db, 'vehicle', 50)[0]) == 50
+
+
+def test_history_filtered_plate(benchmark, ctx):
+    app, db = ctx
+    benchmark(history.page, db, 'vehicle', 50, resource='B00001')
+
+
+def test_checkout_toggle(benchmark, ctx):
+    app, db = ctx
+    plates = itertools.cycle([f'B{i:05d}' for i in range(100)])
+    benchmark(lambda: checkout.submit(db, user_id=2, vehicle_plate=next(plates), issue_password=False))
+
+
+def test_user_cache_hit(benchmark, ctx):
+    user_cache.load_user(2)
+    assert benchmark(user_cache.load_user, 2)['id'] == 2
+
+
+def test_user_cache_miss(benchmark, ctx):
+    app, db = ctx
+    cache = app.extensions['user_cache']
+
+    def run():
+        cache.clear()
+        user_cache.load_user(2)
+    benchmark(run)
+
+
+def test_password_verify(benchmark, ctx):
+    app, db = ctx
+    stored = db.execute('SELECT password FROM users WHERE id = 2').fetchone()[0]
+    # deliberately expensive; keep its share of the run bounded
+    assert benchmark.pedantic(hashing.verify, (stored, USER_PASSWORD), rounds=10, warmup_rounds=1)
@@ -0,0 +1,32 @@
+from vehicles import events
+
+
+def test_import_inserts_new_rows(client, login, db):
+    login('admin')
+    res = client.post('/vehicle/import', json=[{'plate': 'B00001'}, {'plate': 'B10001'}])
+    assert res.status_code == 200
+    assert res.json['inserted'] == 1
+    assert [c['key'] for c in res.json['conflicts']] == ['B00001']
+
+
+def test_failed_import_rolls_back_and_logs(client, login, db, monkeypatch, caplog):
+    login('admin')
+
+    def publish(*args, **kwargs):
+        raise RuntimeError('broken')
+    monkeypatch.setattr(events, 'publish', publish)
+    res = client.post('/gas_card/import', json=[{'card_number': '91000001', 'balance': 5}])
+    assert res.status_code == 500
+    assert 'import gas cards failed' in caplog.text
+    assert db.execute("SELECT 1 FROM gas_cards WHERE card_number = '91000001'").fetchone() is None
+    with client.session_transaction() as session:
+        assert '_flashes' not in session
+
+
+def test_import_command_reports_unparsable_files(app, tmp_path):
+    path = tmp_path / 'vehicles.json'
+    path.write_text('{"plate": ', encoding='utf-8')
+    result = app.test_cli_runner().invoke(args=['vehicle', 'import', str(path)])
+    assert result.exit_code == 1
+    assert result.output.startswith('Error: ')
+    assert 'Traceback' not in result.output
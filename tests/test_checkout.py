@@ -0,0 +1,43 @@
+import pytest
+from vehicles import checkout
+
+
+def status(db, table, key, value):
+    return db.execute(f'SELECT status FROM {table} WHERE {key} = ?', (value,)).fetchone()[0]
+
+
+def test_take_and_return_together(db):
+    result = checkout.submit(db, user_id=2, vehicle_plate='B00001', gas_card_number='90000001')
+    assert (result['vehicle_action'], result['gas_action']) == ('taken', 'taken')
+    assert result['password'] == '00000000'
+    assert db.execute('SELECT COUNT(*) FROM passwords').fetchone()[0] == 9
+    assert status(db, 'vehicles', 'plate', 'B00001') == 'taken'
+
+    result = checkout.submit(db, user_id=2, vehicle_plate='B00001', gas_card_number='90000001', balance='62.5')
+    assert (result['vehicle_action'], result['gas_action']) == ('returned', 'returned')
+    assert db.execute("SELECT balance FROM gas_cards WHERE card_number = '90000001'").fetchone()[0] == 62.5
+    assert db.execute('SELECT COUNT(*) FROM record_vehicles').fetchone()[0] == 2
+    assert db.execute('SELECT COUNT(*) FROM journal').fetchone()[0] == 4
+
+
+def test_unknown_card_writes_nothing(db):
+    with pytest.raises(checkout.CheckoutError):
+        checkout.submit(db, user_id=2, vehicle_plate='B00001', gas_card_number='99999999')
+    assert status(db, 'vehicles', 'plate', 'B00001') == 'returned'
+    assert db.execute('SELECT COUNT(*) FROM passwords').fetchone()[0] == 10
+
+
+def test_bad_balance_rolls_back_the_vehicle(db):
+    checkout.submit(db, user_id=2, vehicle_plate='B00001', gas_card_number='90000001')
+    with pytest.raises(checkout.CheckoutError):
+        checkout.submit(db, user_id=2, vehicle_plate='B00001', gas_card_number='90000001', balance='lots')
+    assert status(db, 'vehicles', 'plate', 'B00001') == 'taken'
+    assert status(db, 'gas_cards', 'card_number', '90000001') == 'taken'
+    assert db.execute('SELECT COUNT(*) FROM record_vehicles').fetchone()[0] == 1
+
+
+def test_submit_route_issues_a_password(client, login):
+    login()
+    res = client.post('/lock/submit', data={'vehicle': 'B00002'})
+    assert res.status_code == 302
+    assert 'password=00000000' in res.headers['Location']
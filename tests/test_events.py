@@ -0,0 +1,49 @@
+import json
+import time
+from vehicles import checkout
+from vehicles.db import get_db
+
+
+def _take(app, plate='B00001'):
+    with app.app_context():
+        checkout.submit(get_db(), 2, vehicle_plate=plate, issue_password=False)
+
+
+def test_requires_login(client):
+    assert client.get('/events').status_code == 401
+
+
+def test_stream_delivers_events(app, client, login):
+    app.config['EVENTS_STREAM_SECONDS'] = 0.3
+    login()
+    _take(app)
+    body = client.get('/events?last_id=0').get_data(as_text=True)
+    assert body.startswith('retry: 3000\n')
+    event = json.loads(body.split('data: ', 1)[1].split('\n', 1)[0])
+    assert (event['plate'], event['status']) == ('B00001', 'taken')
+
+
+def test_clients_beyond_the_limit_poll(app, client, login):
+    app.config['EVENTS_MAX_STREAMS'] = 0
+    login()
+    _take(app)
+    started = time.monotonic()
+    body = client.get('/events?last_id=0').get_data(as_text=True)
+    assert time.monotonic() - started < 1
+    assert body.startswith(f"retry: {app.config['EVENTS_POLL_RETRY'] * 1000}\n")
+    assert 'B00001' in body
+    # resuming after the last event seen yields nothing new
+    last_id = int(body.split('id: ', 1)[1].split('\n', 1)[0])
+    assert 'data:' not in client.get('/events', headers={'Last-Event-ID': str(last_id)}).get_data(as_text=True)
+
+
+def test_stream_slots_are_released(app, client, login):
+    app.config['EVENTS_STREAM_SECONDS'] = 0.1
+    app.config['EVENTS_MAX_STREAMS'] = 1
+    broker = app.extensions['events_broker']
+    login()
+    for _ in range(2):
+        assert client.get('/events').get_data(as_text=True).startswith('retry: 3000\n')
+    assert broker.claim_stream(1)
+    assert not broker.claim_stream(1)
+    broker.release_stream()
@@ -0,0 +1,15 @@
+import multiprocessing
+from vehicles import create_app, hashing
+
+
+def _hash_and_verify(database):
+    app = create_app({'DATABASE': database, 'SECRET_KEY': 'test', 'PASSWORD_HASH_WORKERS': 2,
+                      'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000', 'TEMPLATE_BYTECODE_CACHE': False})
+    with app.app_context():
+        return hashing.verify(hashing.hash_password('secret'), 'secret')
+
+
+def test_hashes_inline_in_daemonic_process(tmp_path):
+    # the load driver serves the app from multiprocessing.Pool workers
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        assert pool.apply(_hash_and_verify, (str(tmp_path / 'vehicles.sqlite'),))
@@ -0,0 +1,57 @@
+import pytest
+from vehicles import checkout, idempotency
+
+KEY = 'k' * 24
+
+
+def test_replay_returns_the_stored_result(db):
+    first = checkout.submit(db, user_id=2, vehicle_plate='B00001', idempotency_key=KEY)
+    again = checkout.submit(db, user_id=2, vehicle_plate='B00001', idempotency_key=KEY)
+    assert again == dict(first, replayed=True)
+    assert db.execute("SELECT status FROM vehicles WHERE plate = 'B00001'").fetchone()[0] == 'taken'
+    assert db.execute('SELECT COUNT(*) FROM passwords').fetchone()[0] == 9
+
+
+def test_replay_from_the_table_after_the_cache_is_cleared(db):
+    first = checkout.submit(db, user_id=2, vehicle_plate='B00001', idempotency_key=KEY)
+    idempotency._cache().clear()
+    again = checkout.submit(db, user_id=2, vehicle_plate='B00001', idempotency_key=KEY)
+    assert again['replayed'] and again['password'] == first['password']
+
+
+@pytest.mark.parametrize('user_id, plate', [(3, 'B00001'), (2, 'B00002')])
+def test_key_reused_for_another_submit(db, user_id, plate):
+    checkout.submit(db, user_id=2, vehicle_plate='B00001', idempotency_key=KEY)
+    with pytest.raises(checkout.CheckoutError):
+        checkout.submit(db, user_id=user_id, vehicle_plate=plate, idempotency_key=KEY)
+    assert db.execute("SELECT status FROM vehicles WHERE plate = 'B00002'").fetchone()[0] == 'returned'
+
+
+def test_malformed_keys_are_ignored(db):
+    checkout.submit(db, user_id=2, vehicle_plate='B00001', idempotency_key='short')
+    result = checkout.submit(db, user_id=2, vehicle_plate='B00001', idempotency_key='short')
+    assert result['vehicle_action'] == 'returned' and not result['replayed']
+
+
+def test_key_is_claimed_before_anything_changes(db):
+    statements = []
+    db.set_trace_callback(statements.append)
+    checkout.submit(db, user_id=2, vehicle_plate='B00001', idempotency_key=KEY)
+    db.set_trace_callback(None)
+    claim = next(i for i, sql in enumerate(statements) if 'INTO idempotency_keys' in sql)
+    update = next(i for i, sql in enumerate(statements) if sql.startswith('UPDATE vehicles'))
+    assert claim < update
+
+
+def test_submit_that_loses_the_claim_replays(db, monkeypatch):
+    # what a concurrent PostgreSQL submit with the same key sees once the
+    # first one commits: the claim fails and the stored result is read
+    first = checkout.submit(db, user_id=2, vehicle_plate='B00001', idempotency_key=KEY)
+    idempotency._cache().clear()
+    lookups = []
+    real_lookup = idempotency.lookup
+    monkeypatch.setattr(idempotency, 'lookup', lambda *args: lookups.append(args) or real_lookup(*args))
+    again = checkout.submit(db, user_id=2, vehicle_plate='B00001', idempotency_key=KEY)
+    assert again == dict(first, replayed=True)
+    assert len(lookups) == 1
+    assert db.execute("SELECT status FROM vehicles WHERE plate = 'B00001'").fetchone()[0] == 'taken'
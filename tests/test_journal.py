@@ -0,0 +1,53 @@
+import time
+from vehicles import checkout, events, journal
+from vehicles.db import run_immediate
+
+
+def test_failed_add_leaves_no_vehicle_or_entry(client, login, db, monkeypatch):
+    login('admin')
+
+    def publish(*args, **kwargs):
+        raise RuntimeError('broken')
+    monkeypatch.setattr(events, 'publish', publish)
+    res = client.post('/vehicle/add', json={'plate': 'B20000'})
+    assert res.status_code == 500
+    assert db.execute("SELECT 1 FROM vehicles WHERE plate = 'B20000'").fetchone() is None
+    assert db.execute('SELECT COUNT(*) FROM journal').fetchone()[0] == 0
+
+
+def test_add_and_delete_are_journaled(client, login, db):
+    login('admin')
+    vid = client.post('/vehicle/add', json={'plate': 'B20000'}).json['id']
+    assert client.post('/vehicle/delete', json={'id': vid}).status_code == 200
+    ops = [(r['resource_id'], r['op']) for r in db.execute('SELECT resource_id, op FROM journal ORDER BY id')]
+    assert ops == [(vid, 'add'), (vid, 'delete')]
+
+
+def test_replay_matches_current_state(db):
+    run_immediate(db, journal.baseline)
+    checkout.submit(db, user_id=2, vehicle_plate='B00001', gas_card_number='90000001')
+    checkout.submit(db, user_id=2, gas_card_number='90000001', balance='60')
+    state, _ = journal.state_at(db)
+    # a returned item keeps who returned it and when; the tables do not
+    def shape(state):
+        return {kind: {rid: (i['key'], i['status'], i['balance']) for rid, i in items.items()}
+                for kind, items in state.items()}
+    assert shape(state) == shape(journal.current_state(db))
+    assert state['vehicle'][1]['status'] == 'taken' and state['vehicle'][1]['user_id'] == 2
+    assert state['gas_card'][1]['balance'] == 60
+
+
+def test_restore_to_an_earlier_state(db):
+    run_immediate(db, journal.baseline)
+    before = journal.current_state(db)
+    time.sleep(1.1)
+    checkout.submit(db, user_id=2, vehicle_plate='B00001')
+    db.execute("DELETE FROM vehicles WHERE plate = 'B00005'")
+    db.commit()
+    earlier, _ = journal.state_at(db, int(time.time()) - 1)
+    assert earlier == before
+    changed = run_immediate(db, lambda db: journal.restore(db, earlier))
+    assert changed == {'vehicle': 2, 'gas_card': 0}
+    after = journal.current_state(db)
+    assert {rid: (i['key'], i['status']) for rid, i in after['vehicle'].items()} == \
+        {rid: (i['key'], i['status']) for rid, i in before['vehicle'].items()}
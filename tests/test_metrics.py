@@ -0,0 +1,49 @@
+import time
+import pytest
+from vehicles.db import get_db
+from vehicles.metrics import TimedCursor
+
+
+def _statements(app, verb):
+    for (name, labels), histogram in app.extensions['metrics'].histograms.items():
+        if name == 'vehicles_sql_statement_duration_seconds' and dict(labels)['verb'] == verb:
+            yield histogram
+
+
+@pytest.mark.parametrize('config', [{'SLOW_QUERY_MS': 20}])
+def test_slow_fetch_is_logged(app, caplog):
+    with app.app_context():
+        db = get_db()
+
+        def slow(value):
+            time.sleep(0.01)
+            return value
+        db.create_function('slow', 1, slow)
+        rows = [row[0] for row in db.execute('SELECT slow(id) FROM vehicles')]
+    assert rows == [1, 2, 3, 4, 5]
+    assert 'slow query' in caplog.text and 'SELECT slow(id)' in caplog.text
+    (histogram,) = _statements(app, 'SELECT')
+    assert histogram.count == 1 and histogram.sum >= 0.05
+
+
+def test_every_statement_is_recorded_once(app):
+    with app.app_context():
+        db = get_db()
+        db.execute('SELECT id FROM vehicles').fetchone()
+        db.execute('SELECT id FROM vehicles').fetchall()
+        db.execute("UPDATE vehicles SET status = 'returned' WHERE id = 1")
+        db.rollback()
+    assert sum(h.count for h in _statements(app, 'SELECT')) == 2
+    assert sum(h.count for h in _statements(app, 'UPDATE')) == 1
+
+
+def test_cursors_that_are_only_iterable(app):
+    class Rows:
+        # like vehicles.postgres.Cursor: iterable, not an iterator
+        def __iter__(self):
+            return iter([(1,), (2,)])
+
+    with app.app_context():
+        db = get_db()
+        assert list(TimedCursor(Rows(), db, 'SELECT 1', 'cli', 0.0)) == [(1,), (2,)]
+    assert sum(h.count for h in _statements(app, 'SELECT')) == 1
@@ -0,0 +1,132 @@
+import sqlite3
+import pytest
+from vehicles import migrations
+
+
+@pytest.fixture
+def old_db(app, tmp_path):
+    """A database at ``version`` built by the migrations themselves."""
+    conns = []
+
+    def make(version):
+        conn = sqlite3.connect(str(tmp_path / f'v{version}.sqlite'))
+        conn.row_factory = sqlite3.Row
+        conns.append(conn)
+        for func in migrations.MIGRATIONS[:version]:
+            func(conn)
+        migrations.stamp(conn, version)
+        conn.commit()
+        return conn
+
+    with app.app_context():
+        yield make
+    for conn in conns:
+        conn.close()
+
+
+def test_rollups_filled_from_text_history(old_db):
+    db = old_db(4)
+    db.execute("INSERT INTO vehicles (plate) VALUES ('B00001')")
+    db.execute("INSERT INTO gas_cards (card_number, balance) VALUES ('90000001', 40)")
+    db.executemany(
+        'INSERT INTO record_vehicles (vehicle_id, user_id, action, timestamp) VALUES (1, 2, ?, ?)',
+        [('taken', '2024-03-01 09:00:00'), ('returned', '2024-03-01 10:30:00'),
+         ('taken', '2024-03-02 08:00:00')]
+    )
+    db.executemany(
+        'INSERT INTO record_gas_cards (gas_card_id, user_id, action, balance, timestamp) VALUES (1, 2, ?, ?, ?)',
+        [('returned', 100, '2024-02-28 12:00:00'), ('taken', None, '2024-03-01 09:00:00'),
+         ('returned', 60, '2024-03-01 11:00:00')]
+    )
+    db.commit()
+    migrations.upgrade(db)
+    assert migrations.current_version(db) == migrations.latest_version()
+    rollups = {(r['day'], r['kind']): (r['checkouts'], r['seconds_out'], r['balance_delta'])
+               for r in db.execute('SELECT * FROM usage_daily')}
+    assert rollups == {('2024-03-01', 'vehicle'): (1, 5400, 0.0), ('2024-03-01', 'gas_card'): (1, 7200, 40.0)}
+    # the vehicle still out, its take converted from UTC+8 text to unix seconds
+    (kind, rid, user_id, taken_at), = db.execute(
+        'SELECT kind, resource_id, user_id, taken_at FROM open_checkouts').fetchall()
+    assert (kind, rid, user_id, taken_at) == ('vehicle', 1, 2, 1709337600)
+
+
+def test_rollups_filled_from_seconds_when_empty(app, old_db):
+    db = old_db(migrations.latest_version() - 1)
+    db.execute("INSERT INTO vehicles (plate) VALUES ('B00001')")
+    db.executemany(
+        'INSERT INTO record_vehicles (vehicle_id, user_id, action, timestamp) VALUES (1, 2, ?, ?)',
+        [('taken', 1709254800), ('returned', 1709260200)]
+    )
+    db.commit()
+    migrations.upgrade(db)
+    assert [tuple(r) for r in db.execute('SELECT day, kind, checkouts, seconds_out FROM usage_daily')] == \
+        [('2024-03-01', 'vehicle', 1, 5400)]
+
+
+def test_search_index_covers_existing_rows(old_db):
+    db = old_db(10)
+    db.executemany('INSERT INTO vehicles (plate) VALUES (?)', [('B12345',), ('C67890',)])
+    db.commit()
+    migrations.upgrade(db)
+    rows = db.execute("SELECT rowid FROM vehicles_fts WHERE vehicles_fts MATCH '\"234\"'").fetchall()
+    assert [r[0] for r in rows] == [1]
+
+
+def test_journal_baseline_matches_current_state(old_db):
+    from vehicles import journal
+    db = old_db(12)
+    db.execute("INSERT INTO vehicles (plate, status) VALUES ('B00001', 'taken')")
+    db.execute("INSERT INTO gas_cards (card_number, balance) VALUES ('90000001', 40)")
+    db.execute("INSERT INTO open_checkouts (kind, resource_id, user_id, taken_at, balance) "
+               "VALUES ('vehicle', 1, 2, 1709254800, NULL)")
+    db.commit()
+    migrations.upgrade(db)
+    state, journal_id = journal.state_at(db)
+    assert journal_id == 0
+    assert state == journal.current_state(db)
+    assert state['vehicle'][1]['user_id'] == 2
+
+
+def _objects(db):
+    return {(r[0], r[1]) for r in db.execute(
+        "SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"
+    )}
+
+
+def _columns(db, table):
+    return [r[1] for r in db.execute(f'PRAGMA table_info({table})')]
+
+
+def test_upgrade_from_empty_matches_schema(app, db, old_db):
+    migrated = old_db(0)
+    assert migrations.upgrade(migrated) == list(range(1, migrations.latest_version() + 1))
+    assert migrations.current_version(migrated) == migrations.current_version(db) == migrations.latest_version()
+    assert _objects(migrated) == _objects(db)
+    for kind, name in _objects(db):
+        if kind == 'table':
+            assert sorted(_columns(migrated, name)) == sorted(_columns(db, name)), name
+    assert migrations.upgrade(migrated) == []
+
+
+def test_failed_migration_keeps_the_previous_version(old_db, monkeypatch):
+    db = old_db(migrations.latest_version())
+
+    def broken(db):
+        db.execute('CREATE TABLE half_done (id INTEGER)')
+        raise RuntimeError('broken')
+    monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS + [broken])
+    with pytest.raises(RuntimeError):
+        migrations.upgrade(db)
+    assert migrations.current_version(db) == migrations.latest_version() - 1
+    assert ('table', 'half_done') not in _objects(db)
+
+
+def test_init_db_starts_the_derived_tables_over(db):
+    from vehicles import checkout, journal
+    from vehicles.db import init_database, run_immediate
+    run_immediate(db, journal.baseline)
+    checkout.submit(db, user_id=2, vehicle_plate='B00001', idempotency_key='k' * 24)
+    init_database()
+    for table in ('data_versions', 'status_events', 'usage_daily', 'open_checkouts', 'login_failures',
+                  'reservations', 'idempotency_keys', 'journal', 'journal_snapshots'):
+        assert db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] == 0, table
@@ -0,0 +1,28 @@
+import threading
+from vehicles import passwords
+from vehicles.db import get_db, run_immediate
+
+
+def test_concurrent_claims_never_share_a_code(app):
+    claimed = []
+    barrier = threading.Barrier(12)
+
+    def claim():
+        with app.app_context():
+            db = get_db()
+            barrier.wait()
+            claimed.append(run_immediate(db, passwords.claim, retries=20))
+
+    threads = [threading.Thread(target=claim) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    codes = [code for code in claimed if code is not None]
+    assert sorted(codes) == [f'{i:08d}' for i in range(10)]
+    assert claimed.count(None) == 2
+
+
+def test_claim_takes_the_oldest(db):
+    assert passwords.claim(db) == '00000000'
+    assert passwords.claim(db) == '00000001'
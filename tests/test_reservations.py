@@ -0,0 +1,55 @@
+import time
+import pytest
+from vehicles import checkout, reservations
+from vehicles.reservations import ReservationError
+
+ALICE, BOB = 2, 3
+HOUR = 3600
+
+
+def _vehicle(db, plate='B00001'):
+    return db.execute('SELECT id FROM vehicles WHERE plate = ?', (plate,)).fetchone()[0]
+
+
+def test_overlapping_bookings_are_refused(app, db):
+    start = int(time.time()) + HOUR
+    vid = _vehicle(db)
+    reservations.book(db, ALICE, vid, start, start + HOUR)
+    with pytest.raises(ReservationError):
+        reservations.book(db, BOB, vid, start + HOUR // 2, start + 2 * HOUR)
+    with pytest.raises(ReservationError):
+        reservations.book(db, BOB, vid, start - HOUR // 2, start + 60)
+    # back to back is fine
+    reservations.book(db, BOB, vid, start + HOUR, start + 2 * HOUR)
+    reservations.book(db, BOB, vid, start - HOUR // 2, start)
+
+
+def test_cancelled_booking_frees_the_window(app, db):
+    start = int(time.time()) + HOUR
+    vid = _vehicle(db)
+    booking = reservations.book(db, ALICE, vid, start, start + HOUR)
+    assert not reservations.cancel(db, booking, user_id=BOB)
+    assert reservations.cancel(db, booking, user_id=ALICE)
+    reservations.book(db, BOB, vid, start, start + HOUR)
+
+
+def test_only_the_holder_can_take_a_booked_vehicle(app, db):
+    now = int(time.time())
+    reservations.book(db, ALICE, _vehicle(db), now, now + HOUR)
+    with pytest.raises(checkout.CheckoutError):
+        checkout.submit(db, BOB, vehicle_plate='B00001', issue_password=False)
+    assert checkout.submit(db, ALICE, vehicle_plate='B00001', issue_password=False)['vehicle_action'] == 'taken'
+
+
+def test_own_upcoming_booking_does_not_hide_a_running_one(app, db):
+    # Alice has the vehicle until T+1h; Bob's booking starts five minutes
+    # later, inside the hold window. Bob must not take it at T+55min.
+    start = int(time.time()) + HOUR
+    vid = _vehicle(db)
+    alice = reservations.book(db, ALICE, vid, start, start + HOUR)
+    reservations.book(db, BOB, vid, start + HOUR + 300, start + 2 * HOUR)
+    with app.test_request_context():
+        blocking = reservations.holder(db, 'vehicle', vid, BOB, now=start + HOUR - 300)
+        assert blocking is not None and blocking.id == alice
+        # once Alice's booking is over, Bob's own booking no longer blocks him
+        assert reservations.holder(db, 'vehicle', vid, BOB, now=start + HOUR) is None
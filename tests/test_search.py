@@ -0,0 +1,20 @@
+from vehicles import search
+
+
+def keys(rows):
+    return [row['plate'] for row in rows]
+
+
+def test_long_queries_match_substrings(db):
+    assert keys(search.search(db, 'vehicle', '0003', 10)) == ['B00003']
+    assert keys(search.search(db, 'vehicle', 'b00', 2)) == ['B00001', 'B00002']
+
+
+def test_short_queries_match_prefixes_only(db):
+    assert keys(search.search(db, 'vehicle', 'b0', 10)) == ['B00001', 'B00002', 'B00003', 'B00004', 'B00005']
+    assert keys(search.search(db, 'vehicle', '03', 10)) == []
+
+
+def test_status_filter(db):
+    db.execute("UPDATE vehicles SET status = 'taken' WHERE plate = 'B00002'")
+    assert keys(search.search(db, 'vehicle', 'B', 10, status='taken')) == ['B00002']
@@ -0,0 +1,195 @@
+"""Fleet utilization and fuel-consumption rollups.
+
+``lock.submit`` maintains two tables in the checkout transaction:
+
+* ``open_checkouts`` holds one row per vehicle or gas card currently out,
+  with who took it, when, and (for gas cards) the balance at that moment.
+* ``usage_daily`` accumulates completed checkouts per local day, kind,
+  resource and user: the checkout count, the seconds the resource was out
+  and, for gas cards, the balance spent (balance at take minus balance at
+  return; negative when the card was topped up).
+
+A checkout is counted on the day it is returned and attributed to the user
+who took it. Reports aggregate ``usage_daily`` only, so their cost grows
+with the number of rollup rows rather than with the raw history.
+Times are unix seconds like the record tables; only the rollup day is
+local (``TIMEZONE``, see vehicles/localtime.py).
+"""
+import time
+import click
+from flask.cli import with_appcontext
+from vehicles.db import get_db, run_immediate
+from vehicles import localtime
+
+
+KINDS = ('vehicle', 'gas_card')
+
+# group -> (label expression, joins, GROUP BY columns); every selected
+# column is grouped on, as PostgreSQL requires
+GROUPS = {
+    'vehicle': (
+        "COALESCE(v.plate, '#' || u.resource_id)",
+        'LEFT JOIN vehicles v ON v.id = u.resource_id',
+        'u.resource_id, v.plate, u.kind',
+    ),
+    'gas_card': (
+        "COALESCE(c.card_number, '#' || u.resource_id)",
+        'LEFT JOIN gas_cards c ON c.id = u.resource_id',
+        'u.resource_id, c.card_number, u.kind',
+    ),
+    'user': (
+        "COALESCE(us.username, '#' || u.user_id)",
+        'LEFT JOIN users us ON us.id = u.user_id',
+        'u.user_id, us.username, u.kind',
+    ),
+    'day': ('u.day', '', 'u.day, u.kind'),
+}
+
+
+def on_take(db, kind, resource_id, user_id=None, balance=None):
+    db.execute(
+        'INSERT INTO open_checkouts (kind, resource_id, user_id, taken_at, balance) '
+        'VALUES (?, ?, ?, ?, ?) '
+        'ON CONFLICT (kind, resource_id) DO UPDATE SET '
+        'user_id = excluded.user_id, taken_at = excluded.taken_at, balance = excluded.balance',
+        (kind, resource_id, user_id or 0, int(time.time()), balance)
+    )
+
+
+def on_return(db, kind, resource_id, balance=None):
+    """Close the open checkout of a resource and add it to the day's rollup.
+
+    Returns are ignored when no take was seen (e.g. taken before the rollups
+    existed), since their duration is unknown.
+    """
+    row = db.execute(
+        'SELECT user_id, taken_at, balance FROM open_checkouts WHERE kind = ? AND resource_id = ?',
+        (kind, resource_id)
+    ).fetchone()
+    if row is None:
+        return
+    db.execute('DELETE FROM open_checkouts WHERE kind = ? AND resource_id = ?', (kind, resource_id))
+    delta = row['balance'] - balance if row['balance'] is not None and balance is not None else 0.0
+    now = int(time.time())
+    _add(db, localtime.local_day(now), kind, resource_id, row['user_id'], now - row['taken_at'], delta)
+
+
+def _add(db, day, kind, resource_id, user_id, seconds, delta):
+    db.execute(
+        'INSERT INTO usage_daily (day, kind, resource_id, user_id, checkouts, seconds_out, balance_delta) '
+        'VALUES (?, ?, ?, ?, 1, ?, ?) '
+        'ON CONFLICT (day, kind, resource_id, user_id) DO UPDATE SET '
+        'checkouts = checkouts + 1, '
+        'seconds_out = seconds_out + excluded.seconds_out, '
+        'balance_delta = balance_delta + excluded.balance_delta',
+        (day, kind, resource_id, user_id, max(seconds, 0), delta)
+    )
+
+
+def forget(db, kind, resource_id):
+    """Drop the open checkout of a deleted resource."""
+    db.execute('DELETE FROM open_checkouts WHERE kind = ? AND resource_id = ?', (kind, resource_id))
+
+
+def _history(db, table, archive, columns):
+    # archived ids are all lower than live ones, so this is one id-ordered pass
+    return db.execute(
+        f'SELECT {columns} FROM {archive} UNION ALL SELECT {columns} FROM {table} ORDER BY id'
+    )
+
+
+def rebuild(db):
+    """Recompute both tables from the record history (live and archive).
+
+    The history has no balance for takes, so a gas card's balance at take
+    is taken from its previous return (no delta is counted for its first
+    checkout). Cards still out keep their current balance.
+    """
+    db.execute('DELETE FROM usage_daily')
+    db.execute('DELETE FROM open_checkouts')
+    sources = {
+        'vehicle': _history(
+            db, 'record_vehicles', 'record_vehicles_archive',
+            'id, vehicle_id AS resource_id, user_id, action, timestamp, NULL AS balance'
+        ),
+        'gas_card': _history(
+            db, 'record_gas_cards', 'record_gas_cards_archive',
+            'id, gas_card_id AS resource_id, user_id, action, timestamp, balance'
+        ),
+    }
+    current = {row[0]: row[1] for row in db.execute('SELECT id, balance FROM gas_cards')}
+    for kind, rows in sources.items():
+        known = {}
+        open_rows = {}
+        for row in rows.fetchall():
+            rid = row['resource_id']
+            stamp = row['timestamp']
+            if row['action'] == 'taken':
+                balance = known.get(rid)
+                open_rows[rid] = (row['user_id'] or 0, stamp, balance)
+                continue
+            taken = open_rows.pop(rid, None)
+            if kind == 'gas_card' and row['balance'] is not None:
+                known[rid] = row['balance']
+            if taken is None:
+                continue
+            user_id, taken_at, balance = taken
+            delta = balance - row['balance'] if balance is not None and row['balance'] is not None else 0.0
+            _add(db, localtime.local_day(stamp), kind, rid, user_id, stamp - taken_at, delta)
+        db.executemany(
+            'INSERT INTO open_checkouts (kind, resource_id, user_id, taken_at, balance) VALUES (?, ?, ?, ?, ?)',
+            ((kind, rid, user_id, taken_at, current.get(rid) if kind == 'gas_card' else None)
+             for rid, (user_id, taken_at, _) in open_rows.items())
+        )
+
+
+def report(db, group='vehicle', since=None, until=None):
+    """Aggregate ``usage_daily`` by ``group`` ('vehicle', 'gas_card',
+    'user' or 'day') over the inclusive local-day range ``since``..``until``
+    (``YYYY-MM-DD`` strings, either may be ``None``)."""
+    label, joins, group_by = GROUPS[group]
+    clauses, params = [], []
+    if group in KINDS:
+        clauses.append('u.kind = ?')
+        params.append(group)
+    if since:
+        clauses.append('u.day >= ?')
+        params.append(since)
+    if until:
+        clauses.append('u.day <= ?')
+        params.append(until)
+    where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+    order = 'u.day DESC, u.kind' if group == 'day' else 'seconds_out DESC, label'
+    return db.execute(
+        f'SELECT {label} AS label, u.kind, SUM(u.checkouts) AS checkouts, '
+        f'SUM(u.seconds_out) AS seconds_out, SUM(u.balance_delta) AS balance_delta '
+        f'FROM usage_daily u {joins} {where} GROUP BY {group_by} ORDER BY {order}',
+        params
+    ).fetchall()
+
+
+def open_checkouts(db):
+    """Resources currently out, longest first, with seconds out so far."""
+    return db.execute(
+        "SELECT o.kind, COALESCE(v.plate, c.card_number, '#' || o.resource_id) AS label, "
+        "COALESCE(us.username, '#' || o.user_id) AS username, o.taken_at, o.balance, "
+        '? - o.taken_at AS seconds_out '
+        'FROM open_checkouts o '
+        "LEFT JOIN vehicles v ON o.kind = 'vehicle' AND v.id = o.resource_id "
+        "LEFT JOIN gas_cards c ON o.kind = 'gas_card' AND c.id = o.resource_id "
+        'LEFT JOIN users us ON us.id = o.user_id '
+        'ORDER BY o.taken_at',
+        (int(time.time()),)
+    ).fetchall()
+
+
+@click.command('rebuild-analytics')
+@with_appcontext
+def rebuild_analytics_command():
+    """Recompute the usage rollups from the full record history."""
+    run_immediate(get_db(), rebuild)
+    click.echo('Rebuilt usage rollups.')
+
+
+def init_analytics(app):
+    app.cli.add_command(rebuild_analytics_command)
@@ -0,0 +1,189 @@
+"""Optional ASGI entry point (``pip install .[asgi]``).
+
+    uvicorn --factory vehicles.asgi:create_asgi_app --host 0.0.0.0 --port 8000
+    gunicorn -k uvicorn.workers.UvicornWorker 'vehicles.asgi:create_asgi_app()'
+
+Ordinary requests go to the Flask app through ``a2wsgi``'s WSGI bridge,
+which runs them on a pool of ``ASGI_THREADS`` threads. The long-lived
+endpoints, ``/events`` and ``/record/api/*``, are served natively. While
+waiting they sit on the event loop instead of holding a thread, and their
+database reads are offloaded to a second bounded pool of the same size. One
+worker process can therefore hold many open streams.
+"""
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from a2wsgi import WSGIMiddleware
+from vehicles import create_app, history
+from vehicles.events import HEARTBEAT, sse_frame
+from vehicles.routes import events as events_routes
+from vehicles.routes.record import stream_args
+
+
+# rows read per offloaded call while streaming history
+STREAM_BATCH = 200
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+
+def _environ(scope):
+    """A minimal WSGI environ for building a Flask request context."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.version': (1, 0),
+    }
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+class AsyncApp:
+    """ASGI application wrapping a Flask app from :func:`create_app`."""
+
+    def __init__(self, app):
+        self.app = app
+        threads = int(app.config['ASGI_THREADS'])
+        self.wsgi = WSGIMiddleware(app, workers=threads)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-db')
+        self.routes = {
+            '/events': self.events,
+            '/record/api/vehicle': partial(self.history, 'vehicle', 'plate'),
+            '/record/api/gas': partial(self.history, 'gas', 'card'),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        handler = self.routes.get(scope.get('path')) if scope['type'] == 'http' else None
+        if handler is None or scope['method'] != 'GET':
+            return await self.wsgi(scope, receive, send)
+        return await handler(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _offload(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _in_request(self, environ, func, *args):
+        # runs in the pool: the session and g.user need a request context
+        with self.app.request_context(environ):
+            self.app.preprocess_request()
+            return func(*args)
+
+    async def events(self, scope, receive, send):
+        last_id = await self._offload(self._in_request, _environ(scope), events_routes.start_id)
+        if last_id is None:
+            await send({'type': 'http.response.start', 'status': 401,
+                        'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b'Unauthorized'})
+            return
+
+        broker = self.app.extensions['events_broker']
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+
+        def waker():
+            loop.call_soon_threadsafe(wake.set)
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+        broker.attach(waker)
+        try:
+            deadline = loop.time() + float(self.app.config['EVENTS_STREAM_SECONDS'])
+            while not disconnected.done() and loop.time() < deadline:
+                pending, behind = broker.available(last_id)
+                if behind:
+                    pending = await self._offload(broker.catch_up, last_id)
+                    if not pending:
+                        last_id = broker.resume_id(last_id)
+                        continue
+                if pending:
+                    last_id = pending[-1][0]
+                    body = ''.join(sse_frame(event) for event in pending).encode()
+                    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+                    continue
+                # clear, then re-check, so an event landing in between is not missed
+                wake.clear()
+                if broker.available(last_id) != ([], False):
+                    continue
+                woken = asyncio.ensure_future(wake.wait())
+                done, _ = await asyncio.wait(
+                    {woken, disconnected}, timeout=min(HEARTBEAT, max(deadline - loop.time(), 0)),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                woken.cancel()
+                if not done and loop.time() < deadline:
+                    await send({'type': 'http.response.body', 'body': sse_frame(None).encode(), 'more_body': True})
+        finally:
+            broker.detach(waker)
+            disconnected.cancel()
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def history(self, kind, resource_arg, scope, receive, send):
+        filters, limit = await self._offload(self._in_request, _environ(scope), stream_args, resource_arg)
+        pool = self.app.extensions['db_pool']
+        conn = await self._offload(pool.acquire)
+        chunks = history.dump_json(history.iter_history(conn, kind, limit=limit, **filters), limit)
+
+        def read():
+            return ''.join(islice(chunks, STREAM_BATCH))
+
+        def finish():
+            chunks.close()
+            pool.release(conn)
+
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'application/json')]})
+            while True:
+                body = await self._offload(read)
+                if not body:
+                    break
+                await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await self._offload(finish)
+
+
+def create_asgi_app(test_config=None):
+    return AsyncApp(create_app(test_config))
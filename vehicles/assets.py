@@ -0,0 +1,146 @@
+"""Fingerprinted, precompressed static assets and template bytecode caching.
+
+``flask assets build`` copies every file under ``static/`` to
+``static/dist/`` with a content hash in its name (``css/global.css`` becomes
+``dist/css/global.1a2b3c4d5e.css``), writes gzip (and, with the optional
+``brotli`` package, brotli) siblings for nginx's ``gzip_static``, and
+records the mapping in ``static/dist/manifest.json``.
+
+When a manifest exists, ``url_for('static', filename=...)`` emits the
+hashed URL, and hashed files are served with a one-year ``immutable``
+cache lifetime. A changed file gets a new name, so browsers never
+revalidate assets. Without a manifest, URLs and caching are unchanged.
+"""
+import hashlib
+import json
+import os
+import click
+from flask import current_app, request
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def _fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:10]
+
+
+def build(static_folder):
+    """Rebuild ``static_folder/dist``. Returns the manifest dict."""
+    # build-time only imports, kept off the worker startup path
+    import gzip
+    import shutil
+    import tempfile
+    brotli = _brotli()
+    dist = os.path.join(static_folder, DIST)
+    staging = tempfile.mkdtemp(prefix='dist-', dir=static_folder)
+    manifest = {}
+    try:
+        for root, dirs, files in os.walk(static_folder):
+            # skip the output and any half-written staging directories
+            dirs[:] = [d for d in dirs if os.path.join(root, d) not in (dist, staging)
+                       and not d.startswith('dist-')]
+            for name in files:
+                source = os.path.join(root, name)
+                rel = os.path.relpath(source, static_folder).replace(os.sep, '/')
+                stem, ext = os.path.splitext(rel)
+                hashed = f'{stem}.{_fingerprint(source)}{ext}'
+                target = os.path.join(staging, hashed)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(source, target)
+                if ext in COMPRESSIBLE:
+                    with open(source, 'rb') as f:
+                        data = f.read()
+                    with open(target + '.gz', 'wb') as f:
+                        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                    if brotli is not None:
+                        with open(target + '.br', 'wb') as f:
+                            f.write(brotli.compress(data, quality=11))
+                manifest[rel] = f'{DIST}/{hashed}'
+        with open(os.path.join(staging, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        if os.path.isdir(dist):
+            shutil.rmtree(dist)
+        os.rename(staging, dist)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return manifest
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def release_id(app, manifest):
+    """Hash of the templates and asset manifest, identifying the deployed
+    release in page ETags (see vehicles/etags.py)."""
+    digest = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode())
+    folder = os.path.join(app.root_path, app.template_folder)
+    for root, dirs, files in sorted(os.walk(folder)):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, folder).encode())
+            digest.update(_fingerprint(path).encode())
+    return digest.hexdigest()[:10]
+
+
+assets_cli = AppGroup('assets', help='Build fingerprinted static assets.')
+
+
+@assets_cli.command('build')
+def build_command():
+    """Fingerprint and precompress everything under static/."""
+    manifest = build(current_app.static_folder)
+    click.echo(f'Built {len(manifest)} assets{"" if _brotli() else " (brotli not installed, gzip only)"}.')
+
+
+def init_assets(app):
+    app.cli.add_command(assets_cli)
+    manifest = load_manifest(app.static_folder)
+    app.extensions['asset_manifest'] = manifest
+    app.config['RELEASE_ID'] = release_id(app, manifest)
+
+    if app.config['TEMPLATE_BYTECODE_CACHE']:
+        directory = os.path.join(app.instance_path, 'jinja_cache')
+        try:
+            os.makedirs(directory, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+        except OSError:
+            app.logger.warning('template bytecode cache disabled: %s is not writable', directory)
+
+    if not manifest:
+        return
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if endpoint == 'static':
+            hashed = manifest.get(values.get('filename'))
+            if hashed:
+                values['filename'] = hashed
+
+    @app.after_request
+    def cache_hashed_static(response):
+        if request.endpoint == 'static' and (request.view_args or {}).get('filename', '').startswith(DIST + '/'):
+            response.headers['Cache-Control'] = IMMUTABLE
+        return response
@@ -0,0 +1,113 @@
+"""Identification applications: filing, listing and batched admin decisions.
+
+An approval sets the applicant's ``users.is_identified`` to 1 and a
+rejection sets it to 3. :func:`decide` applies any number of decisions with
+one ``executemany`` per table inside a single ``BEGIN IMMEDIATE``
+transaction, so clearing the queue is one request. Only pending
+applications are decided; ids that are unknown or already decided are
+reported back as skipped.
+"""
+from vehicles import localtime
+from vehicles.db import run_immediate
+
+
+ACTIONS = {
+    # action -> (application status, users.is_identified)
+    'approve': ('approved', 1),
+    'reject': ('rejected', 3),
+}
+STATUSES = ('pending', 'approved', 'rejected')
+
+# SQLite's default limit on bound parameters is 999 on older versions
+CHUNK = 500
+
+
+def submit(db, username):
+    """File an application for ``username`` and mark the user pending (2).
+    Returns False, changing nothing, when one is already pending."""
+    existing = db.execute(
+        "SELECT 1 FROM applications WHERE username = ? AND status = 'pending'", (username,)
+    ).fetchone()
+    if existing:
+        return False
+    db.execute('INSERT INTO applications (username, status) VALUES (?, ?)', (username, 'pending'))
+    db.execute('UPDATE users SET is_identified = 2 WHERE username = ?', (username,))
+    return True
+
+
+def page(db, size, status='pending', after_id=None, username=None, since=None, until=None):
+    """Return ``(rows, next_after_id)`` for one page of applications with
+    ``status``, oldest first. ``username`` matches a prefix, ``since`` and
+    ``until`` are inclusive local days of submission."""
+    clauses, params = ['a.status = ?'], [status]
+    if after_id is not None:
+        clauses.append('a.id > ?')
+        params.append(after_id)
+    if username:
+        clauses.append("a.username LIKE ? ESCAPE '\\'")
+        params.append(username.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    bounds = since and localtime.day_bounds(since)
+    if bounds:
+        clauses.append('a.created >= ?')
+        params.append(bounds[0])
+    bounds = until and localtime.day_bounds(until)
+    if bounds:
+        clauses.append('a.created < ?')
+        params.append(bounds[1])
+    rows = db.execute(
+        f'SELECT a.id, a.username, a.status, a.created FROM applications a '
+        f'WHERE {" AND ".join(clauses)} ORDER BY a.id LIMIT ?',
+        params + [size + 1]
+    ).fetchall()
+    if len(rows) > size:
+        rows = rows[:size]
+        return rows, rows[-1]['id']
+    return rows, None
+
+
+def count(db, status='pending'):
+    return db.execute('SELECT COUNT(*) FROM applications WHERE status = ?', (status,)).fetchone()[0]
+
+
+def _decide(db, decisions):
+    pending = {}
+    ids = list(decisions)
+    for start in range(0, len(ids), CHUNK):
+        chunk = ids[start:start + CHUNK]
+        for row in db.execute(
+            'SELECT a.id, u.id AS user_id FROM applications a LEFT JOIN users u ON u.username = a.username '
+            f"WHERE a.status = 'pending' AND a.id IN ({', '.join('?' * len(chunk))})",
+            chunk
+        ):
+            pending[row['id']] = row['user_id']
+    db.executemany(
+        "UPDATE applications SET status = ? WHERE id = ? AND status = 'pending'",
+        [(ACTIONS[decisions[app_id]][0], app_id) for app_id in pending]
+    )
+    db.executemany(
+        'UPDATE users SET is_identified = ? WHERE id = ?',
+        [(ACTIONS[decisions[app_id]][1], user_id) for app_id, user_id in pending.items() if user_id is not None]
+    )
+    return pending
+
+
+def decide(db, decisions):
+    """Apply ``decisions`` (``(application_id, action)`` pairs; a later pair
+    for the same id wins) in one transaction.
+
+    Returns ``(applied, skipped, user_ids)``: counts per action, the ids
+    that were not pending, and the users whose cached rows are now stale.
+    """
+    latest = {}
+    for app_id, action in decisions:
+        if action not in ACTIONS:
+            raise ValueError(f'unknown action {action!r}')
+        latest[int(app_id)] = action
+    if not latest:
+        return {action: 0 for action in ACTIONS}, [], []
+    pending = run_immediate(db, lambda db: _decide(db, latest))
+    applied = {action: 0 for action in ACTIONS}
+    for app_id in pending:
+        applied[latest[app_id]] += 1
+    skipped = sorted(set(latest) - set(pending))
+    return applied, skipped, [user_id for user_id in pending.values() if user_id is not None]
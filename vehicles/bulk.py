@@ -0,0 +1,160 @@
+"""Bulk import and export of vehicles and gas cards.
+
+An import parses the whole file first, checks every key against the table
+with one query, and inserts the remaining rows with ``executemany`` in a
+single transaction. Rows whose key is missing, malformed, duplicated in the
+file or already present are reported back instead of aborting the batch.
+"""
+import csv
+import io
+import json
+from vehicles.db import backend, run_immediate, stream
+from vehicles import events, inventory, journal
+
+
+KINDS = {
+    'vehicle': {
+        'table': 'vehicles',
+        'key': 'plate',
+        'insert': ('plate',),
+        'columns': ('plate', 'status'),
+    },
+    'gas_card': {
+        'table': 'gas_cards',
+        'key': 'card_number',
+        'insert': ('card_number', 'balance'),
+        'columns': ('card_number', 'balance', 'status'),
+    },
+}
+
+
+class BulkError(Exception):
+    """The uploaded data cannot be parsed at all."""
+
+
+def parse(data, filename=''):
+    """Parse CSV (with a header row) or JSON into a list of dicts.
+
+    JSON may be a list of objects or an object holding such a list, e.g.
+    ``{"vehicles": [...]}``. The format is taken from the file extension and
+    falls back to sniffing the first character.
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    text = data.strip()
+    if filename.lower().endswith('.json') or text[:1] in ('[', '{'):
+        try:
+            return normalize(json.loads(text))
+        except ValueError as e:
+            raise BulkError(f'JSON 格式错误: {e}')
+    return [dict(row) for row in csv.DictReader(io.StringIO(text))]
+
+
+def normalize(loaded):
+    """Turn decoded JSON into a list of row dicts."""
+    if isinstance(loaded, dict):
+        lists = [v for v in loaded.values() if isinstance(v, list)]
+        loaded = lists[0] if lists else [loaded]
+    if not isinstance(loaded, list) or not all(isinstance(r, dict) for r in loaded):
+        raise BulkError('JSON 必须是对象列表。')
+    return loaded
+
+
+def rows_from_request(request):
+    """Rows from an uploaded ``file`` field or a JSON request body."""
+    upload = request.files.get('file')
+    if upload:
+        return parse(upload.read(), upload.filename or '')
+    data = request.get_json(silent=True)
+    if data is None:
+        raise BulkError('没有接收到数据')
+    return normalize(data)
+
+
+def _clean(kind, row):
+    """Return ``(values, error)`` for one input row."""
+    key = KINDS[kind]['key']
+    value = str(row.get(key) or '').strip()
+    if not value:
+        return None, f'缺少 {key}'
+    if kind == 'vehicle':
+        return (value,), None
+    balance = row.get('balance')
+    if balance in (None, ''):
+        balance = 0.0
+    try:
+        balance = float(balance)
+    except (TypeError, ValueError):
+        return None, f'余额无效: {balance}'
+    return (value, balance), None
+
+
+def import_rows(db, kind, rows):
+    """Insert ``rows`` of ``kind`` ('vehicle' or 'gas_card') in one transaction.
+
+    Returns ``{'inserted': n, 'conflicts': [{'row': i, 'key': ..., 'error': ...}]}``
+    where ``row`` is the 1-based position in the input.
+    """
+    spec = KINDS[kind]
+    table, key = spec['table'], spec['key']
+    conflicts = []
+    candidates = []
+    seen = set()
+    for index, row in enumerate(rows, start=1):
+        values, error = _clean(kind, row)
+        if error is None and values[0] in seen:
+            error = '文件内重复'
+        if error is not None:
+            conflicts.append({'row': index, 'key': str(row.get(key) or ''), 'error': error})
+            continue
+        seen.add(values[0])
+        candidates.append((index, values))
+
+    def work(db):
+        keys = [values[0] for _, values in candidates]
+        if backend(db) == 'postgres':
+            sql, params = f'SELECT {key} FROM {table} WHERE {key} = ANY(?)', (keys,)
+        else:
+            sql, params = f'SELECT {key} FROM {table} WHERE {key} IN (SELECT value FROM json_each(?))', (json.dumps(keys),)
+        existing = {r[0] for r in db.execute(sql, params)}
+        new = [values for _, values in candidates if values[0] not in existing]
+        if new:
+            columns = spec['insert']
+            db.executemany(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                new
+            )
+            journal.append_added(db, kind, [values[0] for values in new])
+            inventory.bump(db)
+            events.publish(db, kind, 'reload', count=len(new))
+        return len(new), existing
+
+    inserted, existing = run_immediate(db, work) if candidates else (0, set())
+    conflicts.extend(
+        {'row': index, 'key': values[0], 'error': '已存在'}
+        for index, values in candidates if values[0] in existing
+    )
+    conflicts.sort(key=lambda c: c['row'])
+    return {'inserted': inserted, 'conflicts': conflicts}
+
+
+def export_rows(db, kind, fmt='csv'):
+    """Yield the whole table of ``kind`` as CSV or JSON text chunks."""
+    spec = KINDS[kind]
+    columns = ('id',) + spec['columns']
+    cursor = stream(db, f'SELECT {", ".join(columns)} FROM {spec["table"]} ORDER BY id')
+    if fmt == 'json':
+        yield '['
+        for i, row in enumerate(cursor):
+            yield (',' if i else '') + json.dumps(dict(row), ensure_ascii=False)
+        yield ']'
+        return
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for row in cursor:
+        writer.writerow(tuple(row))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
@@ -0,0 +1,170 @@
+"""Take/return engine behind ``/lock/submit``.
+
+The status flips, the audit records and the temporary password claim all
+happen in one ``BEGIN IMMEDIATE`` transaction, so two workers can never both
+take the same vehicle or hand out the same password, and a submit costs a
+single commit. A submit carrying an idempotency key that was already applied
+returns the original result instead of toggling again (see
+vehicles/idempotency.py). Taking a vehicle or gas card that someone else has booked
+for now is refused (see vehicles/reservations.py). Every flip is also
+appended to the journal (see vehicles/journal.py) in that transaction.
+"""
+from vehicles.db import run_immediate
+from vehicles import analytics, events, history, idempotency, inventory, journal, localtime, passwords, reservations
+
+
+class CheckoutError(Exception):
+    """A submit that cannot be applied. The message is shown to the user."""
+
+
+def _toggle(status):
+    return 'returned' if status == 'taken' else 'taken'
+
+
+def _parse_balance(balance):
+    # When returning a taken gas card, balance is required and must be numeric
+    if not balance:
+        raise CheckoutError('归还加油卡请填写余额。')
+    try:
+        return float(balance)
+    except ValueError:
+        raise CheckoutError('请输入有效的余额数字。')
+
+
+def _check_reservation(db, kind, resource_id, user_id, what):
+    entry = reservations.holder(db, kind, resource_id, user_id)
+    if entry is not None:
+        raise CheckoutError(
+            f'{what}已被预约（{localtime.format_local(entry.starts, "%m-%d %H:%M")}'
+            f' 至 {localtime.format_local(entry.ends, "%m-%d %H:%M")}），请选择其他{what}。'
+        )
+
+
+def _replay(lookup):
+    try:
+        stored = lookup()
+    except idempotency.KeyMismatch:
+        raise CheckoutError('该提交标识已用于另一次提交，请刷新页面后重试。')
+    return None if stored is None else dict(stored, replayed=True)
+
+
+def _claim_password(db):
+    # an empty pool still yields a code, as before the pool existed
+    return passwords.claim(db) or passwords.generate_password()
+
+
+def submit(db, user_id=None, vehicle_plate='', gas_card_number='', balance='',
+           issue_password=True, honor_reservations=True, idempotency_key=None, retries=3):
+    """Take or return a vehicle and/or gas card.
+
+    Each selected resource is flipped between ``'taken'`` and ``'returned'``
+    with a conditional ``UPDATE`` so a concurrent change is detected rather
+    than overwritten. Returns a dict with the applied ``vehicle_action`` and
+    ``gas_action`` (``None`` when not selected) and the issued ``password``
+    (``None`` when ``issue_password`` is false). With ``honor_reservations``
+    a resource booked by another user for now cannot be taken.
+
+    With an ``idempotency_key`` the result is stored in the same
+    transaction; submitting the key again returns that result with
+    ``replayed`` set and changes nothing. Keys that are not well-formed are
+    ignored.
+
+    Raises :class:`CheckoutError` when a resource does not exist or the input
+    is invalid; nothing is written in that case.
+    """
+    if not vehicle_plate and not gas_card_number:
+        raise CheckoutError('必须选择车辆或加油卡之一才能提交。')
+    key = idempotency_key if idempotency.valid_key(idempotency_key) else None
+    request = idempotency.fingerprint(vehicle=vehicle_plate, gas_card=gas_card_number, balance=balance)
+    if key:
+        replay = _replay(lambda: idempotency.cached(key, user_id, request))
+        if replay is not None:
+            return replay
+
+    def work(db):
+        if key and not idempotency.claim(db, key, user_id, request):
+            replay = _replay(lambda: idempotency.lookup(db, key, user_id, request))
+            if replay is None:
+                raise CheckoutError('该提交正在处理，请稍后刷新页面。')
+            return replay
+        vehicle = None
+        gas = None
+        if vehicle_plate:
+            vehicle = db.execute('SELECT id, plate, status FROM vehicles WHERE plate = ?', (vehicle_plate,)).fetchone()
+            if not vehicle:
+                raise CheckoutError('未找到车辆。')
+
+        if gas_card_number:
+            gas = db.execute('SELECT id, card_number, balance, status FROM gas_cards WHERE card_number = ?', (gas_card_number,)).fetchone()
+            if not gas:
+                raise CheckoutError('未找到加油卡。')
+
+        result = {'vehicle_action': None, 'gas_action': None, 'password': None, 'replayed': False}
+        entries = []
+
+        if vehicle:
+            action = _toggle(vehicle['status'])
+            if action == 'taken' and honor_reservations:
+                _check_reservation(db, 'vehicle', vehicle['id'], user_id, '车辆')
+            cur = db.execute(
+                'UPDATE vehicles SET status = ? WHERE id = ? AND status = ?',
+                (action, vehicle['id'], vehicle['status'])
+            )
+            if cur.rowcount != 1:
+                raise CheckoutError('车辆状态已变化，请刷新后重试。')
+            result['vehicle_action'] = action
+            entries.append(journal.entry('vehicle', vehicle['id'], action, vehicle['plate'], user_id))
+            events.publish(db, 'vehicle', 'update', id=vehicle['id'], plate=vehicle['plate'], status=action)
+            if user_id is not None:
+                history.record_vehicle(db, vehicle['id'], user_id, action)
+            if action == 'taken':
+                analytics.on_take(db, 'vehicle', vehicle['id'], user_id)
+            else:
+                analytics.on_return(db, 'vehicle', vehicle['id'])
+
+        if gas:
+            action = _toggle(gas['status'])
+            if action == 'taken' and honor_reservations:
+                _check_reservation(db, 'gas_card', gas['id'], user_id, '加油卡')
+            if action == 'returned':
+                bal_val = _parse_balance(balance)
+                cur = db.execute(
+                    'UPDATE gas_cards SET balance = ?, status = ? WHERE id = ? AND status = ?',
+                    (bal_val, action, gas['id'], gas['status'])
+                )
+            else:
+                bal_val = None
+                cur = db.execute(
+                    'UPDATE gas_cards SET status = ? WHERE id = ? AND status = ?',
+                    (action, gas['id'], gas['status'])
+                )
+            if cur.rowcount != 1:
+                raise CheckoutError('加油卡状态已变化，请刷新后重试。')
+            result['gas_action'] = action
+            entries.append(journal.entry('gas_card', gas['id'], action, gas['card_number'], user_id, bal_val))
+            events.publish(
+                db, 'gas_card', 'update', id=gas['id'], card_number=gas['card_number'], status=action,
+                balance=bal_val if bal_val is not None else gas['balance']
+            )
+            if user_id is not None:
+                # record balance at the moment of return
+                history.record_gas_card(db, gas['id'], user_id, action, bal_val)
+            if action == 'taken':
+                analytics.on_take(db, 'gas_card', gas['id'], user_id, gas['balance'])
+            else:
+                analytics.on_return(db, 'gas_card', gas['id'], bal_val)
+
+        journal.append(db, entries)
+        inventory.bump(db)
+
+        if issue_password:
+            result['password'] = _claim_password(db)
+
+        if key:
+            idempotency.store(db, key, result)
+        return result
+
+    result = run_immediate(db, work, retries=retries)
+    if key and not result['replayed']:
+        idempotency.remember(key, user_id, request, result)
+    return result
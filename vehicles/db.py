@@ -1,16 +1,134 @@
+import os
+import queue
+import random
 import sqlite3
+import threading
+import time
 from flask import g, current_app
 import click
-from datetime import datetime
+from vehicles import migrations
+
+
+class ConnectionPool:
+    """Per-process pool of SQLite connections.
+
+    Connections are opened lazily with the tuned pragmas applied once and are
+    then reused across requests. Up to ``size`` idle connections are kept;
+    extra connections opened under load are closed when released. The pool
+    remembers the pid that created it so a forked worker never reuses a
+    handle inherited from its parent.
+
+    ``factory`` is the ``sqlite3.Connection`` subclass to open and every
+    callable in ``on_connect`` is called with each new connection; the
+    instrumentation layer uses both to wrap connections.
+    """
+
+    # failures that make a released connection unusable
+    errors = (sqlite3.Error,)
+
+    def __init__(self, database, size=8, busy_timeout=5000, pragmas=()):
+        self.database = database
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.pragmas = list(pragmas)
+        self.factory = sqlite3.Connection
+        self.on_connect = []
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Inherited connections are dropped, not closed: closing them here
+        # would touch SQLite state the parent process still owns.
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.busy_timeout / 1000.0,
+            check_same_thread=False,
+            factory=self.factory,
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        for callback in self.on_connect:
+            callback(conn)
+        return conn
+
+    def idle(self):
+        return self._idle.qsize()
+
+    def acquire(self):
+        self._check_pid()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except self.errors:
+            conn.close()
+            return
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def backend(db):
+    """``'sqlite'`` or ``'postgres'``: the kind of server behind ``db``, for
+    the few statements whose spelling differs (see vehicles/postgres.py)."""
+    return getattr(db, 'backend', 'sqlite')
+
+
+def create_pool(app):
+    config = app.config
+    url = config['DATABASE_URL']
+    if url and url.split(':', 1)[0] in ('postgres', 'postgresql'):
+        from vehicles import postgres
+        return postgres.create_pool(app)
+    database = config['DATABASE']
+    if url:
+        if not url.startswith('sqlite:///'):
+            raise ValueError(f'unsupported DATABASE_URL {url!r}; use sqlite:///<path> or postgresql://...')
+        database = url[len('sqlite:///'):]
+    pragmas = [
+        ('journal_mode', config['DB_JOURNAL_MODE']),
+        ('synchronous', config['DB_SYNCHRONOUS']),
+        ('cache_size', int(config['DB_CACHE_SIZE'])),
+        ('mmap_size', int(config['DB_MMAP_SIZE'])),
+        ('busy_timeout', int(config['DB_BUSY_TIMEOUT'])),
+    ]
+    return ConnectionPool(
+        database,
+        size=int(config['DB_POOL_SIZE']),
+        busy_timeout=int(config['DB_BUSY_TIMEOUT']),
+        pragmas=pragmas,
+    )
 
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-                current_app.config['DATABASE'],
-                detect_types=sqlite3.PARSE_DECLTYPES
-            )
-        g.db.row_factory=sqlite3.Row
+        g.db = current_app.extensions['db_pool'].acquire()
 
     return g.db
 
@@ -24,19 +142,74 @@ def close_db(e=None):
             try:
                 db.commit()
             except Exception:
-                # If commit fails, ensure the connection is closed.
+                # If commit fails, the pool rolls back before reuse.
                 pass
         else:
             db.rollback()
 
-        db.close()
+        current_app.extensions['db_pool'].release(db)
+
+
+# PostgreSQL serialization failure, deadlock and lock timeout
+RETRYABLE_SQLSTATES = ('40001', '40P01', '55P03')
+
+
+def is_busy_error(exc):
+    """True if ``exc`` is SQLite reporting SQLITE_BUSY / SQLITE_LOCKED, or
+    PostgreSQL aborting a transaction that is worth retrying."""
+    if getattr(exc, 'sqlstate', None) in RETRYABLE_SQLSTATES:
+        return True
+    if not isinstance(exc, sqlite3.OperationalError):
+        return False
+    message = str(exc).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def stream(db, sql, params=()):
+    """Execute a query whose rows the caller iterates once, e.g. to stream
+    a response. On SQLite that is a plain cursor, which steps the query as
+    rows are read; on PostgreSQL a server-side cursor, so the rows are not
+    all held in memory at once."""
+    if backend(db) == 'postgres':
+        return db.stream(sql, params)
+    return db.execute(sql, params)
+
+
+def run_immediate(db, work, retries=3, backoff=0.05):
+    """Run ``work(db)`` in a single ``BEGIN IMMEDIATE`` transaction.
+
+    The write lock is taken up front so concurrent workers serialize on the
+    transaction instead of failing halfway through it. If SQLite still
+    reports the database as busy the whole unit of work is retried up to
+    ``retries`` times with jittered exponential backoff. Any other error
+    rolls back and propagates.
+    """
+    attempt = 0
+    while True:
+        if db.in_transaction:
+            db.commit()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            result = work(db)
+            db.commit()
+            return result
+        except Exception as e:
+            if db.in_transaction:
+                db.rollback()
+            if not is_busy_error(e) or attempt >= retries:
+                raise
+            attempt += 1
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.0))
 
 
 def init_database():
     db = get_db()
 
-    with current_app.open_resource('schema.sql') as f:
+    schema = 'schema_postgres.sql' if backend(db) == 'postgres' else 'schema.sql'
+    with current_app.open_resource(schema) as f:
         db.executescript(f.read().decode('utf-8'))
+    migrations.stamp(db, migrations.latest_version())
+    db.commit()
 
 
 @click.command('init-db')
@@ -45,9 +218,23 @@ def init_db_command():
     click.echo('Initialized the database')
 
 
-sqlite3.register_converter('timestamp', lambda v: datetime.fromisoformat(v.decode()))
+@click.command('migrate')
+@click.option('--dry-run', is_flag=True, help='List pending migrations without applying them.')
+def migrate_command(dry_run):
+    """Upgrade the database schema in place."""
+    db = get_db()
+    todo = migrations.pending(db)
+    click.echo(f'Schema version {migrations.current_version(db)}, latest {migrations.latest_version()}')
+    for version, func in todo:
+        click.echo(f'  {version:04d} {func.__name__}: {(func.__doc__ or "").strip()}')
+    if dry_run or not todo:
+        return
+    migrations.upgrade(db)
+    click.echo(f'Migrated to version {migrations.current_version(db)}')
 
 
 def init_db(app):
+    app.extensions['db_pool'] = create_pool(app)
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_command)
@@ -0,0 +1,48 @@
+"""Conditional GET for rendered pages.
+
+Pages built from the inventory and history only change when the
+``inventory`` data version is bumped (every write to vehicles, gas cards or
+the record tables goes through :func:`vehicles.inventory.bump`). The ETag
+combines that version with everything else the page depends on: the URL, the
+logged-in user and their identification state, and the deployed templates
+and assets.
+A browser revalidating an unchanged page gets ``304 Not Modified`` without
+the view running at all.
+"""
+import hashlib
+from functools import wraps
+from flask import current_app, g, make_response, request, session
+from vehicles.db import get_db
+from vehicles import inventory
+
+
+def page_etag():
+    user = g.get('user')
+    parts = (
+        request.full_path,
+        inventory.current_version(get_db()),
+        user['id'] if user else '',
+        user['is_identified'] if user else '',
+        session.get('role', ''),
+        current_app.config.get('RELEASE_ID', ''),
+    )
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:20]
+
+
+def conditional(view):
+    @wraps(view)
+    def wrapped_view(**kwargs):
+        # pending flash messages are part of the page but not of the ETag
+        if session.get('_flashes'):
+            return view(**kwargs)
+        etag = page_etag()
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(**kwargs))
+        response.set_etag(etag)
+        # cached copies must always be revalidated, and stay private
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    return wrapped_view
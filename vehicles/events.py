@@ -0,0 +1,204 @@
+"""Live vehicle/gas card status events.
+
+Writers call :func:`publish` in the same transaction as the status change;
+the event lands in ``status_events``, whose autoincrement id is a global
+change sequence shared by all gunicorn workers.
+
+Each worker runs one :class:`Broker` thread that polls the table for new ids
+while at least one client is subscribed and wakes the subscribed streams,
+so the database is polled once per worker rather than once per open
+connection. The table is trimmed to ``EVENTS_RETENTION`` rows by id
+watermark, like the history tables.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from flask import current_app
+
+
+# seconds of silence before a stream sends a keepalive comment
+HEARTBEAT = 15.0
+
+
+def publish(db, kind, op, **fields):
+    """Record a change of ``kind`` ('vehicle' or 'gas_card').
+
+    ``op`` is 'update', 'add', 'delete' or 'reload' (many rows changed at
+    once; clients should reload the page).
+    """
+    payload = json.dumps(dict(fields, type=kind, op=op), ensure_ascii=False)
+    cur = db.execute(
+        'INSERT INTO status_events (kind, payload, created) VALUES (?, ?, ?)',
+        (kind, payload, int(time.time()))
+    )
+    event_id = cur.lastrowid
+    config = current_app.config
+    if config['MAINTENANCE_INLINE'] and event_id % max(int(config['EVENTS_PRUNE_BATCH']), 1) == 0:
+        db.execute('DELETE FROM status_events WHERE id <= ?', (event_id - int(config['EVENTS_RETENTION']),))
+    return event_id
+
+
+def latest_id(db):
+    return db.execute('SELECT MAX(id) FROM status_events').fetchone()[0] or 0
+
+
+def fetch_since(db, last_id, limit=500):
+    return [
+        (row[0], row[1]) for row in db.execute(
+            'SELECT id, payload FROM status_events WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, limit)
+        )
+    ]
+
+
+class Broker:
+    def __init__(self, pool, interval=0.5, backlog=1000):
+        self.pool = pool
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=backlog)
+        self._subscribers = 0
+        self._streams = 0
+        self._wakers = set()
+        self._last_id = None
+        self._pid = None
+        self._thread = None
+
+    def _ensure_started(self):
+        with self._cond:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            # first use in this process (or after a fork): start fresh
+            self._pid = os.getpid()
+            self._events.clear()
+            self._last_id = None
+            self._thread = threading.Thread(target=self._run, name='events-broker', daemon=True)
+            self._thread.start()
+
+    def _poll(self):
+        conn = self.pool.acquire()
+        try:
+            if self._last_id is None:
+                return [], latest_id(conn)
+            rows = fetch_since(conn, self._last_id)
+            return rows, rows[-1][0] if rows else self._last_id
+        finally:
+            self.pool.release(conn)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._subscribers == 0:
+                    self._cond.wait()
+            try:
+                rows, high_water = self._poll()
+            except Exception:
+                rows, high_water = [], self._last_id
+            if high_water != self._last_id:
+                with self._cond:
+                    self._events.extend(rows)
+                    self._last_id = high_water
+                    self._cond.notify_all()
+                    wakers = list(self._wakers)
+                for waker in wakers:
+                    waker()
+            time.sleep(self.interval)
+
+    def _pending(self, last_id):
+        return [e for e in self._events if e[0] > last_id]
+
+    def _behind(self, last_id, pending):
+        # True when the subscriber needs events the in-memory window lacks:
+        # it connected with an older id than the broker has buffered.
+        if pending:
+            return pending[0][0] > last_id + 1
+        return self._last_id is not None and self._last_id > last_id
+
+    def catch_up(self, last_id):
+        """Read events after ``last_id`` from the database (blocking)."""
+        conn = self.pool.acquire()
+        try:
+            return fetch_since(conn, last_id)
+        finally:
+            self.pool.release(conn)
+
+    def attach(self, waker=None):
+        """Register a subscriber. ``waker()`` is called from the broker
+        thread whenever new events arrive."""
+        self._ensure_started()
+        with self._cond:
+            self._subscribers += 1
+            if waker is not None:
+                self._wakers.add(waker)
+            self._cond.notify_all()
+
+    def detach(self, waker=None):
+        with self._cond:
+            self._subscribers -= 1
+            self._wakers.discard(waker)
+
+    def claim_stream(self, limit):
+        """Take one of ``limit`` slots for a stream that holds a thread
+        (see vehicles/routes/events.py); False when all are in use."""
+        with self._cond:
+            if self._streams >= limit:
+                return False
+            self._streams += 1
+            return True
+
+    def release_stream(self):
+        with self._cond:
+            self._streams -= 1
+
+    def available(self, last_id):
+        """Return ``(pending, behind)`` for a subscriber at ``last_id``
+        without blocking; when ``behind`` is true call :meth:`catch_up`."""
+        with self._cond:
+            pending = self._pending(last_id)
+            return pending, self._behind(last_id, pending)
+
+    def resume_id(self, last_id):
+        # nothing left in the table to catch up on (pruned): skip ahead
+        return max(last_id, self._last_id or 0)
+
+    def subscribe(self, last_id, duration, heartbeat=HEARTBEAT):
+        """Yield ``(id, payload)`` events after ``last_id`` for ``duration``
+        seconds; yields ``None`` when ``heartbeat`` seconds pass quietly."""
+        self.attach()
+        try:
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                with self._cond:
+                    pending = self._pending(last_id)
+                    if not pending and not self._behind(last_id, pending):
+                        self._cond.wait(min(heartbeat, max(deadline - time.monotonic(), 0)))
+                        pending = self._pending(last_id)
+                    behind = self._behind(last_id, pending)
+                if behind:
+                    pending = self.catch_up(last_id)
+                    if not pending:
+                        last_id = self.resume_id(last_id)
+                if not pending:
+                    yield None
+                    continue
+                for event in pending:
+                    last_id = event[0]
+                    yield event
+        finally:
+            self.detach()
+
+
+def sse_frame(event):
+    """Format an ``(id, payload)`` event, or ``None`` for a keepalive."""
+    if event is None:
+        return ': keepalive\n\n'
+    return f'id: {event[0]}\ndata: {event[1]}\n\n'
+
+
+def init_events(app):
+    app.extensions['events_broker'] = Broker(
+        app.extensions['db_pool'],
+        interval=float(app.config['EVENTS_POLL_INTERVAL']),
+    )
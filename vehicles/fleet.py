@@ -0,0 +1,59 @@
+"""Vehicles and gas cards: adding and removing them.
+
+Every change bumps the ``inventory`` data version (see vehicles/inventory.py),
+publishes a status event (see vehicles/events.py) and is journaled (see
+vehicles/journal.py) in the caller's transaction; the caller commits, e.g.
+through ``run_immediate``. Reads go through the inventory cache, and status
+changes go through vehicles/checkout.py.
+"""
+from vehicles import analytics, events, inventory, journal, reservations
+
+
+def add_vehicle(db, plate):
+    """Insert a vehicle. Returns its id; raises ``db.IntegrityError`` when
+    the plate exists."""
+    vehicle_id = db.execute('INSERT INTO vehicles (plate) VALUES (?)', (plate,)).lastrowid
+    inventory.bump(db)
+    journal.append(db, [journal.entry('vehicle', vehicle_id, 'add', plate)])
+    events.publish(db, 'vehicle', 'add', id=vehicle_id, plate=plate, status='returned')
+    return vehicle_id
+
+
+def delete_vehicle(db, vehicle_id):
+    """Delete a vehicle. Returns its plate, or ``None`` if there was none."""
+    row = db.execute('SELECT plate FROM vehicles WHERE id = ?', (vehicle_id,)).fetchone()
+    reservations.forget(db, 'vehicle', vehicle_id)
+    db.execute('DELETE FROM vehicles WHERE id = ?', (vehicle_id,))
+    inventory.bump(db)
+    analytics.forget(db, 'vehicle', vehicle_id)
+    if row is None:
+        return None
+    journal.append(db, [journal.entry('vehicle', vehicle_id, 'delete', row['plate'])])
+    events.publish(db, 'vehicle', 'delete', id=vehicle_id, plate=row['plate'])
+    return row['plate']
+
+
+def add_gas_card(db, card_number, balance=0.0):
+    """Insert a gas card. Returns its id; raises ``db.IntegrityError`` when
+    the number exists."""
+    card_id = db.execute(
+        'INSERT INTO gas_cards (card_number, balance) VALUES (?, ?)', (card_number, balance)
+    ).lastrowid
+    inventory.bump(db)
+    journal.append(db, [journal.entry('gas_card', card_id, 'add', card_number, balance=balance)])
+    events.publish(db, 'gas_card', 'add', id=card_id, card_number=card_number, balance=balance, status='returned')
+    return card_id
+
+
+def delete_gas_card(db, card_id):
+    """Delete a gas card. Returns its number, or ``None`` if there was none."""
+    row = db.execute('SELECT card_number FROM gas_cards WHERE id = ?', (card_id,)).fetchone()
+    reservations.forget(db, 'gas_card', card_id)
+    db.execute('DELETE FROM gas_cards WHERE id = ?', (card_id,))
+    inventory.bump(db)
+    analytics.forget(db, 'gas_card', card_id)
+    if row is None:
+        return None
+    journal.append(db, [journal.entry('gas_card', card_id, 'delete', row['card_number'])])
+    events.publish(db, 'gas_card', 'delete', id=card_id, card_number=row['card_number'])
+    return row['card_number']
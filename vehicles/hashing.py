@@ -0,0 +1,77 @@
+"""Password hashing policy for user logins.
+
+``PASSWORD_HASH_METHOD`` is a werkzeug method string such as
+``pbkdf2:sha256:260000`` or ``scrypt:32768:8:1``. New hashes use it, and a
+successful login whose stored hash was made with different parameters is
+rehashed transparently (see :func:`needs_rehash`).
+
+Hashing and verification run in a small per-worker process pool of
+``PASSWORD_HASH_WORKERS`` processes, so a burst of logins occupies at most
+that many cores and request threads only wait on a future. With 0 workers,
+or inside a daemonic process (a ``multiprocessing.Pool`` worker, which may
+not start children), the work runs inline.
+"""
+import os
+import threading
+from functools import lru_cache
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+_lock = threading.Lock()
+_executor = None
+_pid = None
+
+
+def _get_executor(workers):
+    global _executor, _pid
+    # imported on first use: multiprocessing is not needed to serve pages
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    with _lock:
+        if _executor is None or _pid != os.getpid():
+            # a pool inherited across a fork is unusable; start a new one.
+            # spawn, because forking a threaded server process is unsafe
+            _executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            _pid = os.getpid()
+        return _executor
+
+
+def _inline():
+    import multiprocessing
+    return multiprocessing.current_process().daemon
+
+
+def _run(func, *args):
+    workers = int(current_app.config['PASSWORD_HASH_WORKERS'])
+    if workers <= 0 or _inline():
+        return func(*args)
+    from concurrent.futures.process import BrokenProcessPool
+    try:
+        return _get_executor(workers).submit(func, *args).result()
+    except BrokenProcessPool:
+        # a hashing process died; start a fresh pool next time
+        global _executor
+        with _lock:
+            _executor = None
+        return func(*args)
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def verify(stored, password):
+    return _run(check_password_hash, stored, password)
+
+
+@lru_cache(maxsize=8)
+def _prefix(method):
+    # the method as werkzeug writes it, with its defaults filled in
+    # (``pbkdf2:sha256`` -> ``pbkdf2:sha256:<iterations>``)
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def needs_rehash(stored):
+    """True when ``stored`` was not made with the configured method."""
+    return stored.split('$', 1)[0] != _prefix(current_app.config['PASSWORD_HASH_METHOD'])
@@ -0,0 +1,173 @@
+"""Take/return history storage.
+
+``record_vehicles`` and ``record_gas_cards`` hold the most recent events and
+stay small. Older rows are moved, not deleted, into ``*_archive`` tables
+with the same ids, so every archived id is lower than every live one.
+
+Retention is enforced with an id watermark: after every
+``HISTORY_PRUNE_BATCH`` inserts, rows with ``id <= newest - HISTORY_RETENTION``
+are moved in one primary-key range scan. The cost of an insert therefore
+does not depend on how much history has accumulated. With
+``MAINTENANCE_INLINE`` off, inserts never prune and ``flask worker`` does it
+(see vehicles/worker.py).
+"""
+import json
+from flask import current_app
+from vehicles import localtime
+from vehicles.db import stream
+
+
+VEHICLE_COLUMNS = 'id, vehicle_id, user_id, action, timestamp'
+GAS_CARD_COLUMNS = 'id, user_id, gas_card_id, action, balance, timestamp'
+
+TABLES = {
+    'record_vehicles': ('record_vehicles_archive', VEHICLE_COLUMNS),
+    'record_gas_cards': ('record_gas_cards_archive', GAS_CARD_COLUMNS),
+}
+
+
+def prune(db, table, retention, archive=True):
+    """Move rows older than the newest ``retention`` ids of ``table`` to its
+    archive (or drop them when ``archive`` is false). Returns the number of
+    rows moved."""
+    archive_table, columns = TABLES[table]
+    newest = db.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0]
+    if newest is None:
+        return 0
+    watermark = newest - retention
+    if watermark <= 0:
+        return 0
+    if archive:
+        db.execute(
+            f'INSERT OR IGNORE INTO {archive_table} ({columns}) '
+            f'SELECT {columns} FROM {table} WHERE id <= ?',
+            (watermark,)
+        )
+    return db.execute(f'DELETE FROM {table} WHERE id <= ?', (watermark,)).rowcount
+
+
+def _maybe_prune(db, table, new_id):
+    config = current_app.config
+    if not config['MAINTENANCE_INLINE']:
+        return
+    batch = max(int(config['HISTORY_PRUNE_BATCH']), 1)
+    if new_id % batch == 0:
+        prune(db, table, int(config['HISTORY_RETENTION']), config['HISTORY_ARCHIVE'])
+
+
+def record_vehicle(db, vehicle_id, user_id, action):
+    cur = db.execute(
+        'INSERT INTO record_vehicles (vehicle_id, user_id, action) VALUES (?, ?, ?)',
+        (vehicle_id, user_id, action)
+    )
+    _maybe_prune(db, 'record_vehicles', cur.lastrowid)
+    return cur.lastrowid
+
+
+def record_gas_card(db, gas_card_id, user_id, action, balance=None):
+    cur = db.execute(
+        'INSERT INTO record_gas_cards (user_id, gas_card_id, action, balance) VALUES (?, ?, ?, ?)',
+        (user_id, gas_card_id, action, balance)
+    )
+    _maybe_prune(db, 'record_gas_cards', cur.lastrowid)
+    return cur.lastrowid
+
+
+# Query side: one description per resource kind, shared by the HTML pages
+# and the streaming JSON API.
+KINDS = {
+    'vehicle': {
+        'tables': ('record_vehicles', 'record_vehicles_archive'),
+        'columns': 'r.id, r.action, r.timestamp, v.plate AS vehicle_plate, u.username',
+        'joins': 'LEFT JOIN vehicles v ON r.vehicle_id = v.id LEFT JOIN users u ON r.user_id = u.id',
+        'resource': 'r.vehicle_id = (SELECT id FROM vehicles WHERE plate = ?)',
+    },
+    'gas': {
+        'tables': ('record_gas_cards', 'record_gas_cards_archive'),
+        'columns': 'r.id, r.action, r.timestamp, g.card_number AS gas_card_number, r.balance, u.username',
+        'joins': 'LEFT JOIN gas_cards g ON r.gas_card_id = g.id LEFT JOIN users u ON r.user_id = u.id',
+        'resource': 'r.gas_card_id = (SELECT id FROM gas_cards WHERE card_number = ?)',
+    },
+}
+
+ACTIONS = ('taken', 'returned')
+
+
+def _where(kind, before_id, resource, username, since, until, action):
+    clauses, params = [], []
+    if before_id is not None:
+        clauses.append('r.id < ?')
+        params.append(before_id)
+    if resource:
+        clauses.append(KINDS[kind]['resource'])
+        params.append(resource)
+    if username:
+        clauses.append('r.user_id = (SELECT id FROM users WHERE username = ?)')
+        params.append(username)
+    # `since` and `until` are inclusive local days; malformed ones are ignored
+    bounds = since and localtime.day_bounds(since)
+    if bounds:
+        clauses.append('r.timestamp >= ?')
+        params.append(bounds[0])
+    bounds = until and localtime.day_bounds(until)
+    if bounds:
+        clauses.append('r.timestamp < ?')
+        params.append(bounds[1])
+    if action:
+        clauses.append('r.action = ?')
+        params.append(action)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def iter_history(db, kind, before_id=None, limit=None, resource=None,
+                 username=None, since=None, until=None, action=None):
+    """Yield history rows of ``kind`` ('vehicle' or 'gas'), newest first.
+
+    ``before_id`` is the keyset cursor: only rows with a smaller id are
+    returned, so the next page starts at the last id of the previous one.
+    Rows are read from the live table first and then from the archive;
+    archived ids are always lower than live ones, so the order is preserved
+    without a UNION. Rows are streamed from the cursor, never collected.
+    """
+    spec = KINDS[kind]
+    where, params = _where(kind, before_id, resource, username, since, until, action)
+    remaining = limit
+    for table in spec['tables']:
+        if remaining is not None and remaining <= 0:
+            return
+        sql = f"SELECT {spec['columns']} FROM {table} r {spec['joins']}{where} ORDER BY r.id DESC"
+        args = list(params)
+        if remaining is not None:
+            sql += ' LIMIT ?'
+            args.append(remaining)
+        for row in stream(db, sql, args):
+            if remaining is not None:
+                remaining -= 1
+            yield row
+
+
+def page(db, kind, size, **filters):
+    """Return ``(rows, next_before_id)`` for one page of history;
+    ``next_before_id`` is ``None`` on the last page."""
+    rows = list(iter_history(db, kind, limit=size + 1, **filters))
+    if len(rows) > size:
+        rows = rows[:size]
+        return rows, rows[-1]['id']
+    return rows, None
+
+
+def dump_json(rows, limit):
+    """Yield ``rows`` as a ``{"records": [...], "next_before_id": ...}`` JSON
+    document, written incrementally: rows go out as they are read and the
+    cursor for the next page closes the object."""
+    yield '{"records": ['
+    last_id = None
+    count = 0
+    for row in rows:
+        if count:
+            yield ','
+        yield json.dumps(dict(row), ensure_ascii=False, default=str)
+        last_id = row['id']
+        count += 1
+    next_before_id = last_id if count == limit else None
+    yield '], "next_before_id": %s}' % json.dumps(next_before_id)
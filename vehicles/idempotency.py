@@ -0,0 +1,152 @@
+"""Idempotency keys for ``/lock/submit``.
+
+A submit toggles the selected vehicle or gas card, so a double click, a
+mobile retry or a proxy retry of the same form would toggle it back and use
+up another temporary password. The home form therefore carries a one-time
+key (made in the browser, so the cached page stays the same for everyone)
+and :func:`vehicles.checkout.submit` stores the result under that key in
+the ``idempotency_keys`` table, in the transaction that applied it. A
+replay of the key gets the stored result back and changes nothing. The key
+is claimed before the resources are touched, so of two concurrent submits
+with one key the second waits for the first and replays its result instead
+of failing on the resources the first one already toggled.
+
+Each worker keeps recent results in an LRU in front of the table, so a
+replay that reaches the same worker costs no query. Keys expire after
+``IDEMPOTENCY_TTL`` seconds; the worker's ``prune`` job (or the submit
+itself while ``MAINTENANCE_INLINE`` is on) deletes expired rows. Only
+applied submits are stored: one that failed changed nothing and may simply
+run again. A key replayed by another user or with different form values is
+refused rather than answered with someone else's result.
+"""
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+
+# what the browser sends: 16-64 URL-safe characters
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+class KeyMismatch(Exception):
+    """The key was used by another user or for another request."""
+
+
+def valid_key(key):
+    return bool(key) and KEY_PATTERN.match(key) is not None
+
+
+class ResultCache:
+    """Per-worker LRU of ``key -> (user_id, request, result)``."""
+
+    def __init__(self, maxsize=4096, ttl=86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1:]
+
+    def put(self, key, user_id, request, result):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, user_id, request, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _cache():
+    return current_app.extensions['idempotency_cache']
+
+
+def fingerprint(**fields):
+    """Canonical text of the request values a key is bound to."""
+    return json.dumps(fields, sort_keys=True, ensure_ascii=False)
+
+
+def _check(stored_user_id, stored_request, user_id, request):
+    if stored_user_id != (user_id or 0) or stored_request != request:
+        raise KeyMismatch()
+
+
+def cached(key, user_id, request):
+    """The result stored under ``key`` in this worker's cache, or ``None``.
+    Raises :class:`KeyMismatch` when it was stored for another user or
+    ``request``."""
+    entry = _cache().get(key)
+    if entry is None:
+        return None
+    _check(entry[0], entry[1], user_id, request)
+    return entry[2]
+
+
+def lookup(db, key, user_id, request):
+    """Like :func:`cached`, from the table."""
+    ttl = int(current_app.config['IDEMPOTENCY_TTL'])
+    row = db.execute(
+        'SELECT user_id, request, result FROM idempotency_keys WHERE key = ? AND created > ?',
+        (key, int(time.time()) - ttl)
+    ).fetchone()
+    if row is None:
+        return None
+    _check(row['user_id'], row['request'], user_id, request)
+    result = json.loads(row['result'])
+    _cache().put(key, row['user_id'], row['request'], result)
+    return result
+
+
+def claim(db, key, user_id, request):
+    """Reserve ``key`` in the caller's transaction before anything is
+    changed. Returns ``False`` when another submit holds it; on PostgreSQL
+    this waits until that submit has committed or rolled back, so
+    :func:`lookup` then sees its result."""
+    now = int(time.time())
+    ttl = int(current_app.config['IDEMPOTENCY_TTL'])
+    if current_app.config['MAINTENANCE_INLINE']:
+        prune(db, ttl, now)
+    else:
+        # an expired key the worker has not pruned yet is free again
+        db.execute('DELETE FROM idempotency_keys WHERE key = ? AND created <= ?', (key, now - ttl))
+    return db.execute(
+        "INSERT OR IGNORE INTO idempotency_keys (key, user_id, request, result, created) VALUES (?, ?, ?, '', ?)",
+        (key, user_id or 0, request, now)
+    ).rowcount == 1
+
+
+def store(db, key, result):
+    """Record ``result`` under ``key``, claimed earlier in the same
+    transaction; call :func:`remember` once it has committed."""
+    db.execute('UPDATE idempotency_keys SET result = ? WHERE key = ?', (json.dumps(result), key))
+
+
+def remember(key, user_id, request, result):
+    _cache().put(key, user_id or 0, request, result)
+
+
+def prune(db, ttl, now=None):
+    """Delete keys older than ``ttl`` seconds."""
+    now = int(time.time()) if now is None else now
+    return db.execute('DELETE FROM idempotency_keys WHERE created <= ?', (now - ttl,)).rowcount
+
+
+def init_idempotency(app):
+    app.extensions['idempotency_cache'] = ResultCache(
+        maxsize=int(app.config['IDEMPOTENCY_CACHE_SIZE']),
+        ttl=float(app.config['IDEMPOTENCY_TTL']),
+    )
@@ -0,0 +1,97 @@
+"""Per-worker cache of the vehicle and gas card lists.
+
+Every change to ``vehicles`` or ``gas_cards`` must call :func:`bump` in the
+same transaction. The counter lives in the ``data_versions`` table, so a
+change committed by any gunicorn worker is seen by all of them: a cached
+snapshot is served only while its version matches the stored one, which
+costs a single primary-key lookup instead of two full table reads.
+"""
+import threading
+from flask import current_app
+from vehicles import events
+
+
+def current_version(db, name='inventory'):
+    row = db.execute('SELECT version FROM data_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump(db, name='inventory'):
+    db.execute(
+        'INSERT INTO data_versions (name, version) VALUES (?, 1) '
+        'ON CONFLICT (name) DO UPDATE SET version = version + 1',
+        (name,)
+    )
+
+
+def _count_statuses(rows):
+    counts = {'taken': 0, 'returned': 0}
+    for row in rows:
+        counts[row['status']] = counts.get(row['status'], 0) + 1
+    return counts
+
+
+class InventoryCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._snapshot = ([], [], 0)
+        self._counts = {}
+
+    def snapshot(self, db):
+        """Return ``(vehicles, gas_cards, last_event_id)``.
+
+        ``last_event_id`` is the newest status event already reflected in the
+        rows, so a live-update stream can resume right after it.
+        """
+        # Read the version and event id before the rows: if a writer commits
+        # in between we cache newer rows under older markers, which at worst
+        # reloads or replays an already-applied event.
+        version = current_version(db)
+        with self._lock:
+            if self._version == version:
+                return self._snapshot
+        last_event_id = events.latest_id(db)
+        vehicles = db.execute('SELECT * FROM vehicles').fetchall()
+        gas_cards = db.execute('SELECT * FROM gas_cards').fetchall()
+        counts = {kind: _count_statuses(rows) for kind, rows in (('vehicle', vehicles), ('gas_card', gas_cards))}
+        with self._lock:
+            self._version = version
+            self._snapshot = (vehicles, gas_cards, last_event_id)
+            self._counts = counts
+        return self._snapshot
+
+    def summary(self, db):
+        """Return ``(counts, last_event_id)`` where ``counts[kind][status]``
+        is the number of vehicles or gas cards with that status."""
+        _, _, last_event_id = self.snapshot(db)
+        with self._lock:
+            return self._counts, last_event_id
+
+    def get(self, db):
+        vehicles, gas_cards, _ = self.snapshot(db)
+        return vehicles, gas_cards
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+
+
+def get_inventory(db):
+    """Return ``(vehicles, gas_cards)`` rows, served from cache when current."""
+    return current_app.extensions['inventory_cache'].get(db)
+
+
+def get_snapshot(db):
+    """Like :func:`get_inventory`, plus the id of the last status event."""
+    return current_app.extensions['inventory_cache'].snapshot(db)
+
+
+def get_summary(db):
+    """Status counts and the id of the last status event; see
+    :meth:`InventoryCache.summary`."""
+    return current_app.extensions['inventory_cache'].summary(db)
+
+
+def init_inventory(app):
+    app.extensions['inventory_cache'] = InventoryCache()
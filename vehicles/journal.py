@@ -0,0 +1,360 @@
+"""Append-only journal of vehicle and gas card changes, with snapshots.
+
+``status`` columns only hold the present and the record tables are capped,
+so past state cannot be read back from them. Every change to a vehicle or
+gas card is therefore also appended to ``journal``: ``add`` and ``delete``
+from vehicles/fleet.py and vehicles/bulk.py, ``taken`` and ``returned``
+(with the user and, for gas cards, the balance handed back) from
+vehicles/checkout.py. The rows are written with one ``executemany`` in the
+transaction that makes the change, so they share its single commit and
+the journal never disagrees with the tables. Journal rows are never updated
+or deleted.
+
+``journal_snapshots`` holds the full state as of a journal id. The state
+at any time is the latest snapshot taken before it plus the journal rows
+after that snapshot, so a point-in-time read or a restore replays at most
+the events since one snapshot rather than the whole history. The worker's
+``snapshot`` job (see vehicles/worker.py) takes one once
+``JOURNAL_SNAPSHOT_EVERY`` events have accumulated. The first snapshot,
+taken when the journal was added, holds the state that existed before it
+and is always kept.
+
+``flask replay`` reads it: ``state`` at a time, ``who`` had a vehicle or
+gas card on a day, and ``restore``, which rewrites ``vehicles`` and
+``gas_cards`` from the journal after a bad restore or a manual mistake.
+"""
+import json
+import time
+import click
+from flask.cli import AppGroup
+from vehicles.db import backend, get_db, run_immediate
+from vehicles import analytics, events, inventory, localtime, reservations
+
+
+KINDS = {
+    'vehicle': {'table': 'vehicles', 'key': 'plate'},
+    'gas_card': {'table': 'gas_cards', 'key': 'card_number'},
+}
+OPS = ('add', 'delete', 'taken', 'returned')
+COLUMNS = 'id, created, kind, resource_id, key, op, user_id, balance'
+
+
+def entry(kind, resource_id, op, key=None, user_id=None, balance=None):
+    """One journal row, for :func:`append`."""
+    return (kind, resource_id, key, op, user_id, balance)
+
+
+def append(db, entries):
+    """Append ``entries`` in the caller's transaction."""
+    now = int(time.time())
+    db.executemany(
+        'INSERT INTO journal (created, kind, resource_id, key, op, user_id, balance) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [(now,) + tuple(e) for e in entries]
+    )
+
+
+def append_added(db, kind, keys):
+    """Journal ``add`` for the just inserted rows of ``kind`` with ``keys``."""
+    spec = KINDS[kind]
+    table, key = spec['table'], spec['key']
+    balance = 'balance' if kind == 'gas_card' else 'NULL'
+    if backend(db) == 'postgres':
+        where, param = f'{key} = ANY(?)', list(keys)
+    else:
+        where, param = f'{key} IN (SELECT value FROM json_each(?))', json.dumps(list(keys))
+    db.execute(
+        'INSERT INTO journal (created, kind, resource_id, key, op, user_id, balance) '
+        f"SELECT ?, ?, id, {key}, 'add', NULL, {balance} FROM {table} WHERE {where}",
+        (int(time.time()), kind, param)
+    )
+
+
+# -- state ---------------------------------------------------------------
+#
+# A state is {kind: {resource_id: item}} where an item is a dict with the
+# resource's key (plate or card number), status, the user who took it,
+# the gas card balance and the time of its last change.
+
+def empty_state():
+    return {kind: {} for kind in KINDS}
+
+
+def apply(state, row):
+    """Apply one journal row to ``state``."""
+    items = state[row['kind']]
+    rid = row['resource_id']
+    if row['op'] == 'delete':
+        items.pop(rid, None)
+        return
+    if row['op'] == 'add':
+        items[rid] = {'key': row['key'], 'status': 'returned', 'user_id': None,
+                      'balance': row['balance'], 'since': row['created']}
+        return
+    item = items.setdefault(rid, {'key': row['key'], 'balance': None})
+    item['status'] = row['op']
+    item['user_id'] = row['user_id']
+    item['since'] = row['created']
+    if row['balance'] is not None:
+        item['balance'] = row['balance']
+
+
+def _dump(state):
+    # compact: kind -> {id: [key, status, user_id, balance, since]}
+    return json.dumps({
+        kind: {str(rid): [i['key'], i['status'], i['user_id'], i['balance'], i['since']]
+               for rid, i in items.items()}
+        for kind, items in state.items()
+    }, separators=(',', ':'), ensure_ascii=False)
+
+
+def _load(text):
+    state = empty_state()
+    for kind, items in json.loads(text).items():
+        state[kind] = {
+            int(rid): {'key': v[0], 'status': v[1], 'user_id': v[2], 'balance': v[3], 'since': v[4]}
+            for rid, v in items.items()
+        }
+    return state
+
+
+def current_state(db):
+    """The state in ``vehicles`` and ``gas_cards`` (and who holds what,
+    from ``open_checkouts``)."""
+    state = empty_state()
+    holders = {(r['kind'], r['resource_id']): r for r in db.execute(
+        'SELECT kind, resource_id, user_id, taken_at FROM open_checkouts'
+    )}
+    for kind, spec in KINDS.items():
+        balance = 'balance' if kind == 'gas_card' else 'NULL AS balance'
+        for row in db.execute(f'SELECT id, {spec["key"]} AS key, status, {balance} FROM {spec["table"]}'):
+            held = holders.get((kind, row['id'])) if row['status'] == 'taken' else None
+            state[kind][row['id']] = {
+                'key': row['key'], 'status': row['status'], 'balance': row['balance'],
+                'user_id': (held['user_id'] or None) if held else None,
+                'since': held['taken_at'] if held else None,
+            }
+    return state
+
+
+def state_at(db, at=None):
+    """Return ``(state, journal_id)`` as of unix time ``at`` (default:
+    now), replayed from the latest snapshot taken by then."""
+    if at is None:
+        snap = db.execute(
+            'SELECT journal_id, state FROM journal_snapshots ORDER BY journal_id DESC LIMIT 1'
+        ).fetchone()
+    else:
+        snap = db.execute(
+            'SELECT journal_id, state FROM journal_snapshots WHERE created <= ? '
+            'ORDER BY journal_id DESC LIMIT 1', (at,)
+        ).fetchone()
+    state, last = (_load(snap['state']), snap['journal_id']) if snap else (empty_state(), 0)
+    if at is None:
+        tail = db.execute(f'SELECT {COLUMNS} FROM journal WHERE id > ? ORDER BY id', (last,))
+    else:
+        tail = db.execute(
+            f'SELECT {COLUMNS} FROM journal WHERE id > ? AND created <= ? ORDER BY id', (last, at)
+        )
+    for row in tail:
+        apply(state, row)
+        last = row['id']
+    return state, last
+
+
+def snapshot(db, min_events=0):
+    """Store the current state as a snapshot unless fewer than
+    ``min_events`` were journaled since the last one. Returns the journal
+    id it covers, or ``None`` when skipped. Run it in a write transaction."""
+    newest = db.execute('SELECT MAX(id) FROM journal').fetchone()[0] or 0
+    last = db.execute('SELECT MAX(journal_id) FROM journal_snapshots').fetchone()[0]
+    if last is not None and newest - last < max(min_events, 1):
+        return None
+    state, journal_id = state_at(db)
+    db.execute(
+        'INSERT INTO journal_snapshots (journal_id, created, state) VALUES (?, ?, ?)',
+        (journal_id, int(time.time()), _dump(state))
+    )
+    return journal_id
+
+
+def prune_snapshots(db, keep):
+    """Delete all but the first and the newest ``keep`` snapshots."""
+    return db.execute(
+        'DELETE FROM journal_snapshots WHERE id > (SELECT MIN(id) FROM journal_snapshots) '
+        'AND id NOT IN (SELECT id FROM journal_snapshots ORDER BY id DESC LIMIT ?)',
+        (max(int(keep), 1),)
+    ).rowcount
+
+
+def baseline(db):
+    """The first snapshot: the state from before there was a journal."""
+    db.execute(
+        'INSERT INTO journal_snapshots (journal_id, created, state) VALUES (?, ?, ?)',
+        (db.execute('SELECT COALESCE(MAX(id), 0) FROM journal').fetchone()[0],
+         int(time.time()), _dump(current_state(db)))
+    )
+
+
+def holders(db, kind, resource_id, since, until):
+    """Who had a resource in ``[since, until)``: ``(user_id, taken, returned)``
+    tuples, ``returned`` ``None`` while still out by ``until``."""
+    state, _ = state_at(db, since - 1)
+    item = state[kind].get(resource_id)
+    spans = []
+    if item and item['status'] == 'taken':
+        spans.append([item['user_id'], item['since'], None])
+    for row in db.execute(
+        f'SELECT {COLUMNS} FROM journal WHERE kind = ? AND resource_id = ? '
+        'AND created >= ? AND created < ? ORDER BY created, id',
+        (kind, resource_id, since, until)
+    ):
+        if row['op'] == 'taken':
+            spans.append([row['user_id'], row['created'], None])
+        elif row['op'] in ('returned', 'delete') and spans and spans[-1][2] is None:
+            spans[-1][2] = row['created']
+    return [tuple(span) for span in spans]
+
+
+def restore(db, state):
+    """Make ``vehicles`` and ``gas_cards`` match ``state``, in the caller's
+    transaction. Returns the number of rows changed per kind."""
+    changed = {}
+    current = current_state(db)
+    for kind, spec in KINDS.items():
+        table, key = spec['table'], spec['key']
+        wanted, have = state[kind], current[kind]
+        gone = [rid for rid in have if rid not in wanted]
+        for rid in gone:
+            reservations.forget(db, kind, rid)
+            analytics.forget(db, kind, rid)
+        db.executemany(f'DELETE FROM {table} WHERE id = ?', [(rid,) for rid in gone])
+        count = len(gone)
+        for rid, item in wanted.items():
+            old = have.get(rid)
+            if old is None:
+                if kind == 'gas_card':
+                    db.execute(f'INSERT INTO {table} (id, {key}, status, balance) VALUES (?, ?, ?, ?)',
+                               (rid, item['key'], item['status'], item['balance'] or 0.0))
+                else:
+                    db.execute(f'INSERT INTO {table} (id, {key}, status) VALUES (?, ?, ?)',
+                               (rid, item['key'], item['status']))
+            elif (old['key'], old['status']) != (item['key'], item['status']) or (
+                    kind == 'gas_card' and item['balance'] is not None and old['balance'] != item['balance']):
+                db.execute(f'UPDATE {table} SET {key} = ?, status = ? WHERE id = ?',
+                           (item['key'], item['status'], rid))
+                if kind == 'gas_card' and item['balance'] is not None:
+                    db.execute(f'UPDATE {table} SET balance = ? WHERE id = ?', (item['balance'], rid))
+            else:
+                continue
+            count += 1
+        changed[kind] = count
+        if count:
+            events.publish(db, kind, 'reload', count=count)
+    if any(changed.values()):
+        inventory.bump(db)
+    return changed
+
+
+# -- flask replay ----------------------------------------------------------
+
+replay_cli = AppGroup('replay', help='Read the vehicle and gas card journal.')
+
+
+def _parse_time(text):
+    if text is None:
+        return None
+    at = localtime.parse_local(text)
+    if at is None:
+        bounds = localtime.day_bounds(text)
+        if bounds is None:
+            raise click.BadParameter(f'{text!r} is not YYYY-MM-DD[THH:MM] or unix seconds')
+        # a bare day means its end
+        at = bounds[1] - 1
+    return at
+
+
+def _usernames(db):
+    return {row['id']: row['username'] for row in db.execute('SELECT id, username FROM users')}
+
+
+@replay_cli.command('state')
+@click.option('--at', 'at_text', help='Local time (YYYY-MM-DD[THH:MM]) or unix seconds; default now.')
+@click.option('--kind', type=click.Choice(sorted(KINDS)), help='Only vehicles or only gas cards.')
+@click.option('--taken', is_flag=True, help='Only what was out.')
+def state_command(at_text, kind, taken):
+    """Print every vehicle and gas card as of a point in time."""
+    db = get_db()
+    started = time.perf_counter()
+    state, journal_id = state_at(db, _parse_time(at_text))
+    names = _usernames(db)
+    for k in ([kind] if kind else KINDS):
+        for rid, item in sorted(state[k].items(), key=lambda i: i[1]['key'] or ''):
+            if taken and item['status'] != 'taken':
+                continue
+            holder = names.get(item['user_id'], '') if item['status'] == 'taken' else ''
+            balance = f'  {item["balance"]:.2f}' if k == 'gas_card' and item['balance'] is not None else ''
+            click.echo(f'{k:<8} {item["key"] or "#" + str(rid):<16} {item["status"]:<8} {holder:<12} '
+                       f'{localtime.format_local(item["since"])}{balance}')
+    click.echo(f'-- as of journal id {journal_id}, replayed in {(time.perf_counter() - started) * 1000:.0f} ms', err=True)
+
+
+@replay_cli.command('who')
+@click.argument('kind', type=click.Choice(sorted(KINDS)))
+@click.argument('key')
+@click.option('--day', required=True, help='Local day, YYYY-MM-DD.')
+def who_command(kind, key, day):
+    """Show who had a vehicle (plate) or gas card (number) on a day."""
+    bounds = localtime.day_bounds(day)
+    if bounds is None:
+        raise click.BadParameter(f'{day!r} is not YYYY-MM-DD', param_hint='--day')
+    db = get_db()
+    spec = KINDS[kind]
+    row = db.execute(f'SELECT id AS resource_id FROM {spec["table"]} WHERE {spec["key"]} = ?', (key,)).fetchone()
+    if row is None:
+        # deleted since: the journal still knows it
+        row = db.execute(
+            'SELECT resource_id FROM journal WHERE kind = ? AND key = ? ORDER BY id DESC LIMIT 1', (kind, key)
+        ).fetchone()
+    if row is None:
+        raise click.ClickException(f'no {kind} {key} in the journal')
+    names = _usernames(db)
+    spans = holders(db, kind, row['resource_id'], *bounds)
+    if not spans:
+        click.echo(f'{key} was not taken on {day}')
+    for user_id, taken, returned in spans:
+        click.echo(f'{names.get(user_id, "anonymous" if user_id is None else f"#{user_id}"):<12} '
+                   f'{localtime.format_local(taken)} - {localtime.format_local(returned) if returned else "(still out)"}')
+
+
+@replay_cli.command('snapshot')
+def snapshot_command():
+    """Store a snapshot of the current state now."""
+    journal_id = run_immediate(get_db(), snapshot)
+    click.echo(f'Snapshot at journal id {journal_id}' if journal_id is not None else 'Nothing journaled since the last snapshot')
+
+
+@replay_cli.command('restore')
+@click.option('--dry-run', is_flag=True, help='Only count the rows that would change.')
+def restore_command(dry_run):
+    """Rewrite vehicles and gas_cards from the latest snapshot and the journal."""
+    db = get_db()
+    started = time.perf_counter()
+
+    def work(db):
+        state, journal_id = state_at(db)
+        changed = restore(db, state)
+        if dry_run:
+            db.rollback()
+        return journal_id, changed
+
+    journal_id, changed = run_immediate(db, work)
+    verb = 'Would change' if dry_run else 'Changed'
+    click.echo(f'{verb} {changed["vehicle"]} vehicles and {changed["gas_card"]} gas cards '
+               f'(journal id {journal_id}, {(time.perf_counter() - started) * 1000:.0f} ms)')
+    if not dry_run and any(changed.values()):
+        click.echo('Run `flask rebuild-analytics` if the checkouts in progress changed.')
+
+
+def init_journal(app):
+    app.cli.add_command(replay_cli)
@@ -0,0 +1,84 @@
+"""Timestamps and the local timezone.
+
+Every time column (``record_*.timestamp``, ``applications.created``,
+``open_checkouts.taken_at``, ``status_events.created``) holds integer unix
+seconds in UTC, so storing and comparing them costs nothing. Conversion to
+local time happens here only, and only where a person reads it: the
+``localtime`` template filter and the day bounds of date filters and
+analytics rollups.
+
+``TIMEZONE`` is a fixed offset such as ``+08:00`` or ``UTC``, or an IANA
+name such as ``Asia/Shanghai`` (which needs the system tz database or the
+``tzdata`` package).
+"""
+import re
+from datetime import date, datetime, timedelta, timezone
+from flask import current_app
+
+
+_OFFSET = re.compile(r'^([+-])(\d{2}):?(\d{2})$')
+
+
+def parse_timezone(value):
+    """Return a ``tzinfo`` for a ``TIMEZONE`` setting."""
+    if value in ('UTC', 'Z'):
+        return timezone.utc
+    match = _OFFSET.match(value)
+    if match:
+        sign, hours, minutes = match.groups()
+        offset = timedelta(hours=int(hours), minutes=int(minutes))
+        return timezone(-offset if sign == '-' else offset)
+    from zoneinfo import ZoneInfo
+    return ZoneInfo(value)
+
+
+def tz():
+    return current_app.extensions['timezone']
+
+
+def to_local(ts):
+    return datetime.fromtimestamp(ts, tz())
+
+
+def local_day(ts):
+    """The local ``YYYY-MM-DD`` day of unix time ``ts``."""
+    return to_local(ts).date().isoformat()
+
+
+def day_bounds(day):
+    """Return ``(start, end)`` unix seconds of local day ``day``
+    (``YYYY-MM-DD``), end exclusive, or ``None`` if ``day`` is not a date."""
+    try:
+        start = datetime.combine(date.fromisoformat(day), datetime.min.time(), tz())
+    except (TypeError, ValueError):
+        return None
+    end = start + timedelta(days=1)
+    # through timestamp(), so zones with DST changes get their real day length
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def parse_local(text):
+    """Unix seconds of a local ``YYYY-MM-DDTHH:MM`` time (as sent by an
+    ``<input type="datetime-local">``) or of a plain number of seconds;
+    ``None`` if ``text`` is neither."""
+    text = (text or '').strip()
+    if text.isdigit():
+        return int(text)
+    try:
+        moment = datetime.fromisoformat(text.replace(' ', 'T'))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=tz())
+    return int(moment.timestamp())
+
+
+def format_local(ts, fmt='%Y-%m-%d %H:%M:%S'):
+    if ts is None or ts == '':
+        return ''
+    return to_local(ts).strftime(fmt)
+
+
+def init_localtime(app):
+    app.extensions['timezone'] = parse_timezone(app.config['TIMEZONE'])
+    app.add_template_filter(format_local, 'localtime')
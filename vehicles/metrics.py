@@ -0,0 +1,280 @@
+"""Request and SQL instrumentation.
+
+When ``METRICS_ENABLED`` is set, every request is timed per endpoint and
+every statement run through a pooled connection is timed, fetching its
+rows included, per endpoint and SQL verb. Statements slower than ``SLOW_QUERY_MS`` are logged. The data is
+exposed in Prometheus text format at ``/metrics`` (see routes/metrics.py).
+
+Metrics are kept per worker process; every sample carries a ``pid`` label
+so scrapes of different gunicorn workers can be told apart and summed.
+"""
+import os
+import threading
+import time
+from flask import current_app, g, has_request_context, request
+
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Registry:
+    """Histograms and counters keyed by label tuples, guarded by one lock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, callback):
+        """Register ``callback()`` to be sampled at exposition time."""
+        self.gauges[name] = callback
+
+    def render(self):
+        """Return all metrics in Prometheus text exposition format."""
+        pid = str(os.getpid())
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        seen = set()
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                lines.append(f'# TYPE {name} histogram')
+                seen.add(name)
+            base = labels + (('pid', pid),)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(base + (("le", repr(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(base + (("le", "+Inf"),))} {histogram.count}')
+            lines.append(f'{name}_sum{_labels(base)} {histogram.sum}')
+            lines.append(f'{name}_count{_labels(base)} {histogram.count}')
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f'# TYPE {name} counter')
+                seen.add(name)
+            lines.append(f'{name}{_labels(labels + (("pid", pid),))} {value}')
+        for name, callback in sorted(self.gauges.items()):
+            try:
+                value = callback()
+            except Exception:
+                continue
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name}{_labels((("pid", pid),))} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(pairs):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+
+def _endpoint():
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return 'cli'
+
+
+class TimedCursor:
+    """Cursor proxy that adds fetching and iterating to the time of the
+    statement that produced it.
+
+    SQLite steps a query lazily: ``execute`` stops at the first row and the
+    rest of a scan runs inside ``fetchall`` or the ``for`` loop. The
+    statement is recorded once its rows run out, it is closed, or the
+    proxy is dropped, whichever comes first.
+    """
+
+    __slots__ = ('_cursor', '_rows', '_conn', '_sql', '_endpoint', '_elapsed', '_open')
+
+    def __init__(self, cursor, conn, sql, endpoint, elapsed):
+        self._cursor = cursor
+        self._rows = None
+        self._conn = conn
+        self._sql = sql
+        self._endpoint = endpoint
+        self._elapsed = elapsed
+        self._open = True
+
+    def _finish(self):
+        if self._open:
+            self._open = False
+            self._conn._record(self._sql, self._endpoint, self._elapsed)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._elapsed += time.perf_counter() - start
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, *args):
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(*args)
+        self._elapsed += time.perf_counter() - start
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._elapsed += time.perf_counter() - start
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        if self._rows is None:
+            # sqlite3 cursors are their own iterators, PostgreSQL ones are not
+            self._rows = iter(self._cursor)
+        try:
+            row = next(self._rows)
+        except StopIteration:
+            self._elapsed += time.perf_counter() - start
+            self._finish()
+            raise
+        self._elapsed += time.perf_counter() - start
+        return row
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __del__(self):
+        self._finish()
+
+
+class Instrumented:
+    """Connection mixin that times ``execute``/``executemany``/``executescript``
+    together with fetching their rows (see :class:`TimedCursor`)."""
+
+    registry = None
+    slow_seconds = None
+    logger = None
+
+    def _timed(self, method, sql, *args):
+        endpoint = _endpoint()
+        start = time.perf_counter()
+        try:
+            cursor = method(sql, *args)
+        except BaseException:
+            self._record(sql, endpoint, time.perf_counter() - start)
+            raise
+        return TimedCursor(cursor, self, sql, endpoint, time.perf_counter() - start)
+
+    def _record(self, sql, endpoint, elapsed):
+        if self.registry is None:
+            return
+        verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'EMPTY'
+        self.registry.observe(
+            'vehicles_sql_statement_duration_seconds',
+            {'endpoint': endpoint, 'verb': verb}, elapsed
+        )
+        if self.slow_seconds is not None and elapsed >= self.slow_seconds:
+            self.registry.inc('vehicles_sql_slow_statements_total', {'verb': verb})
+            if self.logger is not None:
+                self.logger.warning('slow query (%.1f ms) in %s: %s', elapsed * 1000, endpoint, ' '.join(sql.split()))
+
+    def execute(self, sql, *args):
+        return self._timed(super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(super().executemany, sql, *args)
+
+    def executescript(self, sql):
+        return self._timed(super().executescript, sql)
+
+    def stream(self, sql, *args):
+        # PostgreSQL only (see vehicles.db.stream)
+        return self._timed(super().stream, sql, *args)
+
+
+def instrumented(base):
+    """Subclass of the connection class ``base`` with :class:`Instrumented`."""
+    return type(f'Instrumented{base.__name__}', (Instrumented, base), {})
+
+
+def _start_timer():
+    g._request_start = time.perf_counter()
+
+
+def _observe_request(status):
+    start = g.pop('_request_start', None)
+    if start is not None:
+        registry = current_app.extensions['metrics']
+        labels = {'endpoint': request.endpoint or 'unknown', 'method': request.method}
+        registry.observe('vehicles_http_request_duration_seconds', labels, time.perf_counter() - start)
+        registry.inc('vehicles_http_requests_total', dict(labels, status=str(status)))
+
+
+def _record_request(response):
+    _observe_request(response.status_code)
+    return response
+
+
+def _record_failure(exc):
+    # after_request does not run for unhandled exceptions
+    if exc is not None:
+        _observe_request(500)
+
+
+def init_metrics(app):
+    registry = Registry()
+    app.extensions['metrics'] = registry
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    slow_ms = app.config['SLOW_QUERY_MS']
+
+    def instrument(conn):
+        conn.registry = registry
+        conn.slow_seconds = None if slow_ms is None else slow_ms / 1000.0
+        conn.logger = app.logger
+
+    pool = app.extensions['db_pool']
+    pool.factory = instrumented(pool.factory)
+    pool.on_connect.append(instrument)
+    registry.gauge('vehicles_db_pool_idle_connections', pool.idle)
+
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.teardown_request(_record_failure)
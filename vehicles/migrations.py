@@ -0,0 +1,513 @@
+"""Versioned schema migrations.
+
+The schema version of a database is stored in ``PRAGMA user_version``.
+``MIGRATIONS[n - 1]`` upgrades a database from version ``n - 1`` to ``n``;
+each one runs in its own transaction together with the version bump, so a
+failed migration leaves the database at the previous version.
+
+``schema.sql`` always describes the latest version: ``init-db`` runs it and
+stamps the database with ``len(MIGRATIONS)``. When changing the schema,
+update ``schema.sql`` *and* append a migration here.
+
+The migrations are SQLite DDL. A PostgreSQL database (see
+vehicles/postgres.py) is created at the latest version from
+``schema_postgres.sql``, which must be kept in step with ``schema.sql``; its
+version lives in the one-row ``schema_version`` table.
+"""
+import json
+from datetime import datetime
+from flask import current_app
+
+MIGRATIONS = []
+
+
+def migration(func):
+    MIGRATIONS.append(func)
+    return func
+
+
+def latest_version():
+    return len(MIGRATIONS)
+
+
+def _postgres(db):
+    return getattr(db, 'backend', 'sqlite') == 'postgres'
+
+
+def current_version(db):
+    if _postgres(db):
+        row = db.execute('SELECT version FROM schema_version').fetchone()
+        return row[0] if row else 0
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def stamp(db, version):
+    if _postgres(db):
+        db.execute('DELETE FROM schema_version')
+        db.execute('INSERT INTO schema_version (version) VALUES (?)', (int(version),))
+        return
+    # PRAGMA arguments cannot be bound as parameters
+    db.execute(f'PRAGMA user_version = {int(version)}')
+
+
+def pending(db):
+    """Return ``(version, func)`` for every migration not yet applied."""
+    version = current_version(db)
+    return [(i + 1, func) for i, func in enumerate(MIGRATIONS) if i + 1 > version]
+
+
+def upgrade(db):
+    """Apply all pending migrations. Returns the list of applied versions."""
+    if _postgres(db) and pending(db):
+        raise RuntimeError(
+            'migrations are SQLite-only; bring the PostgreSQL schema up to date '
+            'from schema_postgres.sql and stamp schema_version'
+        )
+    applied = []
+    for version, func in pending(db):
+        if db.in_transaction:
+            db.commit()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            func(db)
+            stamp(db, version)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def _columns(db, table):
+    return {row['name'] for row in db.execute(f'PRAGMA table_info({table})')}
+
+
+@migration
+def baseline(db):
+    """Bring databases created by older schema.sql files up to the baseline."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS vehicles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plate TEXT UNIQUE NOT NULL,
+            status TEXT NOT NULL DEFAULT 'returned'
+        )""")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            is_identified INTEGER DEFAULT 0
+        )""")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS applications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created TIMESTAMP DEFAULT (datetime('now', '+8 hours')),
+            FOREIGN KEY (username) REFERENCES users (username)
+        )""")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS gas_cards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            card_number TEXT UNIQUE NOT NULL,
+            balance REAL DEFAULT 0.0,
+            status TEXT NOT NULL DEFAULT 'returned'
+        )""")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS passwords (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            password TEXT NOT NULL
+        )""")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS record_vehicles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vehicle_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT (datetime('now', '+8 hours')),
+            FOREIGN KEY(vehicle_id) REFERENCES vehicles(id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )""")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS record_gas_cards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            gas_card_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            balance REAL,
+            timestamp TIMESTAMP DEFAULT (datetime('now', '+8 hours')),
+            FOREIGN KEY(gas_card_id) REFERENCES gas_cards(id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )""")
+    if 'balance' not in _columns(db, 'record_gas_cards'):
+        db.execute('ALTER TABLE record_gas_cards ADD COLUMN balance REAL')
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS record_vehicles_archive (
+            id INTEGER PRIMARY KEY,
+            vehicle_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            timestamp TIMESTAMP
+        )""")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS record_gas_cards_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            gas_card_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            balance REAL,
+            timestamp TIMESTAMP
+        )""")
+
+
+@migration
+def history_and_application_indexes(db):
+    """Index history lookups by resource/user and applications by user/status."""
+    db.execute('CREATE INDEX IF NOT EXISTS idx_record_vehicles_vehicle ON record_vehicles (vehicle_id, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_record_vehicles_user ON record_vehicles (user_id, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_record_gas_cards_card ON record_gas_cards (gas_card_id, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_record_gas_cards_user ON record_gas_cards (user_id, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_record_vehicles_archive_vehicle ON record_vehicles_archive (vehicle_id, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_record_vehicles_archive_user ON record_vehicles_archive (user_id, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_record_gas_cards_archive_card ON record_gas_cards_archive (gas_card_id, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_record_gas_cards_archive_user ON record_gas_cards_archive (user_id, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_applications_username_status ON applications (username, status)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_applications_status ON applications (status, id)')
+
+
+@migration
+def data_versions(db):
+    """Add the data_versions change counters used for cache invalidation."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )""")
+
+
+@migration
+def status_events(db):
+    """Add the status_events change sequence for live status updates."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS status_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created INTEGER NOT NULL
+        )""")
+
+
+def _fill_rollups(db, add):
+    """Fill ``usage_daily`` and ``open_checkouts`` from the record history
+    (live and archive) the way ``analytics.rebuild()`` did when these
+    migrations were written; kept here so later changes to vehicles/analytics.py
+    do not change what they do. ``add(kind, resource_id, user_id, returned,
+    taken, delta)`` records one completed checkout. Gas card balances at take
+    come from the previous return; cards still out keep their current
+    balance."""
+    current = {row[0]: row[1] for row in db.execute('SELECT id, balance FROM gas_cards')}
+    sources = {
+        'vehicle': ('record_vehicles', 'vehicle_id AS resource_id, NULL AS balance'),
+        'gas_card': ('record_gas_cards', 'gas_card_id AS resource_id, balance'),
+    }
+    for kind, (table, columns) in sources.items():
+        columns = f'id, {columns}, user_id, action, timestamp'
+        rows = db.execute(
+            f'SELECT {columns} FROM {table}_archive UNION ALL SELECT {columns} FROM {table} ORDER BY id'
+        ).fetchall()
+        known = {}
+        open_rows = {}
+        for row in rows:
+            rid = row['resource_id']
+            if row['action'] == 'taken':
+                open_rows[rid] = (row['user_id'] or 0, row['timestamp'], known.get(rid))
+                continue
+            taken = open_rows.pop(rid, None)
+            if kind == 'gas_card' and row['balance'] is not None:
+                known[rid] = row['balance']
+            if taken is None:
+                continue
+            user_id, taken_at, balance = taken
+            delta = balance - row['balance'] if balance is not None and row['balance'] is not None else 0.0
+            add(kind, rid, user_id, row['timestamp'], taken_at, delta)
+        db.executemany(
+            'INSERT INTO open_checkouts (kind, resource_id, user_id, taken_at, balance) VALUES (?, ?, ?, ?, ?)',
+            ((kind, rid, user_id, taken_at, current.get(rid) if kind == 'gas_card' else None)
+             for rid, (user_id, taken_at, _) in open_rows.items())
+        )
+
+
+ADD_ROLLUP = (
+    'INSERT INTO usage_daily (day, kind, resource_id, user_id, checkouts, seconds_out, balance_delta) '
+    'VALUES (?, ?, ?, ?, 1, ?, ?) '
+    'ON CONFLICT (day, kind, resource_id, user_id) DO UPDATE SET '
+    'checkouts = checkouts + 1, '
+    'seconds_out = seconds_out + excluded.seconds_out, '
+    'balance_delta = balance_delta + excluded.balance_delta'
+)
+
+
+@migration
+def usage_rollups(db):
+    """Add the analytics rollup tables and fill them from the history."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            day TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            resource_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL DEFAULT 0,
+            checkouts INTEGER NOT NULL DEFAULT 0,
+            seconds_out INTEGER NOT NULL DEFAULT 0,
+            balance_delta REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, kind, resource_id, user_id)
+        )""")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS open_checkouts (
+            kind TEXT NOT NULL,
+            resource_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL DEFAULT 0,
+            taken_at TEXT NOT NULL,
+            balance REAL,
+            PRIMARY KEY (kind, resource_id)
+        )""")
+
+    def add(kind, rid, user_id, returned, taken, delta):
+        # times are local text here; the day is the text's date
+        returned, taken = str(returned), str(taken)
+        day, seconds = db.execute(
+            "SELECT date(?), MAX(CAST(strftime('%s', ?) AS INTEGER) - CAST(strftime('%s', ?) AS INTEGER), 0)",
+            (returned, returned, taken)
+        ).fetchone()
+        db.execute(ADD_ROLLUP, (day, kind, rid, user_id, seconds, delta))
+    _fill_rollups(db, add)
+
+
+@migration
+def unique_passwords(db):
+    """Make pooled passwords unique so claims and bulk inserts can rely on it."""
+    db.execute('DELETE FROM passwords WHERE id NOT IN (SELECT MIN(id) FROM passwords GROUP BY password)')
+    db.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_passwords_password ON passwords (password)')
+
+
+@migration
+def login_failures(db):
+    """Add the failed-login counters used by the login rate limiter."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS login_failures (
+            key TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0,
+            window_start INTEGER NOT NULL
+        )""")
+
+
+# seconds to subtract from the old `datetime('now', '+8 hours')` text values
+OLD_LOCAL_OFFSET = 8 * 3600
+
+EPOCH_NOW = "(CAST(strftime('%s', 'now') AS INTEGER))"
+
+
+def _epoch(column):
+    return (f"CASE WHEN typeof({column}) = 'text' "
+            f"THEN CAST(strftime('%s', {column}) AS INTEGER) - {OLD_LOCAL_OFFSET} ELSE {column} END")
+
+
+def _rebuild(db, table, create, columns, converted):
+    """Recreate ``table`` from ``create`` (a ``CREATE TABLE {table}``
+    statement template), copying ``columns`` and converting the
+    ``converted`` one to unix seconds. Indexes are dropped with the old
+    table; the autoincrement sequence is carried over."""
+    seq = db.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+    new = f'{table}_new'
+    db.execute(create.format(table=new))
+    select = ', '.join(_epoch(c) if c == converted else c for c in columns)
+    db.execute(f'INSERT INTO {new} ({", ".join(columns)}) SELECT {select} FROM {table}')
+    db.execute(f'DROP TABLE {table}')
+    db.execute(f'ALTER TABLE {new} RENAME TO {table}')
+    if seq is not None:
+        db.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (seq[0], table))
+
+
+@migration
+def epoch_timestamps(db):
+    """Store times as integer unix seconds (UTC) instead of +8 hours text."""
+    _rebuild(db, 'applications', f"""
+        CREATE TABLE {{table}} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created INTEGER DEFAULT {EPOCH_NOW},
+            FOREIGN KEY (username) REFERENCES users (username)
+        )""", ('id', 'username', 'status', 'created'), 'created')
+    _rebuild(db, 'record_vehicles', f"""
+        CREATE TABLE {{table}} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vehicle_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            timestamp INTEGER DEFAULT {EPOCH_NOW},
+            FOREIGN KEY(vehicle_id) REFERENCES vehicles(id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )""", ('id', 'vehicle_id', 'user_id', 'action', 'timestamp'), 'timestamp')
+    _rebuild(db, 'record_gas_cards', f"""
+        CREATE TABLE {{table}} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            gas_card_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            balance REAL,
+            timestamp INTEGER DEFAULT {EPOCH_NOW},
+            FOREIGN KEY(gas_card_id) REFERENCES gas_cards(id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )""", ('id', 'user_id', 'gas_card_id', 'action', 'balance', 'timestamp'), 'timestamp')
+    _rebuild(db, 'record_vehicles_archive', """
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY,
+            vehicle_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            timestamp INTEGER
+        )""", ('id', 'vehicle_id', 'user_id', 'action', 'timestamp'), 'timestamp')
+    _rebuild(db, 'record_gas_cards_archive', """
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            gas_card_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            balance REAL,
+            timestamp INTEGER
+        )""", ('id', 'user_id', 'gas_card_id', 'action', 'balance', 'timestamp'), 'timestamp')
+    _rebuild(db, 'open_checkouts', """
+        CREATE TABLE {table} (
+            kind TEXT NOT NULL,
+            resource_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL DEFAULT 0,
+            taken_at INTEGER NOT NULL,
+            balance REAL,
+            PRIMARY KEY (kind, resource_id)
+        )""", ('kind', 'resource_id', 'user_id', 'taken_at', 'balance'), 'taken_at')
+    # the rebuilt tables lost their indexes
+    history_and_application_indexes(db)
+
+
+@migration
+def job_runs(db):
+    """Add the job_runs log of the maintenance worker."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS job_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job TEXT NOT NULL,
+            started INTEGER NOT NULL,
+            duration_ms REAL NOT NULL,
+            ok INTEGER NOT NULL,
+            detail TEXT
+        )""")
+
+
+@migration
+def reservations(db):
+    """Add the reservations table."""
+    db.execute(f"""
+        CREATE TABLE IF NOT EXISTS reservations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vehicle_id INTEGER NOT NULL,
+            gas_card_id INTEGER,
+            user_id INTEGER NOT NULL,
+            starts INTEGER NOT NULL,
+            ends INTEGER NOT NULL,
+            created INTEGER DEFAULT {EPOCH_NOW},
+            FOREIGN KEY(vehicle_id) REFERENCES vehicles(id),
+            FOREIGN KEY(gas_card_id) REFERENCES gas_cards(id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )""")
+    db.execute('CREATE INDEX IF NOT EXISTS idx_reservations_ends ON reservations (ends)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_reservations_user ON reservations (user_id, ends)')
+
+
+@migration
+def search_index(db):
+    """Add FTS5 trigram indexes of plates and card numbers, with triggers."""
+    for table, key in (('vehicles', 'plate'), ('gas_cards', 'card_number')):
+        fts = f'{table}_fts'
+        db.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{key}, content='{table}', content_rowid='id', tokenize='trigram')"
+        )
+        delete = f"INSERT INTO {fts} ({fts}, rowid, {key}) VALUES ('delete', old.id, old.{key});"
+        insert = f'INSERT INTO {fts} (rowid, {key}) VALUES (new.id, new.{key});'
+        db.execute(f'CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END')
+        db.execute(f'CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN {delete} END')
+        db.execute(f'CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {key} ON {table} BEGIN {delete} {insert} END')
+        db.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+@migration
+def idempotency_keys(db):
+    """Add the idempotency_keys table of /lock/submit results."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL DEFAULT 0,
+            request TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created INTEGER NOT NULL
+        )""")
+    db.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created)')
+
+
+@migration
+def journal(db):
+    """Add the journal and its snapshots, starting from the current state."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS journal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            resource_id INTEGER NOT NULL,
+            key TEXT,
+            op TEXT NOT NULL,
+            user_id INTEGER,
+            balance REAL
+        )""")
+    db.execute('CREATE INDEX IF NOT EXISTS idx_journal_resource ON journal (kind, resource_id, created)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_journal_created ON journal (created)')
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS journal_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            journal_id INTEGER NOT NULL,
+            created INTEGER NOT NULL,
+            state TEXT NOT NULL
+        )""")
+    db.execute('CREATE INDEX IF NOT EXISTS idx_journal_snapshots_created ON journal_snapshots (created)')
+    # the baseline snapshot: kind -> {id: [key, status, user_id, balance, since]}
+    held = {(r['kind'], r['resource_id']): r for r in db.execute(
+        'SELECT kind, resource_id, user_id, taken_at FROM open_checkouts'
+    )}
+    state = {}
+    for kind, table, key, balance in (('vehicle', 'vehicles', 'plate', 'NULL'),
+                                      ('gas_card', 'gas_cards', 'card_number', 'balance')):
+        items = state[kind] = {}
+        for row in db.execute(f'SELECT id, {key}, status, {balance} FROM {table}'):
+            holder = held.get((kind, row[0])) if row[2] == 'taken' else None
+            items[str(row[0])] = [row[1], row[2], (holder['user_id'] or None) if holder else None,
+                                  row[3], holder['taken_at'] if holder else None]
+    db.execute(
+        "INSERT INTO journal_snapshots (journal_id, created, state) "
+        "VALUES (0, CAST(strftime('%s', 'now') AS INTEGER), ?)",
+        (json.dumps(state, separators=(',', ':'), ensure_ascii=False),)
+    )
+
+
+@migration
+def usage_rollups_in_seconds(db):
+    """Fill empty usage rollups from the history, in unix seconds."""
+    # databases whose usage_rollups left the tables empty; the rest are
+    # already filled and kept current by every checkout since
+    if db.execute('SELECT 1 FROM usage_daily UNION ALL SELECT 1 FROM open_checkouts LIMIT 1').fetchone():
+        return
+    zone = current_app.extensions['timezone']
+
+    def add(kind, rid, user_id, returned, taken, delta):
+        day = datetime.fromtimestamp(returned, zone).date().isoformat()
+        db.execute(ADD_ROLLUP, (day, kind, rid, user_id, max(returned - taken, 0), delta))
+    _fill_rollups(db, add)
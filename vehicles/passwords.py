@@ -0,0 +1,136 @@
+"""Pool of temporary lock passwords.
+
+Codes live in the ``passwords`` table, unique per code. A claim removes the
+oldest code with a single ``DELETE ... RETURNING`` statement, so two
+concurrent submits can never receive the same code. Admins add codes in bulk
+on ``/lock/password``; ``flask passwords refill`` tops the pool up with
+generated codes when it drops below ``PASSWORD_POOL_LOW_WATERMARK`` (off by
+default, since the codes usually have to be programmed into the lock).
+"""
+import secrets
+import sqlite3
+import string
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from vehicles.db import backend, get_db, run_immediate
+
+
+PASSWORD_ALPHABET = string.ascii_uppercase + string.digits
+PASSWORD_LENGTH = 8
+
+# RETURNING needs SQLite 3.35; older libraries claim with SELECT + DELETE,
+# which is still safe inside the caller's BEGIN IMMEDIATE transaction
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def generate_password(length=PASSWORD_LENGTH):
+    return ''.join(secrets.choice(PASSWORD_ALPHABET) for _ in range(length))
+
+
+def claim(db):
+    """Remove and return the oldest code, or ``None`` when the pool is empty."""
+    if backend(db) == 'postgres':
+        # concurrent claims skip each other's locked rows instead of
+        # queueing for the same one
+        rows = db.execute(
+            'DELETE FROM passwords WHERE id = '
+            '(SELECT id FROM passwords ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED) RETURNING password'
+        ).fetchall()
+        return rows[0][0] if rows else None
+    if HAS_RETURNING:
+        # fetchall() runs the statement to completion before returning
+        rows = db.execute(
+            'DELETE FROM passwords WHERE id = (SELECT MIN(id) FROM passwords) RETURNING password'
+        ).fetchall()
+        return rows[0][0] if rows else None
+    row = db.execute('SELECT id, password FROM passwords ORDER BY id LIMIT 1').fetchone()
+    if row is None:
+        return None
+    db.execute('DELETE FROM passwords WHERE id = ?', (row[0],))
+    return row[1]
+
+
+def depth(db):
+    return db.execute('SELECT COUNT(*) FROM passwords').fetchone()[0]
+
+
+def parse_codes(text):
+    """Split pasted or uploaded text into codes (whitespace or comma separated).
+
+    Returns ``(codes, invalid)``; codes keep their input order, without
+    repeats, and anything not exactly ``PASSWORD_LENGTH`` characters long is
+    reported as invalid.
+    """
+    codes, invalid, seen = [], [], set()
+    for token in text.replace(',', ' ').split():
+        if len(token) != PASSWORD_LENGTH:
+            invalid.append(token)
+        elif token not in seen:
+            seen.add(token)
+            codes.append(token)
+    return codes, invalid
+
+
+def add(db, codes):
+    """Insert ``codes`` in one statement batch, skipping ones already pooled.
+    Returns the number inserted."""
+    # rowcount of executemany is the total over all rows
+    return db.executemany('INSERT OR IGNORE INTO passwords (password) VALUES (?)', ((code,) for code in codes)).rowcount
+
+
+def refill(db, low, target):
+    """Top the pool up to ``target`` codes when it holds fewer than ``low``.
+    Returns the number of codes generated."""
+    count = depth(db)
+    if count >= low:
+        return 0
+    added = 0
+    while count + added < target:
+        # collisions with pooled codes are ignored and simply retried
+        added += add(db, [generate_password() for _ in range(target - count - added)])
+    return added
+
+
+def recent(db, limit):
+    """The ``limit`` newest pooled codes."""
+    return db.execute('SELECT id, password FROM passwords ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+
+
+passwords_cli = AppGroup('passwords', help='Manage the temporary password pool.')
+
+
+@passwords_cli.command('refill')
+@click.option('--force', is_flag=True, help='Refill to the target even above the low watermark.')
+def refill_command(force):
+    """Pre-generate codes when the pool is below the low watermark."""
+    config = current_app.config
+    low = int(config['PASSWORD_POOL_LOW_WATERMARK'])
+    target = int(config['PASSWORD_POOL_TARGET'])
+    if force:
+        low = target
+    if low <= 0:
+        click.echo('Refill disabled (PASSWORD_POOL_LOW_WATERMARK is 0).')
+        return
+    added = run_immediate(get_db(), lambda db: refill(db, low, target))
+    click.echo(f'Added {added} passwords ({depth(get_db())} in pool).')
+
+
+@passwords_cli.command('status')
+def status_command():
+    """Print the number of unclaimed codes."""
+    click.echo(depth(get_db()))
+
+
+def init_passwords(app):
+    app.cli.add_command(passwords_cli)
+    pool = app.extensions['db_pool']
+
+    def pool_depth():
+        conn = pool.acquire()
+        try:
+            return depth(conn)
+        finally:
+            pool.release(conn)
+
+    app.extensions['metrics'].gauge('vehicles_password_pool_depth', pool_depth)
@@ -0,0 +1,248 @@
+"""PostgreSQL backend, selected with ``DATABASE_URL=postgresql://...``.
+
+A SQLite file can only be shared by the processes of one host; with a
+PostgreSQL server several web nodes can run behind the same nginx. Needs
+the ``postgres`` extra (psycopg 3).
+
+The queries in this package are written for SQLite. :class:`Connection`
+gives a psycopg connection the ``sqlite3`` interface the rest of the code
+relies on: ``execute`` returning a cursor, rows addressable by index and by
+name, ``lastrowid``, ``in_transaction`` and a transaction opened implicitly
+before the first write. It also translates the few SQLite spellings the
+queries use:
+
+* ``?`` placeholders become ``%s``;
+* ``BEGIN IMMEDIATE`` becomes ``BEGIN``. Concurrent writers then serialize
+  on row locks, and the conditional ``UPDATE ... WHERE status = ?`` of a
+  checkout still lets only one of them win;
+* ``INSERT OR IGNORE`` becomes ``INSERT ... ON CONFLICT DO NOTHING``;
+* single-row inserts into tables with an ``id`` get ``RETURNING id`` so
+  ``lastrowid`` works.
+
+Iterating a cursor yields rows one at a time, but psycopg has already
+received the whole result; queries that stream large results go through
+:meth:`Connection.stream`, a server-side cursor read in batches.
+
+Statements that differ more are chosen per backend with
+:func:`vehicles.db.backend`. ``init-db`` creates the schema from
+``schema_postgres.sql``.
+"""
+import itertools
+import re
+import psycopg
+from vehicles.db import ConnectionPool
+
+
+# tables with a generated `id` primary key
+ID_TABLES = frozenset((
+    'vehicles', 'users', 'applications', 'gas_cards', 'passwords',
+    'record_vehicles', 'record_gas_cards', 'status_events', 'job_runs', 'reservations',
+    'journal', 'journal_snapshots',
+))
+WRITE_VERBS = frozenset(('INSERT', 'UPDATE', 'DELETE'))
+# rows per round trip of a streamed query
+STREAM_BATCH = 500
+_STREAMS = itertools.count(1)
+
+_INSERT_OR_IGNORE = re.compile(r'^\s*INSERT\s+OR\s+IGNORE\s+', re.IGNORECASE)
+_SINGLE_INSERT = re.compile(r'^\s*INSERT\s+INTO\s+(\w+)\b[^;]*\bVALUES\b', re.IGNORECASE)
+
+
+class Row:
+    """Result row addressable like ``sqlite3.Row``: by position, by column
+    name, and as a mapping through ``keys()``."""
+
+    __slots__ = ('_values', '_index')
+
+    def __init__(self, values, index):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        return list(self._index)
+
+    def __repr__(self):
+        return f'<Row {dict(zip(self._index, self._values))!r}>'
+
+
+def _row_factory(cursor):
+    index = {column.name: i for i, column in enumerate(cursor.description or ())}
+    return lambda values: Row(values, index)
+
+
+def translate(sql):
+    """Return ``(sql, verb, returns_id)`` with SQLite spellings rewritten."""
+    verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    ignore = bool(_INSERT_OR_IGNORE.match(sql))
+    if ignore:
+        sql = _INSERT_OR_IGNORE.sub('INSERT ', sql, count=1)
+    # literal % must be doubled once parameters are bound
+    sql = sql.replace('%', '%%').replace('?', '%s')
+    if ignore:
+        sql = sql.rstrip().rstrip(';') + ' ON CONFLICT DO NOTHING'
+    returns_id = False
+    match = _SINGLE_INSERT.match(sql)
+    if match and match.group(1).lower() in ID_TABLES and 'RETURNING' not in sql.upper():
+        sql = sql.rstrip().rstrip(';') + ' RETURNING id'
+        returns_id = True
+    return sql, verb, returns_id
+
+
+class Cursor:
+    """psycopg cursor with the ``lastrowid`` of ``sqlite3.Cursor``."""
+
+    def __init__(self, cursor, lastrowid=None):
+        self._cursor = cursor
+        self.lastrowid = lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone() if self._cursor.description else None
+
+    def fetchall(self):
+        return self._cursor.fetchall() if self._cursor.description else []
+
+    def __iter__(self):
+        # row by row, as sqlite3 does, instead of building the whole list
+        if self._cursor.description:
+            yield from self._cursor
+
+    def close(self):
+        self._cursor.close()
+
+
+class StreamCursor(Cursor):
+    """Server-side cursor for :meth:`Connection.stream`: rows are fetched
+    ``itersize`` at a time while iterating, and the cursor is closed on the
+    server once they run out."""
+
+    def __iter__(self):
+        try:
+            yield from self._cursor
+        finally:
+            self._cursor.close()
+
+
+class Connection:
+    """A psycopg connection behind the subset of ``sqlite3.Connection``
+    used by this package. The psycopg connection runs in autocommit mode;
+    transactions are opened explicitly, as ``sqlite3`` does implicitly."""
+
+    backend = 'postgres'
+    Error = psycopg.Error
+    IntegrityError = psycopg.IntegrityError
+    OperationalError = psycopg.OperationalError
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.in_transaction = False
+
+    @property
+    def broken(self):
+        return self._raw.closed or self._raw.broken
+
+    def _begin(self):
+        if not self.in_transaction:
+            self._raw.execute('BEGIN')
+            self.in_transaction = True
+
+    def execute(self, sql, params=()):
+        if sql.strip().upper() in ('BEGIN', 'BEGIN IMMEDIATE', 'BEGIN EXCLUSIVE'):
+            self._begin()
+            return Cursor(self._raw.cursor())
+        sql, verb, returns_id = translate(sql)
+        if verb in WRITE_VERBS:
+            self._begin()
+        cursor = self._raw.cursor(row_factory=_row_factory)
+        cursor.execute(sql, tuple(params))
+        lastrowid = cursor.fetchone()[0] if returns_id else None
+        return Cursor(cursor, lastrowid)
+
+    def stream(self, sql, params=()):
+        """Run a ``SELECT`` whose rows are read once, in order, through a
+        server-side cursor (see :func:`vehicles.db.stream`)."""
+        sql, _, _ = translate(sql)
+        # outside a transaction (autocommit) the cursor must be WITH HOLD
+        # to outlive the statement that declares it
+        cursor = self._raw.cursor(name=f'stream_{next(_STREAMS)}', row_factory=_row_factory,
+                                  withhold=not self.in_transaction)
+        cursor.itersize = STREAM_BATCH
+        cursor.execute(sql, tuple(params))
+        return StreamCursor(cursor)
+
+    def executemany(self, sql, seq_of_params):
+        sql, verb, returns_id = translate(sql)
+        if returns_id:
+            sql = sql[:-len(' RETURNING id')]
+        if verb in WRITE_VERBS:
+            self._begin()
+        cursor = self._raw.cursor(row_factory=_row_factory)
+        cursor.executemany(sql, [tuple(params) for params in seq_of_params])
+        return Cursor(cursor)
+
+    def executescript(self, script):
+        # several statements are accepted when nothing is bound
+        self._raw.execute(script)
+        return Cursor(self._raw.cursor())
+
+    def commit(self):
+        if self.in_transaction:
+            self.in_transaction = False
+            self._raw.execute('COMMIT')
+
+    def rollback(self):
+        if self.in_transaction:
+            self.in_transaction = False
+            self._raw.execute('ROLLBACK')
+
+    def close(self):
+        self._raw.close()
+
+
+class PostgresPool(ConnectionPool):
+    """:class:`vehicles.db.ConnectionPool` of :class:`Connection` objects;
+    ``database`` is the connection URL."""
+
+    errors = (psycopg.Error,)
+
+    def __init__(self, url, size=8, busy_timeout=5000):
+        super().__init__(url, size=size, busy_timeout=busy_timeout)
+        self.factory = Connection
+
+    def connect(self):
+        raw = psycopg.connect(self.database, autocommit=True)
+        # wait for row locks as long as SQLite waits for its write lock
+        raw.execute(f'SET lock_timeout = {int(self.busy_timeout)}')
+        conn = self.factory(raw)
+        for callback in self.on_connect:
+            callback(conn)
+        return conn
+
+    def release(self, conn):
+        if conn.broken:
+            # the server went away; the next acquire opens a fresh connection
+            return
+        super().release(conn)
+
+
+def create_pool(app):
+    config = app.config
+    return PostgresPool(
+        config['DATABASE_URL'],
+        size=int(config['DB_POOL_SIZE']),
+        busy_timeout=int(config['DB_BUSY_TIMEOUT']),
+    )
@@ -0,0 +1,56 @@
+"""Failed-login rate limiting.
+
+Failures are counted in the ``login_failures`` table per key over a fixed
+window, so the limit holds across all gunicorn workers: per username and
+client address (``user:<address>:<name>``), and per address alone
+(``ip:<address>``). Keying the username limit on the address too means bad
+passwords sent from elsewhere cannot lock a user (or ``admin``) out. A blocked attempt is refused before any password hash is
+computed, which is what keeps brute-force traffic from burning CPU.
+"""
+import time
+from flask import current_app
+
+
+def _limits():
+    config = current_app.config
+    return {
+        'user': int(config['LOGIN_MAX_FAILURES']),
+        'ip': int(config['LOGIN_MAX_FAILURES_PER_IP']),
+    }
+
+
+def _keys(username, address):
+    return {'user': f'user:{address}:{username}', 'ip': f'ip:{address}'}
+
+
+def retry_after(db, username, address):
+    """Seconds until a login for ``username`` from ``address`` may be
+    attempted again, or 0 when it is allowed now."""
+    window = int(current_app.config['LOGIN_FAILURE_WINDOW'])
+    now = int(time.time())
+    limits = _limits()
+    wait = 0
+    for kind, key in _keys(username, address).items():
+        row = db.execute('SELECT count, window_start FROM login_failures WHERE key = ?', (key,)).fetchone()
+        if row and row['count'] >= limits[kind] and now < row['window_start'] + window:
+            wait = max(wait, row['window_start'] + window - now)
+    return wait
+
+
+def record_failure(db, username, address):
+    window = int(current_app.config['LOGIN_FAILURE_WINDOW'])
+    now = int(time.time())
+    db.executemany(
+        'INSERT INTO login_failures (key, count, window_start) VALUES (?, 1, ?) '
+        'ON CONFLICT (key) DO UPDATE SET '
+        'count = CASE WHEN window_start + ? <= excluded.window_start THEN 1 ELSE count + 1 END, '
+        'window_start = CASE WHEN window_start + ? <= excluded.window_start THEN excluded.window_start ELSE window_start END',
+        [(key, now, window, window) for key in _keys(username, address).values()]
+    )
+    if current_app.config['MAINTENANCE_INLINE']:
+        # expired windows are dropped as new failures come in
+        db.execute('DELETE FROM login_failures WHERE window_start + ? <= ?', (window, now))
+
+
+def clear(db, username, address):
+    db.execute('DELETE FROM login_failures WHERE key = ?', (_keys(username, address)['user'],))
@@ -0,0 +1,323 @@
+"""Vehicle reservations: booking a vehicle, and optionally a gas card, for
+a time window.
+
+A reservation is one ``reservations`` row with ``starts`` and ``ends`` in
+unix seconds, ``ends`` exclusive. Bookings of the same vehicle (or gas
+card) never overlap, so each worker keeps, per resource, the upcoming
+intervals as a list sorted by start: the only booking that can overlap
+``[starts, ends)`` is the last one starting before ``ends``, which
+:meth:`IntervalIndex.overlapping` finds with one bisect. "Which vehicles
+are free from T1 to T2" is one such lookup per vehicle, and a booking is
+rejected without querying the table.
+
+The index is cached per worker like the inventory (see
+vehicles/inventory.py) and checked against the ``reservations`` data
+version. Every write to ``reservations`` bumps that version *first*: the
+bump takes the write lock on SQLite and the row lock of the counter on
+PostgreSQL, so conflicting bookings are decided one at a time against an
+index that is current. A worker applies its own bookings to its index after
+the commit; the others reload it on their next lookup.
+
+``/lock/submit`` honours reservations (see vehicles/checkout.py): from
+``RESERVATION_HOLD_BEFORE`` seconds before a booking starts until it ends,
+only the user who booked can take the vehicle or gas card.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from flask import current_app
+from vehicles.db import run_immediate
+from vehicles.inventory import bump, current_version, get_inventory
+
+
+KINDS = ('vehicle', 'gas_card')
+COLUMNS = 'id, vehicle_id, gas_card_id, user_id, starts, ends'
+
+# start first, so entries sort by time
+Entry = namedtuple('Entry', 'starts ends id user_id')
+
+
+class ReservationError(Exception):
+    """A booking or cancellation that cannot be applied. The message is
+    shown to the user."""
+
+
+class IntervalIndex:
+    """Non-overlapping ``[starts, ends)`` intervals per resource id."""
+
+    def __init__(self):
+        self._entries = {}
+        self._starts = {}
+
+    def add(self, resource_id, entry):
+        entries = self._entries.setdefault(resource_id, [])
+        starts = self._starts.setdefault(resource_id, [])
+        i = bisect_right(starts, entry.starts)
+        entries.insert(i, entry)
+        starts.insert(i, entry.starts)
+
+    def remove(self, resource_id, reservation_id):
+        entries = self._entries.get(resource_id, [])
+        for i, entry in enumerate(entries):
+            if entry.id == reservation_id:
+                del entries[i]
+                del self._starts[resource_id][i]
+                return entry
+        return None
+
+    def overlapping(self, resource_id, starts, ends):
+        """The entry overlapping ``[starts, ends)``, or ``None``."""
+        i = bisect_left(self._starts.get(resource_id, ()), ends)
+        if i and self._entries[resource_id][i - 1].ends > starts:
+            return self._entries[resource_id][i - 1]
+        return None
+
+    def all_overlapping(self, resource_id, starts, ends):
+        """Every entry overlapping ``[starts, ends)``, latest first. Entries
+        do not overlap, so their ends are sorted too and the walk back from
+        the last one starting before ``ends`` stops at the first miss."""
+        entries = self._entries.get(resource_id, ())
+        i = bisect_left(self._starts.get(resource_id, ()), ends)
+        found = []
+        while i and entries[i - 1].ends > starts:
+            i -= 1
+            found.append(entries[i])
+        return found
+
+
+class ReservationIndex:
+    """Per-worker :class:`IntervalIndex` of upcoming bookings, one per kind."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._indexes = {}
+
+    def _load(self, db, version):
+        indexes = {kind: IntervalIndex() for kind in KINDS}
+        for row in db.execute(f'SELECT {COLUMNS} FROM reservations WHERE ends > ?', (int(time.time()),)):
+            entry = Entry(row['starts'], row['ends'], row['id'], row['user_id'])
+            indexes['vehicle'].add(row['vehicle_id'], entry)
+            if row['gas_card_id'] is not None:
+                indexes['gas_card'].add(row['gas_card_id'], entry)
+        self._version = version
+        self._indexes = indexes
+
+    def refresh(self, db, version):
+        """Reload the index unless it reflects data version ``version``."""
+        with self._lock:
+            if self._version != version:
+                self._load(db, version)
+
+    def overlapping(self, db, kind, resource_id, starts, ends, version=None):
+        """The booking of ``resource_id`` overlapping ``[starts, ends)``.
+        ``version`` is the data version the answer must reflect; by default
+        the stored one."""
+        if version is None:
+            version = current_version(db, 'reservations')
+        with self._lock:
+            if self._version != version:
+                self._load(db, version)
+            return self._indexes[kind].overlapping(resource_id, starts, ends)
+
+    def all_overlapping(self, db, kind, resource_id, starts, ends):
+        """Every booking of ``resource_id`` overlapping ``[starts, ends)``."""
+        version = current_version(db, 'reservations')
+        with self._lock:
+            if self._version != version:
+                self._load(db, version)
+            return self._indexes[kind].all_overlapping(resource_id, starts, ends)
+
+    def free(self, db, kind, resource_ids, starts, ends):
+        """The ids of ``resource_ids`` with no booking in ``[starts, ends)``."""
+        version = current_version(db, 'reservations')
+        with self._lock:
+            if self._version != version:
+                self._load(db, version)
+            index = self._indexes[kind]
+            return [i for i in resource_ids if index.overlapping(i, starts, ends) is None]
+
+    def applied(self, version, added=(), removed=()):
+        """Record a committed change that moved the data version from
+        ``version - 1`` to ``version``; a stale index is left to reload."""
+        with self._lock:
+            if self._version != version - 1:
+                return
+            for row in removed:
+                self._indexes['vehicle'].remove(row['vehicle_id'], row['id'])
+                if row['gas_card_id'] is not None:
+                    self._indexes['gas_card'].remove(row['gas_card_id'], row['id'])
+            for row in added:
+                entry = Entry(row['starts'], row['ends'], row['id'], row['user_id'])
+                self._indexes['vehicle'].add(row['vehicle_id'], entry)
+                if row['gas_card_id'] is not None:
+                    self._indexes['gas_card'].add(row['gas_card_id'], entry)
+            self._version = version
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+
+
+def _index():
+    return current_app.extensions['reservation_index']
+
+
+def _begin_change(db):
+    """Bump the version and make sure the index reflects the state before
+    the bump. Returns the new version."""
+    bump(db, 'reservations')
+    version = current_version(db, 'reservations')
+    # nothing else can change the bookings until we commit
+    _index().refresh(db, version - 1)
+    return version
+
+
+def _check_window(starts, ends, now):
+    config = current_app.config
+    if starts is None or ends is None:
+        raise ReservationError('请填写有效的开始和结束时间。')
+    if ends <= starts:
+        raise ReservationError('结束时间必须晚于开始时间。')
+    # a datetime-local input is precise to the minute
+    if starts < now - 60:
+        raise ReservationError('开始时间已过。')
+    if ends - starts > int(config['RESERVATION_MAX_DURATION']):
+        raise ReservationError(f'单次预约不能超过 {int(config["RESERVATION_MAX_DURATION"]) // 3600} 小时。')
+    if starts > now + int(config['RESERVATION_HORIZON']):
+        raise ReservationError(f'只能预约 {int(config["RESERVATION_HORIZON"]) // 86400} 天内的时间。')
+
+
+def book(db, user_id, vehicle_id, starts, ends, gas_card_id=None):
+    """Book ``vehicle_id`` (and ``gas_card_id`` if given) for
+    ``[starts, ends)`` and commit. Returns the reservation id.
+
+    Raises :class:`ReservationError` when the window is invalid, a resource
+    does not exist or is already booked for part of the window, or the user
+    has ``RESERVATION_MAX_PER_USER`` upcoming bookings.
+    """
+    now = int(time.time())
+    _check_window(starts, ends, now)
+    limit = int(current_app.config['RESERVATION_MAX_PER_USER'])
+
+    def work(db):
+        version = _begin_change(db)
+        index = _index()
+        if db.execute('SELECT 1 FROM vehicles WHERE id = ?', (vehicle_id,)).fetchone() is None:
+            raise ReservationError('未找到车辆。')
+        if index.overlapping(db, 'vehicle', vehicle_id, starts, ends, version=version - 1):
+            raise ReservationError('该车辆在所选时间段已被预约。')
+        if gas_card_id is not None:
+            if db.execute('SELECT 1 FROM gas_cards WHERE id = ?', (gas_card_id,)).fetchone() is None:
+                raise ReservationError('未找到加油卡。')
+            if index.overlapping(db, 'gas_card', gas_card_id, starts, ends, version=version - 1):
+                raise ReservationError('该加油卡在所选时间段已被预约。')
+        if limit > 0:
+            upcoming = db.execute(
+                'SELECT COUNT(*) FROM reservations WHERE user_id = ? AND ends > ?', (user_id, now)
+            ).fetchone()[0]
+            if upcoming >= limit:
+                raise ReservationError(f'每人最多同时保留 {limit} 个预约。')
+        reservation_id = db.execute(
+            'INSERT INTO reservations (vehicle_id, gas_card_id, user_id, starts, ends) VALUES (?, ?, ?, ?, ?)',
+            (vehicle_id, gas_card_id, user_id, starts, ends)
+        ).lastrowid
+        row = {'id': reservation_id, 'vehicle_id': vehicle_id, 'gas_card_id': gas_card_id,
+               'user_id': user_id, 'starts': starts, 'ends': ends}
+        return version, row
+
+    version, row = run_immediate(db, work)
+    _index().applied(version, added=[row])
+    return row['id']
+
+
+def cancel(db, reservation_id, user_id=None):
+    """Cancel a booking of ``user_id`` (any user's when ``None``) and commit.
+    A booking that has started is cut short at the current time instead.
+    Returns False when there was no such upcoming booking."""
+    now = int(time.time())
+
+    def work(db):
+        row = db.execute(f'SELECT {COLUMNS} FROM reservations WHERE id = ?', (reservation_id,)).fetchone()
+        if row is None or row['ends'] <= now or (user_id is not None and row['user_id'] != user_id):
+            return None
+        version = _begin_change(db)
+        if row['starts'] < now:
+            db.execute('UPDATE reservations SET ends = ? WHERE id = ?', (now, reservation_id))
+            added = [dict(zip(row.keys(), row), ends=now)]
+        else:
+            db.execute('DELETE FROM reservations WHERE id = ?', (reservation_id,))
+            added = []
+        return version, row, added
+
+    result = run_immediate(db, work)
+    if result is None:
+        return False
+    version, row, added = result
+    _index().applied(version, added=added, removed=[row])
+    return True
+
+
+def forget(db, kind, resource_id):
+    """Drop the bookings of a deleted vehicle, or detach a deleted gas card
+    from its bookings, in the caller's transaction."""
+    bump(db, 'reservations')
+    if kind == 'vehicle':
+        db.execute('DELETE FROM reservations WHERE vehicle_id = ?', (resource_id,))
+    else:
+        db.execute('UPDATE reservations SET gas_card_id = NULL WHERE gas_card_id = ?', (resource_id,))
+
+
+def holder(db, kind, resource_id, user_id, now=None):
+    """The booking that keeps ``user_id`` from taking the resource now, or
+    ``None``. Bookings hold from ``RESERVATION_HOLD_BEFORE`` seconds before
+    they start; the user's own booking never blocks."""
+    now = int(time.time()) if now is None else now
+    hold = int(current_app.config['RESERVATION_HOLD_BEFORE'])
+    # the window can hold someone else's running booking and the user's
+    # own next one: any booking of another user blocks
+    for entry in _index().all_overlapping(db, kind, resource_id, now, now + hold + 1):
+        if user_id is None or entry.user_id != user_id:
+            return entry
+    return None
+
+
+def free(db, starts, ends):
+    """Return ``(vehicles, gas_cards)`` inventory rows with no booking in
+    ``[starts, ends)``."""
+    vehicles, gas_cards = get_inventory(db)
+    index = _index()
+    vehicle_ids = set(index.free(db, 'vehicle', [v['id'] for v in vehicles], starts, ends))
+    card_ids = set(index.free(db, 'gas_card', [c['id'] for c in gas_cards], starts, ends))
+    return ([v for v in vehicles if v['id'] in vehicle_ids],
+            [c for c in gas_cards if c['id'] in card_ids])
+
+
+def upcoming(db, user_id=None, limit=200):
+    """Bookings that have not ended, soonest first; only ``user_id``'s
+    when given."""
+    params = [int(time.time())]
+    where = 'r.ends > ?'
+    if user_id is not None:
+        where += ' AND r.user_id = ?'
+        params.append(user_id)
+    return db.execute(
+        'SELECT r.id, r.vehicle_id, r.gas_card_id, r.user_id, r.starts, r.ends, '
+        'v.plate, g.card_number, u.username FROM reservations r '
+        'LEFT JOIN vehicles v ON v.id = r.vehicle_id '
+        'LEFT JOIN gas_cards g ON g.id = r.gas_card_id '
+        'LEFT JOIN users u ON u.id = r.user_id '
+        f'WHERE {where} ORDER BY r.starts LIMIT ?',
+        params + [limit]
+    ).fetchall()
+
+
+def prune(db, retention_days):
+    """Delete bookings that ended more than ``retention_days`` ago."""
+    cutoff = int(time.time()) - int(retention_days) * 86400
+    return db.execute('DELETE FROM reservations WHERE ends < ?', (cutoff,)).rowcount
+
+
+def init_reservations(app):
+    app.extensions['reservation_index'] = ReservationIndex()
@@ -1,3 +1,3 @@
-from . import home, auth, lock, vehicle, gas_card, record
+from . import home, auth, lock, vehicle, gas_card, record, metrics, events, analytics, reservation
 
-bps = [home.bp, auth.bp, lock.bp, vehicle.bp, gas_card.bp, record.bp]
\ No newline at end of file
+bps = [home.bp, auth.bp, lock.bp, vehicle.bp, gas_card.bp, record.bp, metrics.bp, events.bp, analytics.bp, reservation.bp]
\ No newline at end of file
@@ -0,0 +1,42 @@
+from flask import Blueprint, render_template, request, jsonify
+from vehicles.db import get_db
+from vehicles import analytics
+from .lock import admin_required
+
+bp = Blueprint('analytics', __name__, url_prefix='/analytics')
+
+
+def _params():
+    group = request.args.get('group', 'vehicle')
+    if group not in analytics.GROUPS:
+        group = 'vehicle'
+    since = (request.args.get('since') or '').strip() or None
+    until = (request.args.get('until') or '').strip() or None
+    return group, since, until
+
+
+@bp.route('/')
+@admin_required
+def report():
+    group, since, until = _params()
+    db = get_db()
+    return render_template(
+        'analytics/report.html',
+        rows=analytics.report(db, group, since, until),
+        open_rows=analytics.open_checkouts(db),
+        group=group, since=since or '', until=until or '',
+    )
+
+
+@bp.route('/api')
+@admin_required
+def report_api():
+    group, since, until = _params()
+    db = get_db()
+    return jsonify({
+        'group': group,
+        'since': since,
+        'until': until,
+        'rows': [dict(row) for row in analytics.report(db, group, since, until)],
+        'open': [dict(row) for row in analytics.open_checkouts(db)],
+    })
@@ -1,10 +1,9 @@
 from flask import (
-    Blueprint, flash, redirect, render_template, request, session, url_for, g
+    Blueprint, current_app, flash, jsonify, redirect, render_template, request, session, url_for, g
 )
 from functools import wraps
 from vehicles.db import get_db
-import sqlite3
-from werkzeug.security import generate_password_hash, check_password_hash
+from vehicles import audit as applications, user_cache, hashing, ratelimit, users
 
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
@@ -21,15 +20,39 @@ def login_required(view):
     return wrapped_view
 
 
+def is_admin():
+    """True if the logged-in user is the admin.
+
+    Uses the role stored in the signed session at login; sessions created
+    before roles were stored fall back to the loaded user row.
+    """
+    role = session.get('role')
+    if role is not None:
+        return role == 'admin'
+    user = g.get('user')
+    return user is not None and user['username'] == 'admin'
+
+
+def start_session(user_id, username):
+    session.clear()
+    # id, username and role never change for a user, so they live in the
+    # signed cookie and admin checks need no lookup
+    session['user_id'] = user_id
+    session['username'] = username
+    session['role'] = 'admin' if username == 'admin' else 'user'
+    session.permanent = True
+
+
 @bp.before_app_request
 def load_logged_in_user():
     user_id = session.get('user_id')
     if user_id is None:
         g.pop('user', None)
+    elif request.endpoint == 'static':
+        # static files never look at the user
+        return
     else:
-        g.user = get_db().execute(
-            'SELECT * FROM users WHERE id = ?', (user_id,)
-        ).fetchone()
+        g.user = user_cache.load_user(user_id)
 
 
 @bp.route('/register', methods=('GET', 'POST'))
@@ -40,29 +63,18 @@ def register():
         db = get_db()
 
         try:
-            hashed_password = generate_password_hash(password)
-            cur = db.execute(
-                'INSERT INTO users (username, password) VALUES (?, ?)',
-                (username, hashed_password)
-            )
+            hashed_password = hashing.hash_password(password)
+            user_id = users.create(db, username, hashed_password)
             db.commit()
             # Auto-login the newly created user
-            session.clear()
-            user_id = cur.lastrowid
-            session['user_id'] = user_id
-            session.permanent = True
+            start_session(user_id, username)
 
             # Auto-submit identification application and mark user as pending (2)
             try:
                 # prevent duplicate pending applications just in case
-                existing = db.execute(
-                    "SELECT * FROM applications WHERE username = ? AND status = 'pending'",
-                    (username,)
-                ).fetchone()
-                if not existing:
-                    db.execute('INSERT INTO applications (username, status) VALUES (?, ?)', (username, 'pending'))
-                    db.execute('UPDATE users SET is_identified = 2 WHERE id = ?', (user_id,))
+                if applications.submit(db, username):
                     db.commit()
+                    user_cache.invalidate(user_id=user_id)
                     flash('注册并自动提交了核实申请。', 'success')
                 else:
                     flash('注册成功，已有待处理的核实申请。', 'success')
@@ -72,7 +84,8 @@ def register():
                 flash('注册成功，但自动提交核实申请时发生错误，请手动提交核实。', 'warning')
             # Redirect to home (user is already logged in)
             return redirect(url_for('home.index'))
-        except sqlite3.IntegrityError:
+        except db.IntegrityError:
+            db.rollback()
             flash(f"用户 {username} 已存在。", 'error')
 
     return render_template('auth/register.html')
@@ -85,21 +98,31 @@ def login():
         password = request.form['password']
         db = get_db()
         error = None
-        user = db.execute(
-            'SELECT * FROM users WHERE username = ?', (username,)
-        ).fetchone()
+
+        # refuse before hashing anything, so brute force cannot burn CPU
+        wait = ratelimit.retry_after(db, username, request.remote_addr)
+        if wait:
+            flash(f'登录失败次数过多，请 {(wait + 59) // 60} 分钟后再试。')
+            return render_template('auth/login.html'), 429
+
+        user = users.by_username(db, username)
 
         if user is None:
             error = '用户名不存在。'
-        elif not check_password_hash(user['password'], password):
+        elif not hashing.verify(user['password'], password):
             error = '密码错误。'
 
         if error is None:
-            session.clear()
-            session['user_id'] = user['id']
-            session.permanent = True
+            if hashing.needs_rehash(user['password']):
+                # upgrade to the current policy while the plain password is at hand
+                users.replace_password(db, user['id'], user['password'], hashing.hash_password(password))
+            ratelimit.clear(db, username, request.remote_addr)
+            db.commit()
+            start_session(user['id'], user['username'])
             return redirect(url_for('home.index'))
 
+        ratelimit.record_failure(db, username, request.remote_addr)
+        db.commit()
         flash(error)
 
     return render_template('auth/login.html')
@@ -120,74 +143,99 @@ def identification():
         db = get_db()
         username = g.user['username']
 
-        # prevent duplicate pending applications
-        existing = db.execute(
-            "SELECT * FROM applications WHERE username = ? AND status = 'pending'",
-            (username,)
-        ).fetchone()
-        if existing:
+        # prevent duplicate pending applications; marks the user pending (2)
+        if not applications.submit(db, username):
             flash('核实中，请等待管理员处理。', 'error')
             return redirect(url_for('home.index'))
-
-        db.execute('INSERT INTO applications (username, status) VALUES (?, ?)', (username, 'pending'))
-        # mark user as pending (2)
-        db.execute('UPDATE users SET is_identified = 2 WHERE username = ?', (username,))
         db.commit()
+        user_cache.invalidate(username=username)
         flash('申请已提交，请联系网管通过核实。', 'success')
         return redirect(url_for('home.index'))
 
     return render_template('auth/identification.html')
 
 
+# filters of the audit list, kept across pages and decisions
+AUDIT_FILTERS = ('status', 'user', 'since', 'until')
+
+
+def _audit_query(source):
+    return {key: source.get(key).strip() for key in AUDIT_FILTERS if (source.get(key) or '').strip()}
+
+
 @bp.route('/audit', methods=('GET',))
 @login_required
 def audit():
     # admin-only
-    if g.user is None or g.user['username'] != 'admin':
+    if g.user is None or not is_admin():
         flash('仅管理员可访问。', 'error')
         return redirect(url_for('home.index'))
 
+    query = _audit_query(request.args)
+    status = query.get('status') if query.get('status') in applications.STATUSES else 'pending'
     db = get_db()
-    apps = db.execute("SELECT * FROM applications WHERE status = 'pending'").fetchall()
-    return render_template('auth/audit.html', applications=apps)
+    apps, next_after_id = applications.page(
+        db, int(current_app.config['AUDIT_PAGE_SIZE']), status=status,
+        after_id=request.args.get('after_id', type=int), username=query.get('user'),
+        since=query.get('since'), until=query.get('until'),
+    )
+    return render_template(
+        'auth/audit.html', applications=apps, next_after_id=next_after_id, query=query,
+        status=status, pending_count=applications.count(db),
+    )
+
+
+def _decisions():
+    """Read ``(application_id, action)`` pairs from a JSON or form request.
+
+    JSON: ``{"decisions": [{"id": 1, "action": "approve"}, ...]}``, or one
+    ``action`` for a list of ``ids``, or the single ``application_id`` and
+    ``action`` of the original API. Form: a row button's ``decision``
+    (``<id>:<action>``), else the checked ``application_id`` boxes with the
+    ``action`` of the button pressed.
+    """
+    data = request.get_json(silent=True)
+    if data is not None:
+        if 'decisions' in data:
+            return [(item['id'], item['action']) for item in data['decisions']]
+        ids = data.get('ids') or [data.get('application_id')]
+        return [(app_id, data.get('action')) for app_id in ids if app_id]
+    decision = request.form.get('decision')
+    if decision:
+        app_id, _, action = decision.partition(':')
+        return [(app_id, action)]
+    action = request.form.get('action')
+    return [(app_id, action) for app_id in request.form.getlist('application_id')]
 
 
 @bp.route('/audit/decide', methods=('POST',))
 @login_required
 def audit_decide():
     # admin-only
-    if g.user is None or g.user['username'] != 'admin':
+    if g.user is None or not is_admin():
+        if request.is_json:
+            return jsonify({'error': '仅管理员可操作。'}), 403
         flash('仅管理员可操作。', 'error')
         return redirect(url_for('home.index'))
 
-    app_id = request.form.get('application_id') or (request.get_json() or {}).get('application_id')
-    action = request.form.get('action') or (request.get_json() or {}).get('action')
-    if not app_id or action not in ('approve', 'reject'):
+    back = url_for('auth.audit', **_audit_query(request.form))
+    try:
+        decisions = _decisions()
+        applied, skipped, user_ids = applications.decide(get_db(), decisions)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        decisions = None
+    if not decisions:
+        if request.is_json:
+            return jsonify({'error': '参数缺失或不正确。'}), 400
         flash('参数缺失或不正确。', 'error')
-        return redirect(url_for('auth.audit'))
-
-    db = get_db()
-    application = db.execute('SELECT * FROM applications WHERE id = ?', (app_id,)).fetchone()
-    if not application:
-        flash('未找到申请。', 'error')
-        return redirect(url_for('auth.audit'))
-
-    username = application['username']
-    if action == 'approve':
-        try:
-            # mark user as approved (1)
-            db.execute('UPDATE users SET is_identified = 1 WHERE username = ?', (username,))
-            db.execute("UPDATE applications SET status = 'approved' WHERE id = ?", (app_id,))
-            db.commit()
-            flash(f'已通过 {username} 的申请。', 'success')
-        except Exception as e:
-            print(f"审核通过更新错误: {e}")
-            flash('审核处理失败。', 'error')
-    else:
-        # mark user as rejected (3)
-        db.execute('UPDATE users SET is_identified = 3 WHERE username = ?', (username,))
-        db.execute("UPDATE applications SET status = 'rejected' WHERE id = ?", (app_id,))
-        db.commit()
-        flash(f'已拒绝 {username} 的认证申请。', 'info')
-
-    return redirect(url_for('auth.audit'))
\ No newline at end of file
+        return redirect(back)
+
+    for user_id in user_ids:
+        user_cache.invalidate(user_id=user_id)
+    if request.is_json:
+        return jsonify({'approved': applied['approve'], 'rejected': applied['reject'], 'skipped': skipped})
+    if applied['approve'] or applied['reject']:
+        flash(f"已通过 {applied['approve']} 个、拒绝 {applied['reject']} 个认证申请。", 'success')
+    if skipped:
+        flash(f'{len(skipped)} 个申请不存在或已处理，已跳过。', 'info')
+    return redirect(back)
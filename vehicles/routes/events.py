@@ -0,0 +1,52 @@
+from flask import Blueprint, Response, current_app, request, g, abort, stream_with_context
+from vehicles.events import sse_frame
+
+bp = Blueprint('events', __name__)
+
+
+def start_id():
+    """Return the event id the stream resumes after, or ``None`` when the
+    client may not subscribe."""
+    if not getattr(g, 'user', None):
+        return None
+    # resume after the snapshot the page was rendered from, or after the last
+    # event the browser saw when EventSource reconnects on its own
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_id', 0, type=int)
+    return last_id
+
+
+@bp.route('/events')
+def stream():
+    """Server-sent status events. An open stream holds a request thread,
+    so each worker keeps at most ``EVENTS_MAX_STREAMS`` open; beyond that
+    the response carries what is pending and ends, and the browser polls
+    again after ``EVENTS_POLL_RETRY`` seconds. (The ASGI entry point serves
+    ``/events`` without threads and has no such limit.)"""
+    last_id = start_id()
+    if last_id is None:
+        abort(401)
+    broker = current_app.extensions['events_broker']
+    config = current_app.config
+    duration = float(config['EVENTS_STREAM_SECONDS'])
+    limit = int(config['EVENTS_MAX_STREAMS'])
+    retry = int(float(config['EVENTS_POLL_RETRY']) * 1000)
+
+    def generate():
+        if not broker.claim_stream(limit):
+            yield f'retry: {retry}\n\n'
+            for event in broker.catch_up(last_id):
+                yield sse_frame(event)
+            return
+        try:
+            yield 'retry: 3000\n\n'
+            for event in broker.subscribe(last_id, duration):
+                yield sse_frame(event)
+        finally:
+            broker.release_stream()
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,12 +1,46 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, current_app, jsonify, render_template, request
 from vehicles.db import get_db
+from vehicles.inventory import get_summary
+from vehicles.etags import conditional
+from vehicles import search as lookup
+from .auth import login_required
 
 bp = Blueprint('home', __name__)
 
 
 @bp.route('/')
+@conditional
 def index():
+    counts, last_event_id = get_summary(get_db())
+    return render_template('home/index.html', counts=counts, last_event_id=last_event_id)
+
+
+@bp.route('/search')
+@login_required
+@conditional
+def search():
+    """Top matches for the home form: ``?kind=vehicle|gas_card&q=...``,
+    optionally ``status=returned|taken`` and ``limit``. The response also
+    carries the status counts of ``kind``."""
+    kind = request.args.get('kind', 'vehicle')
+    if kind not in lookup.KINDS:
+        return jsonify({'error': 'kind 必须是 vehicle 或 gas_card。'}), 400
+    status = request.args.get('status') or None
+    if status is not None and status not in lookup.STATUSES:
+        return jsonify({'error': 'status 必须是 taken 或 returned。'}), 400
+    config = current_app.config
+    try:
+        limit = int(request.args.get('limit', config['SEARCH_LIMIT']))
+    except ValueError:
+        limit = int(config['SEARCH_LIMIT'])
+    limit = max(0, min(limit, int(config['SEARCH_MAX_LIMIT'])))
     db = get_db()
-    vehicles = db.execute('SELECT * FROM vehicles').fetchall()
-    gas_cards = db.execute('SELECT * FROM gas_cards').fetchall()
-    return render_template('home/index.html', vehicles=vehicles, gas_cards=gas_cards)
\ No newline at end of file
+    q = request.args.get('q', '')
+    rows = lookup.search(db, kind, q, limit, status) if limit else []
+    counts, _ = get_summary(db)
+    return jsonify({
+        'kind': kind,
+        'q': q,
+        'results': [dict(row) for row in rows],
+        'counts': counts[kind],
+    })
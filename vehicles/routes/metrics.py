@@ -0,0 +1,19 @@
+import hmac
+from flask import Blueprint, Response, current_app, request, session, g, flash, redirect, url_for
+from .auth import is_admin
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.route('/metrics')
+def metrics():
+    # Admin session, or a bearer token for Prometheus scrapers
+    token = current_app.config.get('METRICS_TOKEN')
+    auth = request.headers.get('Authorization', '')
+    authorized = bool(token) and hmac.compare_digest(auth, f'Bearer {token}')
+    if not authorized and ('user_id' not in session or not getattr(g, 'user', None) or not is_admin()):
+        flash('管理员权限不足。')
+        return redirect(url_for('auth.login'))
+
+    body = current_app.extensions['metrics'].render()
+    return Response(body, mimetype='text/plain; version=0.0.4')
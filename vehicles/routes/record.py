@@ -1,79 +1,67 @@
-from flask import Blueprint, render_template, request
+from flask import Blueprint, render_template, request, current_app, Response, stream_with_context
 from vehicles.db import get_db
+from vehicles import history
+from vehicles.etags import conditional
 
 bp = Blueprint('record', __name__, url_prefix='/record')
 
 
+def _filters(resource_arg):
+    """Read the shared history filters from the query string."""
+    args = request.args
+    before_id = args.get('before_id', type=int)
+    action = (args.get('action') or '').strip()
+    return {
+        'before_id': before_id,
+        'resource': (args.get(resource_arg) or '').strip() or None,
+        'username': (args.get('user') or '').strip() or None,
+        'since': (args.get('since') or '').strip() or None,
+        'until': (args.get('until') or '').strip() or None,
+        'action': action if action in history.ACTIONS else None,
+    }
+
+
+def _render(kind, template, resource_arg):
+    filters = _filters(resource_arg)
+    rows, next_before_id = history.page(
+        get_db(), kind, int(current_app.config['HISTORY_PAGE_SIZE']), **filters
+    )
+    # query-string values for the filter form and the "older" link
+    query = {key: value for key, value in request.args.items() if value and key != 'before_id'}
+    return render_template(template, records=rows, next_before_id=next_before_id, query=query)
+
+
+def stream_args(resource_arg):
+    """Return ``(filters, limit)`` for a history API request."""
+    filters = _filters(resource_arg)
+    limit = request.args.get('limit', type=int) or int(current_app.config['HISTORY_PAGE_SIZE'])
+    limit = max(1, min(limit, int(current_app.config['HISTORY_API_MAX_LIMIT'])))
+    return filters, limit
+
+
+def _stream(kind, resource_arg):
+    filters, limit = stream_args(resource_arg)
+    rows = history.iter_history(get_db(), kind, limit=limit, **filters)
+    return Response(stream_with_context(history.dump_json(rows, limit)), mimetype='application/json')
+
+
 @bp.route('/vehicle')
+@conditional
 def vehicle():
-    db = get_db()
-    plate = (request.args.get('plate') or '').strip()
-    if plate:
-        rows = db.execute(
-            """
-            SELECT rv.id, rv.action, rv.timestamp, v.plate AS vehicle_plate, u.username
-            FROM record_vehicles rv
-            LEFT JOIN vehicles v ON rv.vehicle_id = v.id
-            LEFT JOIN users u ON rv.user_id = u.id
-            WHERE v.plate = ?
-            ORDER BY rv.id DESC
-            LIMIT 200
-            """,
-            (plate,)
-        ).fetchall()
-    else:
-        rows = db.execute(
-            """
-            SELECT rv.id, rv.action, rv.timestamp, v.plate AS vehicle_plate, u.username
-            FROM record_vehicles rv
-            LEFT JOIN vehicles v ON rv.vehicle_id = v.id
-            LEFT JOIN users u ON rv.user_id = u.id
-            ORDER BY rv.id DESC
-            LIMIT 200
-            """
-        ).fetchall()
-    return render_template('record/vehicle.html', records=rows, plate=plate)
+    return _render('vehicle', 'record/vehicle.html', 'plate')
 
 
 @bp.route('/gas')
+@conditional
 def gas():
-    db = get_db()
-    card = (request.args.get('card') or '').strip()
-    query_with_balance = (
-        "SELECT rg.id, rg.action, rg.timestamp, g.card_number AS gas_card_number, rg.balance AS balance, u.username "
-        "FROM record_gas_cards rg "
-        "LEFT JOIN gas_cards g ON rg.gas_card_id = g.id "
-        "LEFT JOIN users u ON rg.user_id = u.id "
-    )
-    try:
-        if card:
-            rows = db.execute(query_with_balance + "WHERE g.card_number = ? ORDER BY rg.id DESC LIMIT 200", (card,)).fetchall()
-        else:
-            rows = db.execute(query_with_balance + "ORDER BY rg.id DESC LIMIT 200").fetchall()
-    except Exception:
-        # fallback for DBs that don't have `rg.balance` column: use current gas card balance
-        if card:
-            rows = db.execute(
-                """
-                SELECT rg.id, rg.action, rg.timestamp, g.card_number AS gas_card_number, g.balance AS balance, u.username
-                FROM record_gas_cards rg
-                LEFT JOIN gas_cards g ON rg.gas_card_id = g.id
-                LEFT JOIN users u ON rg.user_id = u.id
-                WHERE g.card_number = ?
-                ORDER BY rg.id DESC
-                LIMIT 200
-                """,
-                (card,)
-            ).fetchall()
-        else:
-            rows = db.execute(
-                """
-                SELECT rg.id, rg.action, rg.timestamp, g.card_number AS gas_card_number, g.balance AS balance, u.username
-                FROM record_gas_cards rg
-                LEFT JOIN gas_cards g ON rg.gas_card_id = g.id
-                LEFT JOIN users u ON rg.user_id = u.id
-                ORDER BY rg.id DESC
-                LIMIT 200
-                """
-            ).fetchall()
-    return render_template('record/gas.html', records=rows, card=card)
\ No newline at end of file
+    return _render('gas', 'record/gas.html', 'card')
+
+
+@bp.route('/api/vehicle')
+def vehicle_api():
+    return _stream('vehicle', 'plate')
+
+
+@bp.route('/api/gas')
+def gas_api():
+    return _stream('gas', 'card')
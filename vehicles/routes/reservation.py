@@ -0,0 +1,81 @@
+import time
+from flask import Blueprint, flash, g, jsonify, redirect, render_template, request, url_for
+from vehicles.db import get_db
+from vehicles import localtime, reservations
+from .auth import is_admin, login_required
+
+bp = Blueprint('reservation', __name__, url_prefix='/reservation')
+
+
+def _window(args):
+    return localtime.parse_local(args.get('start')), localtime.parse_local(args.get('end'))
+
+
+def _optional_id(value):
+    value = (value or '').strip()
+    return int(value) if value.isdigit() else None
+
+
+@bp.route('/', methods=('GET', 'POST'))
+@login_required
+def index():
+    db = get_db()
+    identified = g.user is not None and g.user['is_identified'] == 1
+    if request.method == 'POST':
+        starts, ends = _window(request.form)
+        vehicle_id = _optional_id(request.form.get('vehicle_id'))
+        if not identified:
+            flash('请先完成身份核实再预约。')
+        elif vehicle_id is None:
+            flash('请选择车辆。')
+        else:
+            try:
+                reservations.book(
+                    db, g.user['id'], vehicle_id, starts, ends,
+                    gas_card_id=_optional_id(request.form.get('gas_card_id')),
+                )
+                flash('预约成功。')
+                return redirect(url_for('reservation.index'))
+            except reservations.ReservationError as e:
+                flash(str(e))
+        return redirect(url_for('reservation.index', start=request.form.get('start'), end=request.form.get('end')))
+
+    starts, ends = _window(request.args)
+    vehicles = gas_cards = None
+    if starts is not None and ends is not None and ends > starts:
+        vehicles, gas_cards = reservations.free(db, starts, ends)
+    return render_template(
+        'reservation/index.html',
+        start=request.args.get('start', ''), end=request.args.get('end', ''),
+        vehicles=vehicles, gas_cards=gas_cards, identified=identified,
+        bookings=reservations.upcoming(db, None if is_admin() else g.user['id']),
+        now=int(time.time()),
+    )
+
+
+@bp.route('/<int:reservation_id>/cancel', methods=('POST',))
+@login_required
+def cancel(reservation_id):
+    # the admin may cancel anyone's booking
+    if reservations.cancel(get_db(), reservation_id, None if is_admin() else g.user['id']):
+        flash('预约已取消。')
+    else:
+        flash('未找到可取消的预约。')
+    return redirect(url_for('reservation.index'))
+
+
+@bp.route('/api/free')
+@login_required
+def free_api():
+    """Vehicles and gas cards with no booking between ``start`` and ``end``
+    (unix seconds or local ``YYYY-MM-DDTHH:MM``)."""
+    starts, ends = _window(request.args)
+    if starts is None or ends is None or ends <= starts:
+        return jsonify({'error': '请提供有效的 start 和 end，且 end 晚于 start。'}), 400
+    vehicles, gas_cards = reservations.free(get_db(), starts, ends)
+    return jsonify({
+        'start': starts,
+        'end': ends,
+        'vehicles': [{'id': v['id'], 'plate': v['plate'], 'status': v['status']} for v in vehicles],
+        'gas_cards': [{'id': c['id'], 'card_number': c['card_number'], 'status': c['status']} for c in gas_cards],
+    })
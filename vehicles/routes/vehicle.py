@@ -1,5 +1,9 @@
-from flask import Blueprint, render_template, request, jsonify
-from vehicles.db import get_db
+import click
+from flask import (Blueprint, render_template, request, jsonify, Response, stream_with_context,
+                   current_app)
+from vehicles.db import get_db, run_immediate
+from vehicles import inventory, bulk, fleet
+from vehicles.etags import conditional
 from .lock import admin_required
 
 bp = Blueprint('vehicle', __name__, url_prefix='/vehicle')
@@ -7,9 +11,9 @@ bp = Blueprint('vehicle', __name__, url_prefix='/vehicle')
 
 @bp.route('/manage')
 @admin_required
+@conditional
 def manage():
-    db = get_db()
-    vehicles = db.execute('SELECT * FROM vehicles').fetchall()
+    vehicles, _ = inventory.get_inventory(get_db())
     return render_template('vehicle/manage.html', vehicles=vehicles)
     
     
@@ -26,15 +30,10 @@ def add():
 
     try:
         db = get_db()
-        cur = db.execute(
-            'INSERT INTO vehicles (plate) VALUES (?)',
-            (plate,)
-        )
-        db.commit()
-        vid = cur.lastrowid
+        vid = run_immediate(db, lambda db: fleet.add_vehicle(db, plate))
         return jsonify({'message': '添加成功', 'id': vid}), 200
-    except Exception as e:
-        print(f"添加车辆错误: {e}")
+    except Exception:
+        current_app.logger.exception('add vehicle failed')
         return jsonify({'error': '添加失败'}), 500
 
 
@@ -51,9 +50,60 @@ def delete():
 
     try:
         db = get_db()
-        db.execute('DELETE FROM vehicles WHERE id = ?', (vehicle_id,))
-        db.commit()
+        run_immediate(db, lambda db: fleet.delete_vehicle(db, vehicle_id))
         return jsonify({'message': '删除成功', 'id': vehicle_id}), 200
-    except Exception as e:
-        print(f"删除车辆错误: {e}")
-        return jsonify({'error': '删除失败'}), 500
\ No newline at end of file
+    except Exception:
+        current_app.logger.exception('delete vehicle failed')
+        return jsonify({'error': '删除失败'}), 500
+
+
+@bp.post('/import')
+@admin_required
+def import_rows():
+    try:
+        rows = bulk.rows_from_request(request)
+    except bulk.BulkError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        result = bulk.import_rows(get_db(), 'vehicle', rows)
+    except Exception:
+        current_app.logger.exception('import vehicles failed')
+        return jsonify({'error': '导入失败，未导入任何数据'}), 500
+    return jsonify(result), 200
+
+
+@bp.get('/export')
+@admin_required
+def export():
+    fmt = 'json' if request.args.get('format') == 'json' else 'csv'
+    mimetype = 'application/json' if fmt == 'json' else 'text/csv'
+    return Response(
+        stream_with_context(bulk.export_rows(get_db(), 'vehicle', fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=vehicles.{fmt}'},
+    )
+
+
+@bp.cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_command(path):
+    """Import vehicles from a CSV or JSON file."""
+    with open(path, 'rb') as f:
+        try:
+            rows = bulk.parse(f.read(), path)
+        except bulk.BulkError as e:
+            raise click.ClickException(str(e))
+    result = bulk.import_rows(get_db(), 'vehicle', rows)
+    click.echo(f"Imported {result['inserted']} of {len(rows)} rows")
+    for conflict in result['conflicts']:
+        click.echo(f"  row {conflict['row']} {conflict['key']}: {conflict['error']}")
+
+
+@bp.cli.command('export')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json']), default='csv')
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+def export_command(fmt, output):
+    """Export all vehicles as CSV or JSON."""
+    for chunk in bulk.export_rows(get_db(), 'vehicle', fmt):
+        output.write(chunk)
@@ -4,6 +4,21 @@ DROP TABLE IF EXISTS applications;
 DROP TABLE IF EXISTS gas_cards;
 DROP TABLE IF EXISTS passwords;
 DROP TABLE IF EXISTS assignments;
+DROP TABLE IF EXISTS vehicles_fts;
+DROP TABLE IF EXISTS gas_cards_fts;
+-- state kept about the rows above, which start again from id 1
+DROP TABLE IF EXISTS data_versions;
+DROP TABLE IF EXISTS status_events;
+DROP TABLE IF EXISTS usage_daily;
+DROP TABLE IF EXISTS open_checkouts;
+DROP TABLE IF EXISTS login_failures;
+DROP TABLE IF EXISTS reservations;
+DROP TABLE IF EXISTS idempotency_keys;
+DROP TABLE IF EXISTS journal;
+DROP TABLE IF EXISTS journal_snapshots;
+
+-- All time columns hold unix seconds (UTC); they are shown in TIMEZONE
+-- by the `localtime` template filter (see vehicles/localtime.py)
 
 CREATE TABLE IF NOT EXISTS vehicles (
 	id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -22,7 +37,7 @@ CREATE TABLE IF NOT EXISTS applications (
 	id INTEGER PRIMARY KEY AUTOINCREMENT,
 	username TEXT NOT NULL,
 	status TEXT NOT NULL DEFAULT 'pending',
-	created TIMESTAMP DEFAULT (datetime('now', '+8 hours')),
+	created INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
 	FOREIGN KEY (username) REFERENCES users (username)
 );
 
@@ -44,7 +59,7 @@ CREATE TABLE IF NOT EXISTS record_vehicles (
 	vehicle_id INTEGER NOT NULL,
 	user_id INTEGER NOT NULL,
 	action TEXT NOT NULL,
-	timestamp TIMESTAMP DEFAULT (datetime('now', '+8 hours')),
+	timestamp INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
 	FOREIGN KEY(vehicle_id) REFERENCES vehicles(id),
 	FOREIGN KEY(user_id) REFERENCES users(id)
 );
@@ -55,7 +70,187 @@ CREATE TABLE IF NOT EXISTS record_gas_cards (
 	gas_card_id INTEGER NOT NULL,
 	action TEXT NOT NULL,
 	balance REAL,
-	timestamp TIMESTAMP DEFAULT (datetime('now', '+8 hours')),
+	timestamp INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+	FOREIGN KEY(gas_card_id) REFERENCES gas_cards(id),
+	FOREIGN KEY(user_id) REFERENCES users(id)
+);
+
+-- Rows pruned from the record tables are moved here with their original ids
+CREATE TABLE IF NOT EXISTS record_vehicles_archive (
+	id INTEGER PRIMARY KEY,
+	vehicle_id INTEGER NOT NULL,
+	user_id INTEGER NOT NULL,
+	action TEXT NOT NULL,
+	timestamp INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS record_gas_cards_archive (
+	id INTEGER PRIMARY KEY,
+	user_id INTEGER NOT NULL,
+	gas_card_id INTEGER NOT NULL,
+	action TEXT NOT NULL,
+	balance REAL,
+	timestamp INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_record_vehicles_vehicle ON record_vehicles (vehicle_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_vehicles_user ON record_vehicles (user_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_gas_cards_card ON record_gas_cards (gas_card_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_gas_cards_user ON record_gas_cards (user_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_vehicles_archive_vehicle ON record_vehicles_archive (vehicle_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_vehicles_archive_user ON record_vehicles_archive (user_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_gas_cards_archive_card ON record_gas_cards_archive (gas_card_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_gas_cards_archive_user ON record_gas_cards_archive (user_id, id);
+CREATE INDEX IF NOT EXISTS idx_applications_username_status ON applications (username, status);
+CREATE INDEX IF NOT EXISTS idx_applications_status ON applications (status, id);
+
+-- Change counters bumped in the same transaction as the data they cover;
+-- per-worker caches compare against them (see vehicles/inventory.py)
+CREATE TABLE IF NOT EXISTS data_versions (
+	name TEXT PRIMARY KEY,
+	version INTEGER NOT NULL DEFAULT 0
+);
+
+-- Change sequence of vehicle/gas card status changes pushed to /events
+-- (see vehicles/events.py); `created` is a unix timestamp
+CREATE TABLE IF NOT EXISTS status_events (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	kind TEXT NOT NULL,
+	payload TEXT NOT NULL,
+	created INTEGER NOT NULL
+);
+
+-- Usage rollups maintained by vehicles/analytics.py: one row per local day,
+-- kind ('vehicle' or 'gas_card'), resource and user (0 when unknown)
+CREATE TABLE IF NOT EXISTS usage_daily (
+	day TEXT NOT NULL,
+	kind TEXT NOT NULL,
+	resource_id INTEGER NOT NULL,
+	user_id INTEGER NOT NULL DEFAULT 0,
+	checkouts INTEGER NOT NULL DEFAULT 0,
+	seconds_out INTEGER NOT NULL DEFAULT 0,
+	balance_delta REAL NOT NULL DEFAULT 0,
+	PRIMARY KEY (day, kind, resource_id, user_id)
+);
+
+-- Vehicles and gas cards currently out
+CREATE TABLE IF NOT EXISTS open_checkouts (
+	kind TEXT NOT NULL,
+	resource_id INTEGER NOT NULL,
+	user_id INTEGER NOT NULL DEFAULT 0,
+	taken_at INTEGER NOT NULL,
+	balance REAL,
+	PRIMARY KEY (kind, resource_id)
+);
+
+-- A code can be pooled only once (see vehicles/passwords.py)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_passwords_password ON passwords (password);
+
+-- Failed logins per `user:<address>:<name>` / `ip:<address>` key within the current
+-- window (see vehicles/ratelimit.py); `window_start` is a unix timestamp
+CREATE TABLE IF NOT EXISTS login_failures (
+	key TEXT PRIMARY KEY,
+	count INTEGER NOT NULL DEFAULT 0,
+	window_start INTEGER NOT NULL
+);
+
+-- One row per maintenance job run by `flask worker` (see vehicles/worker.py)
+CREATE TABLE IF NOT EXISTS job_runs (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	job TEXT NOT NULL,
+	started INTEGER NOT NULL,
+	duration_ms REAL NOT NULL,
+	ok INTEGER NOT NULL,
+	detail TEXT
+);
+
+-- Bookings of a vehicle, and optionally a gas card, for [starts, ends) in
+-- unix seconds; bookings of one resource never overlap (see
+-- vehicles/reservations.py)
+CREATE TABLE IF NOT EXISTS reservations (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	vehicle_id INTEGER NOT NULL,
+	gas_card_id INTEGER,
+	user_id INTEGER NOT NULL,
+	starts INTEGER NOT NULL,
+	ends INTEGER NOT NULL,
+	created INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+	FOREIGN KEY(vehicle_id) REFERENCES vehicles(id),
 	FOREIGN KEY(gas_card_id) REFERENCES gas_cards(id),
 	FOREIGN KEY(user_id) REFERENCES users(id)
 );
+
+CREATE INDEX IF NOT EXISTS idx_reservations_ends ON reservations (ends);
+CREATE INDEX IF NOT EXISTS idx_reservations_user ON reservations (user_id, ends);
+
+-- Results of applied /lock/submit requests by idempotency key, so a replayed
+-- form returns the same result (see vehicles/idempotency.py); `request`
+-- holds the form values the key was used with
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+	key TEXT PRIMARY KEY,
+	user_id INTEGER NOT NULL DEFAULT 0,
+	request TEXT NOT NULL,
+	result TEXT NOT NULL,
+	created INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created);
+
+-- Append-only log of every vehicle and gas card change: op is 'add',
+-- 'delete', 'taken' or 'returned'; key is the plate or card number and
+-- balance the gas card balance added or handed back (see vehicles/journal.py)
+CREATE TABLE IF NOT EXISTS journal (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	created INTEGER NOT NULL,
+	kind TEXT NOT NULL,
+	resource_id INTEGER NOT NULL,
+	key TEXT,
+	op TEXT NOT NULL,
+	user_id INTEGER,
+	balance REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_journal_resource ON journal (kind, resource_id, created);
+CREATE INDEX IF NOT EXISTS idx_journal_created ON journal (created);
+
+-- Full state as of journal row `journal_id`, as JSON; replays start from the
+-- latest one taken before the time asked for
+CREATE TABLE IF NOT EXISTS journal_snapshots (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	journal_id INTEGER NOT NULL,
+	created INTEGER NOT NULL,
+	state TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_journal_snapshots_created ON journal_snapshots (created);
+
+-- Trigram indexes of plates and card numbers for the home form's search
+-- (see vehicles/search.py), kept in step by the triggers below
+CREATE VIRTUAL TABLE IF NOT EXISTS vehicles_fts USING fts5(
+	plate, content='vehicles', content_rowid='id', tokenize='trigram'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS gas_cards_fts USING fts5(
+	card_number, content='gas_cards', content_rowid='id', tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS vehicles_fts_insert AFTER INSERT ON vehicles BEGIN
+	INSERT INTO vehicles_fts (rowid, plate) VALUES (new.id, new.plate);
+END;
+CREATE TRIGGER IF NOT EXISTS vehicles_fts_delete AFTER DELETE ON vehicles BEGIN
+	INSERT INTO vehicles_fts (vehicles_fts, rowid, plate) VALUES ('delete', old.id, old.plate);
+END;
+CREATE TRIGGER IF NOT EXISTS vehicles_fts_update AFTER UPDATE OF plate ON vehicles BEGIN
+	INSERT INTO vehicles_fts (vehicles_fts, rowid, plate) VALUES ('delete', old.id, old.plate);
+	INSERT INTO vehicles_fts (rowid, plate) VALUES (new.id, new.plate);
+END;
+
+CREATE TRIGGER IF NOT EXISTS gas_cards_fts_insert AFTER INSERT ON gas_cards BEGIN
+	INSERT INTO gas_cards_fts (rowid, card_number) VALUES (new.id, new.card_number);
+END;
+CREATE TRIGGER IF NOT EXISTS gas_cards_fts_delete AFTER DELETE ON gas_cards BEGIN
+	INSERT INTO gas_cards_fts (gas_cards_fts, rowid, card_number) VALUES ('delete', old.id, old.card_number);
+END;
+CREATE TRIGGER IF NOT EXISTS gas_cards_fts_update AFTER UPDATE OF card_number ON gas_cards BEGIN
+	INSERT INTO gas_cards_fts (gas_cards_fts, rowid, card_number) VALUES ('delete', old.id, old.card_number);
+	INSERT INTO gas_cards_fts (rowid, card_number) VALUES (new.id, new.card_number);
+END;
@@ -0,0 +1,203 @@
+-- PostgreSQL version of schema.sql (see vehicles/postgres.py); keep the two
+-- in step. Ids are identity columns, times unix seconds like in SQLite.
+DROP TABLE IF EXISTS vehicles CASCADE;
+DROP TABLE IF EXISTS users CASCADE;
+DROP TABLE IF EXISTS applications CASCADE;
+DROP TABLE IF EXISTS gas_cards CASCADE;
+DROP TABLE IF EXISTS passwords CASCADE;
+DROP TABLE IF EXISTS assignments CASCADE;
+-- state kept about the rows above, which start again from id 1
+DROP TABLE IF EXISTS data_versions CASCADE;
+DROP TABLE IF EXISTS status_events CASCADE;
+DROP TABLE IF EXISTS usage_daily CASCADE;
+DROP TABLE IF EXISTS open_checkouts CASCADE;
+DROP TABLE IF EXISTS login_failures CASCADE;
+DROP TABLE IF EXISTS reservations CASCADE;
+DROP TABLE IF EXISTS idempotency_keys CASCADE;
+DROP TABLE IF EXISTS journal CASCADE;
+DROP TABLE IF EXISTS journal_snapshots CASCADE;
+
+CREATE TABLE IF NOT EXISTS vehicles (
+	id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	plate TEXT UNIQUE NOT NULL,
+	status TEXT NOT NULL DEFAULT 'returned'
+);
+
+CREATE TABLE IF NOT EXISTS users (
+	id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	username TEXT UNIQUE NOT NULL,
+	password TEXT NOT NULL,
+	is_identified INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS applications (
+	id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	username TEXT NOT NULL REFERENCES users (username),
+	status TEXT NOT NULL DEFAULT 'pending',
+	created BIGINT DEFAULT (EXTRACT(EPOCH FROM now())::BIGINT)
+);
+
+CREATE TABLE IF NOT EXISTS gas_cards (
+	id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	card_number TEXT UNIQUE NOT NULL,
+	balance DOUBLE PRECISION DEFAULT 0.0,
+	status TEXT NOT NULL DEFAULT 'returned'
+);
+
+CREATE TABLE IF NOT EXISTS passwords (
+	id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	password TEXT NOT NULL
+);
+
+-- history outlives deleted vehicles and gas cards (shown as unknown), as in
+-- SQLite, which does not enforce these foreign keys
+CREATE TABLE IF NOT EXISTS record_vehicles (
+	id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	vehicle_id BIGINT NOT NULL,
+	user_id BIGINT NOT NULL REFERENCES users (id),
+	action TEXT NOT NULL,
+	timestamp BIGINT DEFAULT (EXTRACT(EPOCH FROM now())::BIGINT)
+);
+
+CREATE TABLE IF NOT EXISTS record_gas_cards (
+	id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	user_id BIGINT NOT NULL REFERENCES users (id),
+	gas_card_id BIGINT NOT NULL,
+	action TEXT NOT NULL,
+	balance DOUBLE PRECISION,
+	timestamp BIGINT DEFAULT (EXTRACT(EPOCH FROM now())::BIGINT)
+);
+
+CREATE TABLE IF NOT EXISTS record_vehicles_archive (
+	id BIGINT PRIMARY KEY,
+	vehicle_id BIGINT NOT NULL,
+	user_id BIGINT NOT NULL,
+	action TEXT NOT NULL,
+	timestamp BIGINT
+);
+
+CREATE TABLE IF NOT EXISTS record_gas_cards_archive (
+	id BIGINT PRIMARY KEY,
+	user_id BIGINT NOT NULL,
+	gas_card_id BIGINT NOT NULL,
+	action TEXT NOT NULL,
+	balance DOUBLE PRECISION,
+	timestamp BIGINT
+);
+
+CREATE INDEX IF NOT EXISTS idx_record_vehicles_vehicle ON record_vehicles (vehicle_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_vehicles_user ON record_vehicles (user_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_gas_cards_card ON record_gas_cards (gas_card_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_gas_cards_user ON record_gas_cards (user_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_vehicles_archive_vehicle ON record_vehicles_archive (vehicle_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_vehicles_archive_user ON record_vehicles_archive (user_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_gas_cards_archive_card ON record_gas_cards_archive (gas_card_id, id);
+CREATE INDEX IF NOT EXISTS idx_record_gas_cards_archive_user ON record_gas_cards_archive (user_id, id);
+CREATE INDEX IF NOT EXISTS idx_applications_username_status ON applications (username, status);
+CREATE INDEX IF NOT EXISTS idx_applications_status ON applications (status, id);
+
+CREATE TABLE IF NOT EXISTS data_versions (
+	name TEXT PRIMARY KEY,
+	version BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS status_events (
+	id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	kind TEXT NOT NULL,
+	payload TEXT NOT NULL,
+	created BIGINT NOT NULL
+);
+
+-- INTEGER, not BIGINT, so SUM() in reports returns int rather than numeric
+CREATE TABLE IF NOT EXISTS usage_daily (
+	day TEXT NOT NULL,
+	kind TEXT NOT NULL,
+	resource_id BIGINT NOT NULL,
+	user_id BIGINT NOT NULL DEFAULT 0,
+	checkouts INTEGER NOT NULL DEFAULT 0,
+	seconds_out INTEGER NOT NULL DEFAULT 0,
+	balance_delta DOUBLE PRECISION NOT NULL DEFAULT 0,
+	PRIMARY KEY (day, kind, resource_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS open_checkouts (
+	kind TEXT NOT NULL,
+	resource_id BIGINT NOT NULL,
+	user_id BIGINT NOT NULL DEFAULT 0,
+	taken_at BIGINT NOT NULL,
+	balance DOUBLE PRECISION,
+	PRIMARY KEY (kind, resource_id)
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_passwords_password ON passwords (password);
+
+CREATE TABLE IF NOT EXISTS login_failures (
+	key TEXT PRIMARY KEY,
+	count INTEGER NOT NULL DEFAULT 0,
+	window_start BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS job_runs (
+	id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	job TEXT NOT NULL,
+	started BIGINT NOT NULL,
+	duration_ms DOUBLE PRECISION NOT NULL,
+	ok INTEGER NOT NULL,
+	detail TEXT
+);
+
+CREATE TABLE IF NOT EXISTS reservations (
+	id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	vehicle_id BIGINT NOT NULL REFERENCES vehicles(id),
+	gas_card_id BIGINT REFERENCES gas_cards(id),
+	user_id BIGINT NOT NULL REFERENCES users(id),
+	starts BIGINT NOT NULL,
+	ends BIGINT NOT NULL,
+	created BIGINT DEFAULT (EXTRACT(EPOCH FROM now())::BIGINT)
+);
+
+CREATE INDEX IF NOT EXISTS idx_reservations_ends ON reservations (ends);
+CREATE INDEX IF NOT EXISTS idx_reservations_user ON reservations (user_id, ends);
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+	key TEXT PRIMARY KEY,
+	user_id BIGINT NOT NULL DEFAULT 0,
+	request TEXT NOT NULL,
+	result TEXT NOT NULL,
+	created BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created);
+
+CREATE TABLE IF NOT EXISTS journal (
+	id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	created BIGINT NOT NULL,
+	kind TEXT NOT NULL,
+	resource_id BIGINT NOT NULL,
+	key TEXT,
+	op TEXT NOT NULL,
+	user_id BIGINT,
+	balance DOUBLE PRECISION
+);
+
+CREATE INDEX IF NOT EXISTS idx_journal_resource ON journal (kind, resource_id, created);
+CREATE INDEX IF NOT EXISTS idx_journal_created ON journal (created);
+
+CREATE TABLE IF NOT EXISTS journal_snapshots (
+	id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	journal_id BIGINT NOT NULL,
+	created BIGINT NOT NULL,
+	state TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_journal_snapshots_created ON journal_snapshots (created);
+
+-- trigram indexes for the home form's substring search (vehicles/search.py)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_vehicles_plate_trgm ON vehicles USING gin (plate gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_gas_cards_card_number_trgm ON gas_cards USING gin (card_number gin_trgm_ops);
+
+-- schema version (PRAGMA user_version in SQLite, see vehicles/migrations.py)
+CREATE TABLE IF NOT EXISTS schema_version (
+	version INTEGER NOT NULL
+);
@@ -0,0 +1,92 @@
+"""Plate and gas card number search for the home form's autocomplete.
+
+Substring queries of three or more characters go through a trigram index:
+the FTS5 tables ``vehicles_fts`` and ``gas_cards_fts`` (``tokenize =
+'trigram'``, SQLite 3.34+), external-content tables kept in step with
+``vehicles`` and ``gas_cards`` by triggers, or a ``pg_trgm`` GIN index
+on PostgreSQL. Shorter queries are prefix range scans on the unique
+key. Either way a lookup reads the top matches only, so its cost does
+not grow with the fleet.
+
+Matches starting with the query come first, then by key.
+"""
+from vehicles.db import backend
+
+
+KINDS = {
+    'vehicle': {
+        'table': 'vehicles',
+        'fts': 'vehicles_fts',
+        'key': 'plate',
+        'columns': ('id', 'plate', 'status'),
+    },
+    'gas_card': {
+        'table': 'gas_cards',
+        'fts': 'gas_cards_fts',
+        'key': 'card_number',
+        'columns': ('id', 'card_number', 'balance', 'status'),
+    },
+}
+STATUSES = ('taken', 'returned')
+
+# trigram indexes only help with queries at least this long
+MIN_TRIGRAM = 3
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search(db, kind, q, limit, status=None):
+    """Return up to ``limit`` rows of ``kind`` matching ``q``, optionally only
+    those with ``status``.
+
+    A ``q`` of ``MIN_TRIGRAM`` or more characters matches keys that contain
+    it, case-insensitively. On SQLite a shorter ``q`` only matches keys that
+    start with it, as typed or upper-cased; PostgreSQL matches substrings
+    of any length.
+    """
+    spec = KINDS[kind]
+    table, key = spec['table'], spec['key']
+    columns = ', '.join(f't.{c}' for c in spec['columns'])
+    q = (q or '').strip()
+    clauses, params = [], []
+    if status is not None:
+        clauses.append('t.status = ?')
+        params.append(status)
+
+    if not q:
+        source, order, order_params = f'{table} t', f't.{key}', []
+    elif backend(db) == 'postgres':
+        source = f'{table} t'
+        clauses.append(f"t.{key} ILIKE ? ESCAPE '\\'")
+        params.append(f'%{_escape_like(q)}%')
+        order, order_params = f'strpos(lower(t.{key}), lower(?)), t.{key}', [q]
+    elif len(q) >= MIN_TRIGRAM:
+        source = f'{spec["fts"]} JOIN {table} t ON t.id = {spec["fts"]}.rowid'
+        # one quoted phrase: every trigram of q, in order
+        clauses.append(f'{spec["fts"]} MATCH ?')
+        params.append('"' + q.replace('"', '""') + '"')
+        order, order_params = f'instr(lower(t.{key}), lower(?)), t.{key}', [q]
+    else:
+        # too short for trigrams: prefix ranges on the unique index, as
+        # typed and upper-cased (plates and card numbers are upper case)
+        source = f'{table} t'
+        ranges = []
+        for prefix in dict.fromkeys((q, q.upper())):
+            ranges.append(f't.{key} >= ? AND t.{key} < ?')
+            params.extend((prefix, prefix + '\U0010ffff'))
+        clauses.append('(' + ' OR '.join(ranges) + ')')
+        order, order_params = f't.{key}', []
+
+    where = f'WHERE {" AND ".join(clauses)} ' if clauses else ''
+    return db.execute(
+        f'SELECT {columns} FROM {source} {where}ORDER BY {order} LIMIT ?',
+        params + order_params + [int(limit)]
+    ).fetchall()
+
+
+def rebuild(db):
+    """Rebuild the FTS5 indexes from their tables (SQLite only)."""
+    for spec in KINDS.values():
+        db.execute(f"INSERT INTO {spec['fts']} ({spec['fts']}) VALUES ('rebuild')")
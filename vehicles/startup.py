@@ -0,0 +1,115 @@
+"""Startup helpers: one-shot secret resolution and the startup profile CLI.
+
+``create_app`` is safe to run once in a gunicorn master with ``--preload``:
+it opens no database connections and starts no threads or processes.
+Connection pools, the events broker thread and the hashing process pool
+are all created on first use in each worker and notice when they have been
+inherited across a fork.
+"""
+import json
+import os
+import secrets
+import subprocess
+import sys
+import time
+import click
+from flask.cli import with_appcontext
+from flask import current_app
+
+
+class PhaseTimer:
+    """Records how long each step of the app factory takes."""
+
+    def __init__(self):
+        self.phases = []
+        self._last = time.perf_counter()
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+
+def resolve_secret_key(app):
+    """Set ``SECRET_KEY`` once, in order of preference: app config
+    (``config.py`` or test config), the ``SECRET_KEY`` environment variable,
+    ``instance/secret_key``, or a new random key persisted to that file."""
+    if app.config.get('SECRET_KEY'):
+        return
+    if os.environ.get('SECRET_KEY'):
+        app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
+        return
+    path = os.path.join(app.instance_path, 'secret_key')
+    key = secrets.token_hex(32).encode()
+    try:
+        # O_EXCL: when several workers start without --preload, the first one
+        # to create the file wins and the others read its key
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'rb') as f:
+            existing = f.read().strip()
+        if existing:
+            app.config['SECRET_KEY'] = existing
+            return
+    except OSError:
+        # read-only instance folder: sessions last until the next restart
+        app.logger.warning('cannot persist %s; using a temporary secret key', path)
+    else:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key)
+    app.config['SECRET_KEY'] = key
+
+
+PROFILE_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+from vehicles import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+json.dump({"import": imported - start, "factory": created - imported,
+           "phases": app.extensions["startup"]}, sys.stdout)
+'''
+
+
+def _parse_importtime(stderr, prefix):
+    """Return ``(cumulative_us, module)`` for modules whose name starts with
+    ``prefix`` from ``python -X importtime`` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        try:
+            _, cumulative, name = line.split('|')
+            cumulative = int(cumulative)
+        except ValueError:
+            continue
+        name = name.strip()
+        if name.startswith(prefix):
+            rows.append((cumulative, name))
+    return sorted(rows, reverse=True)
+
+
+@click.command('startup-profile')
+@click.option('--top', default=15, show_default=True, help='Number of modules to list.')
+@click.option('--prefix', default='', help='Only list modules starting with this, e.g. "vehicles".')
+@with_appcontext
+def startup_profile_command(top, prefix):
+    """Measure import and app factory time in a fresh interpreter."""
+    env = dict(os.environ)
+    root = os.path.dirname(current_app.root_path)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROFILE_SCRIPT],
+        capture_output=True, text=True, env=env, cwd=root,
+    )
+    if result.returncode != 0:
+        raise click.ClickException(result.stderr.strip().splitlines()[-1])
+    timings = json.loads(result.stdout)
+    click.echo(f'import vehicles  {timings["import"] * 1000:8.1f} ms')
+    click.echo(f'create_app()     {timings["factory"] * 1000:8.1f} ms')
+    for name, seconds in timings['phases']:
+        click.echo(f'  {name:<16}{seconds * 1000:8.1f} ms')
+    click.echo('slowest imports (cumulative):')
+    for cumulative, name in _parse_importtime(result.stderr, prefix)[:top]:
+        click.echo(f'  {cumulative / 1000:8.1f} ms  {name}')
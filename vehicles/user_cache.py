@@ -0,0 +1,80 @@
+"""Per-worker LRU cache of logged-in user rows.
+
+``auth.load_logged_in_user`` runs before every request; with this cache a
+returning user costs no query at all until the entry expires. Only the
+columns the views need are cached (never the password hash).
+
+Entries are dropped explicitly when ``is_identified`` changes in this
+worker; changes made by another worker become visible after at most
+``USER_CACHE_TTL`` seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from vehicles.db import get_db
+from vehicles import users
+
+
+class UserCache:
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires, user = entry
+            if expires < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def put(self, row):
+        user = {'id': row['id'], 'username': row['username'], 'is_identified': row['is_identified']}
+        with self._lock:
+            self._entries[user['id']] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user['id'])
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id=None, username=None):
+        with self._lock:
+            if user_id is not None:
+                self._entries.pop(user_id, None)
+            if username is not None:
+                for key, (_, user) in list(self._entries.items()):
+                    if user['username'] == username:
+                        del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def load_user(user_id):
+    """Return the cached user dict for ``user_id``, loading it on a miss."""
+    cache = current_app.extensions['user_cache']
+    user = cache.get(user_id)
+    if user is None:
+        row = users.get(get_db(), user_id)
+        if row is not None:
+            user = cache.put(row)
+    return user
+
+
+def invalidate(user_id=None, username=None):
+    current_app.extensions['user_cache'].invalidate(user_id=user_id, username=username)
+
+
+def init_user_cache(app):
+    app.extensions['user_cache'] = UserCache(
+        maxsize=int(app.config['USER_CACHE_SIZE']),
+        ttl=float(app.config['USER_CACHE_TTL']),
+    )
@@ -0,0 +1,30 @@
+"""User accounts.
+
+``is_identified`` is 0 for new users, 2 while an identification
+application is pending, 1 once approved and 3 when rejected (see
+vehicles/audit.py). Callers commit, and call ``user_cache.invalidate``
+after changing a user that may be cached.
+"""
+
+
+def get(db, user_id):
+    return db.execute('SELECT id, username, is_identified FROM users WHERE id = ?', (user_id,)).fetchone()
+
+
+def by_username(db, username):
+    return db.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+
+
+def create(db, username, password_hash):
+    """Insert a user. Returns its id; raises ``db.IntegrityError`` when the
+    username is taken."""
+    return db.execute(
+        'INSERT INTO users (username, password) VALUES (?, ?)', (username, password_hash)
+    ).lastrowid
+
+
+def replace_password(db, user_id, old_hash, new_hash):
+    """Store ``new_hash`` unless the password changed since ``old_hash`` was read."""
+    db.execute(
+        'UPDATE users SET password = ? WHERE id = ? AND password = ?', (new_hash, user_id, old_hash)
+    )
@@ -0,0 +1,247 @@
+"""Periodic maintenance off the request path.
+
+``flask worker run`` is a long-running process (the ``worker`` service in
+docker-compose) that runs the jobs in :data:`JOBS` on their intervals:
+
+* ``prune``: move old history to the archive tables and trim
+  ``status_events``, expired ``login_failures`` and ``idempotency_keys``,
+  ended ``reservations`` and ``job_runs``.
+* ``refill_passwords``: top up the password pool (see vehicles/passwords.py).
+* ``optimize``: ``PRAGMA optimize``, which refreshes planner statistics.
+* ``checkpoint``: fold the WAL back into the database file.
+* ``vacuum``: return free pages to the filesystem with
+  ``PRAGMA incremental_vacuum``. The first run switches the database to
+  incremental auto-vacuum, which needs one full ``VACUUM``.
+* ``snapshot``: store a journal snapshot once ``JOURNAL_SNAPSHOT_EVERY``
+  changes have accumulated and drop all but the first and the newest
+  ``JOURNAL_SNAPSHOTS_KEEP`` (see vehicles/journal.py).
+* ``backup``: an online copy made with ``sqlite3.Connection.backup``,
+  written to ``BACKUP_DIR``; the newest ``BACKUP_KEEP`` copies are kept.
+
+Each run is recorded in ``job_runs`` with its duration and outcome, and the
+schedule continues from there after a restart. An exclusive lock on
+``instance/worker.lock`` makes sure only one worker runs per instance.
+
+With PostgreSQL (see vehicles/postgres.py) ``optimize`` runs ``ANALYZE`` and
+the SQLite-specific jobs are skipped. Run one worker per database, not one
+per web node.
+
+While requests still prune inline (``MAINTENANCE_INLINE``, on by default),
+the ``prune`` job only catches up. Set it to False when the worker runs.
+"""
+import fcntl
+import os
+import signal
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from vehicles.db import backend, get_db, run_immediate
+from vehicles import history, idempotency, journal, localtime, passwords, reservations
+
+
+def prune(db):
+    config = current_app.config
+    moved = 0
+    for table in history.TABLES:
+        moved += history.prune(db, table, int(config['HISTORY_RETENTION']), config['HISTORY_ARCHIVE'])
+    newest = db.execute('SELECT MAX(id) FROM status_events').fetchone()[0] or 0
+    events = db.execute(
+        'DELETE FROM status_events WHERE id <= ?', (newest - int(config['EVENTS_RETENTION']),)
+    ).rowcount
+    failures = db.execute(
+        'DELETE FROM login_failures WHERE window_start + ? <= ?',
+        (int(config['LOGIN_FAILURE_WINDOW']), int(time.time()))
+    ).rowcount
+    bookings = reservations.prune(db, config['RESERVATION_RETENTION_DAYS'])
+    keys = idempotency.prune(db, int(config['IDEMPOTENCY_TTL']))
+    newest = db.execute('SELECT MAX(id) FROM job_runs').fetchone()[0] or 0
+    db.execute('DELETE FROM job_runs WHERE id <= ?', (newest - int(config['WORKER_RUNS_RETENTION']),))
+    return f'{moved} history rows, {events} events, {failures} login failures, {keys} idempotency keys, {bookings} reservations'
+
+
+def refill_passwords(db):
+    config = current_app.config
+    low = int(config['PASSWORD_POOL_LOW_WATERMARK'])
+    if low <= 0:
+        return 'disabled'
+    return f'{passwords.refill(db, low, int(config["PASSWORD_POOL_TARGET"]))} added'
+
+
+def snapshot(db):
+    config = current_app.config
+    journal_id = journal.snapshot(db, int(config['JOURNAL_SNAPSHOT_EVERY']))
+    dropped = journal.prune_snapshots(db, config['JOURNAL_SNAPSHOTS_KEEP'])
+    taken = 'skipped' if journal_id is None else f'at journal id {journal_id}'
+    return f'{taken}, {dropped} old snapshots dropped'
+
+
+def optimize(db):
+    if backend(db) == 'postgres':
+        db.execute('ANALYZE')
+        return ''
+    db.execute('PRAGMA optimize')
+    return ''
+
+
+def checkpoint(db):
+    if backend(db) == 'postgres':
+        return 'skipped: the server checkpoints itself'
+    busy, frames, done = db.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    # busy: a reader kept part of the WAL in use; the next run finishes it
+    return f'{done}/{frames} frames{" (busy)" if busy else ""}'
+
+
+def vacuum(db):
+    if backend(db) == 'postgres':
+        return 'skipped: left to autovacuum'
+    if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        db.execute('VACUUM')
+        return 'switched to incremental auto-vacuum'
+    free = db.execute('PRAGMA freelist_count').fetchone()[0]
+    db.execute('PRAGMA incremental_vacuum').fetchall()
+    return f'{free} pages freed'
+
+
+def backup(db):
+    if backend(db) == 'postgres':
+        return 'skipped: back up the server with pg_dump'
+    config = current_app.config
+    directory = config['BACKUP_DIR'] or os.path.join(current_app.instance_path, 'backups')
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(directory, f'vehicles-{stamp}.sqlite')
+    partial = path + '.partial'
+    target = sqlite3.connect(partial)
+    try:
+        db.backup(target)
+    finally:
+        target.close()
+    os.replace(partial, path)
+    copies = sorted(name for name in os.listdir(directory)
+                    if name.startswith('vehicles-') and name.endswith('.sqlite'))
+    for name in copies[:-max(int(config['BACKUP_KEEP']), 1)]:
+        os.remove(os.path.join(directory, name))
+    return os.path.basename(path)
+
+
+# name -> (function, config key of its interval in seconds, runs in a write transaction)
+JOBS = {
+    'prune': (prune, 'WORKER_PRUNE_INTERVAL', True),
+    'refill_passwords': (refill_passwords, 'WORKER_PRUNE_INTERVAL', True),
+    'snapshot': (snapshot, 'WORKER_SNAPSHOT_INTERVAL', True),
+    'optimize': (optimize, 'WORKER_OPTIMIZE_INTERVAL', False),
+    'checkpoint': (checkpoint, 'WORKER_CHECKPOINT_INTERVAL', False),
+    'vacuum': (vacuum, 'WORKER_VACUUM_INTERVAL', False),
+    'backup': (backup, 'WORKER_BACKUP_INTERVAL', False),
+}
+
+
+def run_job(db, name):
+    """Run one job and record it in ``job_runs``. Returns True on success."""
+    func, _, transactional = JOBS[name]
+    started = time.time()
+    try:
+        if transactional:
+            detail = run_immediate(db, func)
+        else:
+            if db.in_transaction:
+                db.commit()
+            detail = func(db)
+        ok = True
+    except Exception as e:
+        current_app.logger.exception('job %s failed', name)
+        if db.in_transaction:
+            db.rollback()
+        detail, ok = f'{type(e).__name__}: {e}', False
+    duration = time.time() - started
+    run_immediate(db, lambda db: db.execute(
+        'INSERT INTO job_runs (job, started, duration_ms, ok, detail) VALUES (?, ?, ?, ?, ?)',
+        (name, int(started), round(duration * 1000, 1), int(ok), detail)
+    ))
+    current_app.logger.info('job %s %s in %.0f ms: %s', name, 'ok' if ok else 'failed', duration * 1000, detail)
+    return ok
+
+
+def last_runs(db):
+    """Latest run of every job that has run, keyed by job name."""
+    return {row['job']: row for row in db.execute(
+        'SELECT j.* FROM job_runs j JOIN (SELECT job, MAX(id) AS id FROM job_runs GROUP BY job) l ON j.id = l.id'
+    )}
+
+
+def _intervals(names):
+    config = current_app.config
+    return {name: float(config[JOBS[name][1]]) for name in names if float(config[JOBS[name][1]]) > 0}
+
+
+def _acquire_lock():
+    path = os.path.join(current_app.instance_path, 'worker.lock')
+    handle = open(path, 'w')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        raise click.ClickException(f'another worker holds {path}')
+    return handle
+
+
+worker_cli = AppGroup('worker', help='Run periodic database maintenance.')
+
+
+@worker_cli.command('run')
+@click.option('--once', is_flag=True, help='Run the selected jobs once and exit.')
+@click.option('--job', 'names', multiple=True, type=click.Choice(sorted(JOBS)),
+              help='Only run this job (repeatable).')
+def run_command(once, names):
+    """Run maintenance jobs on their intervals until stopped."""
+    names = names or tuple(JOBS)
+    lock = _acquire_lock()
+    db = get_db()
+    if once:
+        failed = [name for name in names if not run_job(db, name)]
+        lock.close()
+        if failed:
+            raise click.ClickException(f'failed: {", ".join(failed)}')
+        return
+
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+    intervals = _intervals(names)
+    last = last_runs(db)
+    # continue the schedule of the previous worker instead of rerunning everything
+    due = {name: (last[name]['started'] + interval if name in last else 0)
+           for name, interval in intervals.items()}
+    click.echo(f'Worker running: {", ".join(f"{n} every {intervals[n]:g}s" for n in intervals)}')
+    while intervals and not stop.is_set():
+        now = time.time()
+        for name in intervals:
+            if due[name] <= now and not stop.is_set():
+                run_job(db, name)
+                due[name] = time.time() + intervals[name]
+        stop.wait(max(min(due.values()) - time.time(), 0.1))
+    lock.close()
+
+
+@worker_cli.command('status')
+def status_command():
+    """Show the latest run of every job."""
+    runs = last_runs(get_db())
+    intervals = _intervals(JOBS)
+    for name in JOBS:
+        row = runs.get(name)
+        every = f'every {intervals[name]:g}s' if name in intervals else 'disabled'
+        if row is None:
+            click.echo(f'{name:<17} {every:<14} never run')
+            continue
+        click.echo(f'{name:<17} {every:<14} {localtime.format_local(row["started"])}  {"ok" if row["ok"] else "FAILED"}  '
+                   f'{row["duration_ms"]:.0f} ms  {row["detail"] or ""}')
+
+
+def init_worker(app):
+    app.cli.add_command(worker_cli)